@@ -0,0 +1,239 @@
+"""
+Журнал событий воронки набора и счётчики для /stats.
+
+События (открыл вакансию, открыл анкету роли, получил тест, написал
+кураторам, прислал файл) только дописываются в файл: запись — 14 байт
+struct <IqBB (unix-время, user_id, код роли, тип события). Как и индекс
+сообщений, record() лишь кладёт запись в буфер, а на диск пачку пишет
+flush() из отдельного потока.
+
+Воронка считается по когортам: пользователь попадает в когорту дня, когда
+впервые сделал любой шаг по роли, а дальше отмечается, до каких шагов он
+дошёл, когда бы это ни случилось. Поэтому в отчёте за период все шаги —
+про одних и тех же людей, и доля от пришедших не бывает больше 100%.
+
+Состояние — по записи на (пользователь, роль) и счётчики по когортам.
+Когорты старше retention_days забываются вместе с их пользователями,
+а журнал при старте и раз в сутки переписывается заново: по записи на
+каждый достигнутый шаг живых пользователей. Так ни память, ни время
+чтения журнала не растут с числом событий.
+"""
+import asyncio
+import os
+import struct
+import threading
+from enum import IntEnum
+from time import time
+
+from logs import get_logger
+
+log = get_logger("analytics")
+
+_MAGIC = b"KTEVENT1"
+_RECORD = struct.Struct("<IqBB")
+
+DAY = 86400
+
+# раз в сколько секунд выкидывать старые когорты и сжимать журнал
+_COMPACT_EVERY_SEC = DAY
+
+
+class Event(IntEnum):
+    VACANCY = 1  # открыл описание вакансии
+    APPLY = 2    # открыл анкету роли
+    TEST = 3     # получил тестовое
+    MESSAGE = 4  # написал кураторам
+    FILE = 5     # прислал кураторам вложение
+
+
+def _user_key(user_id: int, role: int) -> int:
+    # int вместо кортежа: на десятки тысяч пользователей это втрое меньше памяти
+    return (user_id << 5) | role
+
+
+class EventLog:
+    def __init__(self, path: str | None, *, retention_days: int):
+        """path=None — только счётчики в памяти, без файла."""
+        self.path = path or None
+        self.retention_days = retention_days
+        self.events = 0
+        # _user_key -> (день когорты << 8) | битовая маска достигнутых шагов
+        self._users: dict[int, int] = {}
+        # (день когорты, роль) -> [пришло, дошли до Event 1..5]
+        self._cohorts: dict[tuple[int, int], list[int]] = {}
+        self._pending: list[bytes] = []
+        self._write_lock = threading.Lock()
+        if self.path:
+            self._load()
+            self._compact()
+
+    def _horizon(self, now: float | None = None) -> int:
+        return int(time() if now is None else now) // DAY - self.retention_days
+
+    # ---- чтение журнала ----
+
+    def _rotate_aside(self, reason: str) -> None:
+        aside = f"{self.path}.bad-{int(time())}"
+        log.error("Event log is unreadable (%s), moving it to %s and starting empty", reason, aside)
+        try:
+            os.replace(self.path, aside)
+        except OSError as e:
+            log.error("Could not move the event log aside, analytics will stay in memory: %s", e)
+            self.path = None
+
+    def _load(self) -> None:
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            self._rotate_aside(str(e))
+            return
+        if not data:
+            return
+        if data[:len(_MAGIC)] != _MAGIC:
+            self._rotate_aside("bad header")
+            return
+
+        body = memoryview(data)[len(_MAGIC):]
+        usable = len(body) - len(body) % _RECORD.size
+        if usable != len(body):
+            # запись оборвалась на середине (процесс убили) — хвост пропадёт при сжатии ниже
+            log.warning("Event log has a truncated record, dropping it", extra={"bytes": len(body) - usable})
+        horizon = self._horizon()
+        for ts, user_id, role, event in _RECORD.iter_unpack(body[:usable]):
+            self._count(ts, user_id, role, event, horizon)
+        log.info("Event log loaded", extra={"events": self.events, "users": len(self._users)})
+
+    def _count(self, ts: int, user_id: int, role: int, event: int, horizon: int) -> None:
+        self.events += 1
+        key = _user_key(user_id, role)
+        state = self._users.get(key)
+        if state is None:
+            day = ts // DAY
+            if day < horizon:
+                return
+            cohort = self._cohorts.get((day, role))
+            if cohort is None:
+                cohort = self._cohorts[(day, role)] = [0] * (len(Event) + 1)
+            cohort[0] += 1
+            state = day << 8
+        bit = 1 << event
+        if state & bit:
+            return
+        self._users[key] = state | bit
+        self._cohorts[(state >> 8, role)][event] += 1
+
+    def record(self, event: Event, user_id: int, role: int = 0, ts: float | None = None) -> None:
+        ts = int(time() if ts is None else ts)
+        self._count(ts, user_id, role, event, self._horizon(ts))
+        if self.path:
+            self._pending.append(_RECORD.pack(ts, user_id, role, event))
+
+    # ---- обслуживание ----
+
+    def prune(self, now: float | None = None) -> int:
+        """Забывает когорты старше retention_days; возвращает, сколько пользователей выкинуто."""
+        horizon = self._horizon(now)
+        old = [key for key, state in self._users.items() if state >> 8 < horizon]
+        for key in old:
+            del self._users[key]
+        for day_role in [k for k in self._cohorts if k[0] < horizon]:
+            del self._cohorts[day_role]
+        return len(old)
+
+    def _snapshot(self) -> bytes:
+        """Журнал, из которого получится ровно текущее состояние."""
+        out = [_MAGIC]
+        for key, state in self._users.items():
+            ts = (state >> 8) * DAY
+            user_id, role = key >> 5, key & 0x1F
+            for event in Event:
+                if state & (1 << event):
+                    out.append(_RECORD.pack(ts, user_id, role, event))
+        return b"".join(out)
+
+    def _start_compaction(self) -> tuple[bytes, list[bytes]]:
+        """Выкидывает старое и снимает состояние; буфер входит в снимок и отдаётся на случай ошибки."""
+        self.prune()
+        chunks, self._pending = self._pending, []
+        return self._snapshot(), chunks
+
+    def _replace(self, data: bytes) -> bool:
+        tmp = f"{self.path}.tmp"
+        try:
+            with self._write_lock:
+                with open(tmp, "wb") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning("Event log compaction failed: %s", e)
+            return False
+        self.events = (len(data) - len(_MAGIC)) // _RECORD.size
+        return True
+
+    def _compact(self) -> None:
+        data, chunks = self._start_compaction()
+        if not self._replace(data):
+            self._pending[:0] = chunks
+
+    # ---- запись на диск ----
+
+    def _write(self, chunks: list[bytes]) -> None:
+        with self._write_lock:
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(_MAGIC)
+                f.write(b"".join(chunks))
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        chunks, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, chunks)
+        except Exception as e:
+            log.warning("Event log write failed, will retry: %s", e, extra={"events": len(chunks)})
+            self._pending[:0] = chunks
+
+    async def run(self, interval: float) -> None:
+        last_compact = time()
+        while True:
+            await asyncio.sleep(interval)
+            if time() - last_compact < _COMPACT_EVERY_SEC:
+                await self.flush()
+                continue
+            last_compact = time()
+            if not self.path:
+                self.prune()
+                continue
+            # снимок снимаем здесь, в потоке только пишем: record() меняет состояние из event loop
+            data, chunks = self._start_compaction()
+            if not await asyncio.to_thread(self._replace, data):
+                self._pending[:0] = chunks
+
+    def close(self) -> None:
+        if self._pending:
+            chunks, self._pending = self._pending, []
+            self._write(chunks)
+
+    # ---- отчёт ----
+
+    def funnel(self, since: float, until: float | None = None) -> dict[int, tuple[int, dict[Event, int]]]:
+        """
+        Код роли -> (сколько пришло, {шаг: сколько из них до него дошли}) для
+        когорт, чей первый шаг пришёлся на период (по дням, UTC).
+        """
+        first, last = int(since) // DAY, int(time() if until is None else until) // DAY
+        out: dict[int, tuple[int, dict[Event, int]]] = {}
+        for (day, role), cohort in self._cohorts.items():
+            if not first <= day <= last:
+                continue
+            entered, steps = out.get(role, (0, dict.fromkeys(Event, 0)))
+            for event in Event:
+                steps[event] += cohort[event]
+            out[role] = (entered + cohort[0], steps)
+        return out
@@ -0,0 +1,83 @@
+"""
+Сборка «пачек» из сообщений, приходящих по одному.
+
+IdleBatcher копит элементы по ключу и отдаёт их колбэку одной пачкой,
+когда по этому ключу idle секунд ничего не приходило или набралось
+max_items элементов. Таймер — loop.call_later, без отдельной задачи
+на каждый ключ.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+from logs import get_logger
+
+log = get_logger("batching")
+
+
+class _Pending:
+    __slots__ = ("items", "timer")
+
+    def __init__(self):
+        self.items: list = []
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class IdleBatcher:
+    def __init__(
+        self,
+        on_flush: Callable[[Hashable, list], Awaitable[Any]],
+        *,
+        idle: float,
+        max_items: int | None = None,
+    ):
+        self.on_flush = on_flush
+        self.idle = idle
+        self.max_items = max_items
+        self._pending: dict[Hashable, _Pending] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return sum(len(p.items) for p in self._pending.values())
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._pending
+
+    def add(self, key: Hashable, item) -> None:
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _Pending()
+        pending.items.append(item)
+        if pending.timer:
+            pending.timer.cancel()
+        if self.max_items and len(pending.items) >= self.max_items:
+            self._fire(key)
+        else:
+            pending.timer = asyncio.get_running_loop().call_later(self.idle, self._fire, key)
+
+    def flush(self, key: Hashable) -> asyncio.Task | None:
+        """Отдать накопленное по ключу, не дожидаясь таймера; задачу можно дождаться."""
+        return self._fire(key)
+
+    def _fire(self, key: Hashable) -> asyncio.Task | None:
+        pending = self._pending.pop(key, None)
+        if not pending or not pending.items:
+            return None
+        if pending.timer:
+            pending.timer.cancel()
+        task = asyncio.create_task(self._run(key, pending.items))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _run(self, key: Hashable, items: list) -> None:
+        try:
+            await self.on_flush(key, items)
+        except Exception as e:
+            log.exception("Batch flush failed: %s", e)
+
+    async def flush_all(self) -> None:
+        """Отдать всё накопленное сейчас же и дождаться колбэков (для остановки)."""
+        for key in list(self._pending):
+            self._fire(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -0,0 +1,242 @@
+"""
+Нагрузочный прогон бота без настоящего Telegram.
+
+    python bench/bench_bot.py --users 500 --concurrency 50 --latency-ms 30 --flood-rate 0.01
+
+Поднимает заглушку Bot API (bench/fake_telegram.py), импортирует настоящий
+bot.py — с его dp и хендлерами — и прогоняет через него синтетических
+кандидатов: /start → кнопки → выдача теста → сообщения в ЛС (текст и фото)
+→ свайп-ответ куратора в группе. В конце печатает p50/p99 по шагам,
+пропускную способность, число вызовов API и RSS процесса.
+
+--polling — апдейты идут через getUpdates заглушки (как в проде),
+иначе скармливаются прямо в dp.feed_update.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import resource
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+GROUP_ID = -1001234567890
+ADMIN_ID = 1
+FIRST_USER_ID = 10_000_000
+
+_update_ids = itertools.count(1)
+
+
+def _env(args) -> None:
+    """Настраиваем bot.py до импорта: конфиг читается на уровне модуля."""
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHBENCHBENCHBENCHBENCHBENCHBENCH")
+    os.environ["GROUP_ID"] = str(GROUP_ID)
+    os.environ["ADMIN_IDS"] = str(ADMIN_ID)
+    os.environ["STORAGE_BACKEND"] = args.storage
+    os.environ["STORAGE_PATH"] = args.storage_path
+    os.environ.setdefault("THREAD_TRANSLATOR_ID", "11")
+    os.environ.setdefault("THREAD_EDITOR_ID", "12")
+    if not args.real_limits:
+        # меряем сам бот, а не лимиты Telegram
+        os.environ["OUTBOX_GLOBAL_RATE"] = "1000000"
+        os.environ["OUTBOX_GROUP_PER_MIN"] = "60000000"
+        os.environ["OUTBOX_PRIVATE_RATE"] = "1000000"
+
+# ============ UPDATES ============
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": "Кандидат", "username": f"cand{uid}"}
+
+
+def _private_chat(uid: int) -> dict:
+    return {"id": uid, "type": "private", "first_name": "Кандидат", "username": f"cand{uid}"}
+
+
+def message_update(uid: int, text: str | None = None, *, photo: bool = False, caption: str | None = None) -> dict:
+    msg = {"message_id": next(_update_ids), "date": int(time.time()), "chat": _private_chat(uid), "from": _user(uid)}
+    if text is not None:
+        msg["text"] = text
+    if photo:
+        msg["photo"] = [{"file_id": f"photo-{uid}", "file_unique_id": f"u{uid}", "width": 800, "height": 1200}]
+        if caption:
+            msg["caption"] = caption
+    return {"update_id": next(_update_ids), "message": msg}
+
+
+def callback_update(uid: int, data: str) -> dict:
+    return {
+        "update_id": next(_update_ids),
+        "callback_query": {
+            "id": str(next(_update_ids)),
+            "from": _user(uid),
+            "chat_instance": str(uid),
+            "data": data,
+            "message": {"message_id": 1, "date": int(time.time()), "chat": _private_chat(uid), "text": "screen"},
+        },
+    }
+
+
+def swipe_update(group_msg_id: int, group_text: str, text: str) -> dict:
+    group = {"id": GROUP_ID, "type": "supergroup", "title": "bench", "is_forum": True}
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": group,
+            "from": {"id": ADMIN_ID, "is_bot": False, "first_name": "Куратор"},
+            "text": text,
+            "reply_to_message": {
+                "message_id": group_msg_id, "date": int(time.time()), "chat": group,
+                "from": {"id": 42, "is_bot": True, "first_name": "Bench"}, "text": group_text,
+            },
+        },
+    }
+
+# ============ RUNNER ============
+
+
+class Runner:
+    def __init__(self, bot_module, fake, *, polling: bool, timeout: float = 30.0):
+        self.botmod = bot_module
+        self.fake = fake
+        self.polling = polling
+        # апдейт, который не обработан за timeout секунд, считаем ошибкой, а не ждём вечно
+        self.timeout = timeout
+        self.timeouts = 0
+        self.latencies: dict[str, list[float]] = {}
+        self.errors = 0
+        self._waiters: dict[int, tuple[str, float, asyncio.Future]] = {}
+        bot_module.dp.update.outer_middleware(self._record)
+
+    async def _record(self, handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            waiter = self._waiters.pop(event.update_id, None)
+            if waiter:
+                step, t0, fut = waiter
+                self.latencies.setdefault(step, []).append(time.perf_counter() - t0)
+                if not fut.done():
+                    fut.set_result(None)
+
+    async def submit(self, step: str, update: dict) -> None:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[update["update_id"]] = (step, time.perf_counter(), fut)
+        if self.polling:
+            self.fake.push_update(update)
+        else:
+            asyncio.create_task(self._feed(update, fut))
+        try:
+            await asyncio.wait_for(fut, self.timeout)
+        except asyncio.TimeoutError:
+            self._waiters.pop(update["update_id"], None)
+            self.errors += 1
+            self.timeouts += 1
+
+    async def _feed(self, update: dict, fut: asyncio.Future) -> None:
+        try:
+            await self.botmod.dp.feed_raw_update(self.botmod.bot, update)
+        except Exception:
+            self.errors += 1
+        finally:
+            if not fut.done():
+                self._waiters.pop(update["update_id"], None)
+                fut.set_result(None)
+
+    async def candidate(self, uid: int) -> None:
+        await self.submit("start", message_update(uid, "/start"))
+        for data in ("about", "vacancies", "v:editor", "apply", "a:translator"):
+            await self.submit("callback", callback_update(uid, data))
+        await self.submit("starttest", callback_update(uid, "starttest:translator"))
+        await self.submit("dm_text", message_update(uid, "1. Имя: Лис\n2. Ник: kitsune\n4. 10 часов в неделю"))
+        await self.submit("dm_photo", message_update(uid, photo=True, caption="тестовое"))
+
+        found = self.fake.find_sent(GROUP_ID, f"id {uid}")
+        if found:
+            await self.submit("swipe", swipe_update(found[0], found[1], "Спасибо, посмотрим!"))
+
+
+def _pct(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p * len(values)))] * 1000 if values else 0.0
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        return 0.0
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="задержка ответа заглушки")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--polling", action="store_true", help="гнать апдейты через getUpdates")
+    parser.add_argument("--real-limits", action="store_true", help="оставить лимиты outbox как в проде")
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--storage-path", default="/tmp/kitsune-bench.sqlite3")
+    parser.add_argument("--timeout", type=float, default=30.0, help="сколько ждать обработки одного апдейта")
+    args = parser.parse_args()
+
+    _env(args)
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from fake_telegram import FakeTelegram
+
+    fake = FakeTelegram(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, flood_rate=args.flood_rate)
+    url = await fake.start()
+
+    import bot as botmod
+    botmod.bot.session.api = TelegramAPIServer.from_base(url)
+
+    runner = Runner(botmod, fake, polling=args.polling, timeout=args.timeout)
+    polling_task = None
+    if args.polling:
+        polling_task = asyncio.create_task(
+            botmod.dp.start_polling(botmod.bot, handle_signals=False, polling_timeout=1, close_bot_session=False)
+        )
+
+    rss_before = _rss_mb()
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def one(uid: int) -> None:
+        async with slots:
+            await runner.candidate(uid)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one(FIRST_USER_ID + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - t0
+
+    if polling_task:
+        await botmod.dp.stop_polling()
+        await polling_task
+    await fake.stop()
+    await botmod.bot.session.close()
+
+    total = sum(len(v) for v in runner.latencies.values())
+    print(f"users={args.users} concurrency={args.concurrency} latency={args.latency_ms}±{args.jitter_ms}ms "
+          f"flood={args.flood_rate} mode={'polling' if args.polling else 'feed'} storage={args.storage}")
+    print(f"{'step':<10} {'n':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for step, values in runner.latencies.items():
+        print(f"{step:<10} {len(values):>7} {_pct(values, .5):>9.1f} {_pct(values, .99):>9.1f} {max(values) * 1000:>9.1f}")
+    print(f"updates: {total} in {elapsed:.2f}s -> {total / elapsed:.0f} upd/s, handler errors: {runner.errors} "
+          f"(timeouts: {runner.timeouts})")
+    print("api calls:", " ".join(f"{k}={v}" for k, v in sorted(fake.calls.items())), f"| 429 injected: {fake.floods}")
+    print("outbox:", botmod.outbox.stats())
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"rss: {rss_before:.1f} MB before, {_rss_mb():.1f} MB after, peak {peak:.1f} MB")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
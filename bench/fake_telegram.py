@@ -0,0 +1,156 @@
+"""
+Локальная заглушка Bot API на aiohttp для нагрузочных прогонов.
+
+Отвечает правдоподобными объектами на методы, которые зовёт бот
+(getUpdates, sendMessage, editMessageText, send* с медиа, sendMediaGroup,
+copyMessage(s), deleteMessage(s), getChat, ...), умеет добавлять задержку
+и с заданной вероятностью отвечать 429 Too Many Requests — только на
+методы, которые бот шлёт через outbox (send*, copy*, forward*, edit*):
+остальные он не повторяет, и 429 на getMe или getUpdates просто
+останавливает прогон.
+"""
+import asyncio
+import itertools
+import json
+import random
+import time
+from collections import deque
+
+from aiohttp import web
+
+# те же методы, что темпирует outbox.Outbox
+_PACED_PREFIXES = ("send", "copy", "forward", "edit")
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        *,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        flood_rate: float = 0.0,
+        retry_after: int = 1,
+        bot_id: int = 42,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.flood_rate = flood_rate
+        self.retry_after = retry_after
+        self.bot_id = bot_id
+        self._message_ids = itertools.count(1)
+        self.calls: dict[str, int] = {}
+        self.floods = 0
+        # последние сообщения бота: (chat_id, message_id, text)
+        self.sent: deque[tuple[int, int, str]] = deque(maxlen=20_000)
+        self._updates: asyncio.Queue[dict] = asyncio.Queue()
+        self._runner: web.AppRunner | None = None
+        self.url = ""
+
+    # ---- запуск ----
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+
+    # ---- для сценария ----
+
+    def push_update(self, update: dict) -> None:
+        self._updates.put_nowait(update)
+
+    def find_sent(self, chat_id: int, needle: str) -> tuple[int, str] | None:
+        for cid, mid, text in reversed(self.sent):
+            if cid == chat_id and needle in text:
+                return mid, text
+        return None
+
+    # ---- ответы ----
+
+    def _chat(self, chat_id: int) -> dict:
+        if chat_id < 0:
+            return {"id": chat_id, "type": "supergroup", "title": "bench", "is_forum": True}
+        return {"id": chat_id, "type": "private", "username": f"user{chat_id}", "first_name": "Bench"}
+
+    def _message(self, chat_id: int, text: str | None, fields: dict) -> dict:
+        mid = next(self._message_ids)
+        msg = {
+            "message_id": mid,
+            "date": int(time.time()),
+            "chat": self._chat(chat_id),
+            "from": {"id": self.bot_id, "is_bot": True, "first_name": "Bench"},
+        }
+        if text is not None:
+            msg["text"] = text
+        if fields.get("caption"):
+            msg["caption"] = fields["caption"]
+        if fields.get("message_thread_id"):
+            msg["message_thread_id"] = int(fields["message_thread_id"])
+        self.sent.append((chat_id, mid, text or fields.get("caption") or ""))
+        return msg
+
+    def _result(self, method: str, fields: dict):
+        chat_id = int(fields["chat_id"]) if fields.get("chat_id", "").lstrip("-").isdigit() else 0
+        if method == "getMe":
+            return {"id": self.bot_id, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method == "getChat":
+            return self._chat(chat_id)
+        if method == "sendMessage":
+            return self._message(chat_id, fields.get("text", ""), fields)
+        if method == "editMessageText":
+            msg = self._message(chat_id, fields.get("text", ""), fields)
+            msg["message_id"] = int(fields.get("message_id", msg["message_id"]))
+            return msg
+        if method == "sendMediaGroup":
+            media = json.loads(fields.get("media", "[]"))
+            return [self._message(chat_id, None, {**fields, "caption": m.get("caption")}) for m in media]
+        if method == "copyMessage":
+            return {"message_id": self._message(chat_id, None, fields)["message_id"]}
+        if method == "copyMessages":
+            ids = json.loads(fields.get("message_ids", "[]"))
+            return [{"message_id": self._message(chat_id, None, fields)["message_id"]} for _ in ids]
+        if method.startswith(("send", "forward")):
+            return self._message(chat_id, None, fields)
+        # deleteMessage(s), answerCallbackQuery, setMyCommands, deleteWebhook, ...
+        return True
+
+    async def _get_updates(self, fields: dict) -> list[dict]:
+        timeout = float(fields.get("timeout") or 0)
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self._updates.get(), timeout=timeout or 0.01))
+        except asyncio.TimeoutError:
+            return []
+        while not self._updates.empty() and len(batch) < 100:
+            batch.append(self._updates.get_nowait())
+        return batch
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        fields = {k: v for k, v in (await request.post()).items() if isinstance(v, str)}
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(fields)})
+
+        delay = self.latency_ms + random.uniform(0, self.jitter_ms)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+        if self.flood_rate and method.startswith(_PACED_PREFIXES) and random.random() < self.flood_rate:
+            self.floods += 1
+            return web.json_response({
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            })
+        return web.json_response({"ok": True, "result": self._result(method, fields)})
@@ -1,19 +1,43 @@
 import os
 import re
 import asyncio
+import secrets
+import html
+import weakref
 from datetime import datetime, timedelta, timezone
-from threading import Thread
-from http.server import BaseHTTPRequestHandler, HTTPServer
 from time import monotonic
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.filters import Command, CommandObject
 from aiogram.types import (
-    InlineKeyboardMarkup, InlineKeyboardButton,
     Message, CallbackQuery, BotCommand,
-    BotCommandScopeAllPrivateChats, BotCommandScopeAllChatAdministrators
+    BotCommandScopeAllPrivateChats, BotCommandScopeAllChatAdministrators,
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, MessageEntity,
 )
 
+from analytics import DAY, Event, EventLog
+from batching import IdleBatcher
+from broadcast import BroadcastResult, fan_out
+from cache import BoundedCache, cache_stats
+from deletion import DeletionBatch, delete_messages
+from digest import DeadlineDigest, DigestPost
+from lifecycle import Lifecycle
+from instrumentation import ApiTimingMiddleware, HandlerTimingMiddleware, log_summary
+from logs import HandlerContextMiddleware, UpdateContextMiddleware, get_logger, setup_logging, shutdown_logging
+from metrics import CallbackMetric, Counter, Health, HeartbeatMiddleware
+from flood import FloodGuard, Verdict
+from ordering import UpdateScheduler
+from outbox import Outbox, Priority, prioritized
+from profiles import ProfileCache, ProfileMiddleware
+from relay import CAPTIONED, compose, copy_many_with_header, copy_with_header, is_copy_error, pack_messages
+from scheduler import DeadlineScheduler
+from session import SESSION_VALUE, Flow, Role, UserSession
+from search import MessageIndex, parse_query
+from screens import Screen, ScreenRegistry, fingerprint as screen_fingerprint, keyboard
+from storage import Codec, JSON_VALUE, PAIR_KEY, STR_VALUE, PersistentMap, PersistentSet, Storage, make_backend
+from webapp import add_webhook, build_app, serve
+
 # ==== HTML parse_mode: совместимость с разными aiogram ====
 try:
     from aiogram.client.default import DefaultBotProperties  # v3.x
@@ -133,27 +157,252 @@ ROLE_INFO = {
 }
 
 TEST_DEADLINE_DAYS = int(os.getenv("TEST_DEADLINE_DAYS", "3"))
+# сводка по тестовым в темах ролей: не чаще раза в DIGEST_REFRESH_SEC;
+# «дедлайн скоро» — если осталось меньше DIGEST_DUE_SOON_HOURS
+DIGEST_REFRESH_SEC = float(os.getenv("DIGEST_REFRESH_SEC", "60"))
+DIGEST_DUE_SOON_HOURS = int(os.getenv("DIGEST_DUE_SOON_HOURS", "24"))
+# строк на раздел сводки: пост не должен упереться в 4096 символов
+DIGEST_SECTION_LINES = 30
 PORT = int(os.getenv("PORT", "10000"))
 
+# polling — long polling (по умолчанию); webhook — апдейты приходят на наш aiohttp-сервер
+MODE = os.getenv("MODE", "polling").lower()
+if MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"Unknown MODE: {MODE}")
+# внешний адрес сервиса; на Render он уже лежит в RENDER_EXTERNAL_URL
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL") or os.getenv("RENDER_EXTERNAL_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Telegram присылает его в X-Telegram-Bot-Api-Secret-Token; без него запрос отклоняется
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# max_connections для setWebhook; сколько апдейтов обрабатывается одновременно, задаёт UPDATE_CONCURRENCY
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "32"))
+# принятых, но ещё не обработанных апдейтов; сверх этого отвечаем 503 и Telegram повторит позже
+WEBHOOK_MAX_BACKLOG = int(os.getenv("WEBHOOK_MAX_BACKLOG", "1000"))
+# сколько секунд при остановке ждать начатые хендлеры и очередь отправки (Render даёт 30)
+DRAIN_TIMEOUT_SEC = float(os.getenv("DRAIN_TIMEOUT_SEC", "20"))
+# раз в сколько секунд печатать сводку по времени хендлеров и Bot API (0 — не печатать)
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))
+
+# JSON-логи в stdout; LOG_LEVELS — уровни по компонентам: "outbox=DEBUG,storage=WARNING"
+setup_logging(
+    os.getenv("LOG_LEVEL", "INFO"),
+    os.getenv("LOG_LEVELS", ""),
+    sample_burst=int(os.getenv("LOG_SAMPLE_BURST", "5")),
+    sample_window=float(os.getenv("LOG_SAMPLE_WINDOW", "60")),
+)
+log = get_logger("bot")
+if MODE == "webhook" and not WEBHOOK_BASE_URL:
+    raise RuntimeError("MODE=webhook requires WEBHOOK_BASE_URL")
+
+# memory (по умолчанию) — всё в памяти, как раньше; sqlite — состояние переживает
+# перезапуск, но STORAGE_PATH (и ANALYTICS_PATH) должны лежать на постоянном диске:
+# рабочая папка на хостинге может очищаться при каждом деплое
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "memory")
+STORAGE_PATH = os.getenv("STORAGE_PATH", "kitsune.sqlite3")
+STORAGE_FLUSH_SEC = float(os.getenv("STORAGE_FLUSH_SEC", "2"))
+# журнал событий воронки для /stats; пусто — только счётчики в памяти до перезапуска
+ANALYTICS_PATH = os.getenv(
+    "ANALYTICS_PATH", "kitsune-events.bin" if STORAGE_BACKEND.lower() == "sqlite" else "",
+)
+# когорты старше этого забываются: память и журнал не растут бесконечно
+ANALYTICS_RETENTION_DAYS = int(os.getenv("ANALYTICS_RETENTION_DAYS", "365"))
+
+# сколько записей держать в памяти и как долго отвечать на свайп / удалять через /undo
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "20000"))
+REPLY_TTL_DAYS = int(os.getenv("REPLY_TTL_DAYS", "30"))
+# через сколько часов ник из кэша профилей перепроверять через getChat
+PROFILE_TTL_HOURS = float(os.getenv("PROFILE_TTL_HOURS", "24"))
+# раз в сколько секунд фоном спрашивать getChat про тех, чьего ника нет в кэше
+PROFILE_REFRESH_SEC = float(os.getenv("PROFILE_REFRESH_SEC", "2"))
+# Telegram не даёт боту удалять сообщения старше 48 часов
+UNDO_TTL_HOURS = int(os.getenv("UNDO_TTL_HOURS", "48"))
+# /broadcast: сколько отправок держать одновременно (темп всё равно задаёт outbox)
+# и раз в сколько секунд обновлять сообщение с прогрессом
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_PROGRESS_SEC = float(os.getenv("BROADCAST_PROGRESS_SEC", "10"))
+
+# лимиты исходящих: Telegram режет ~30 сообщений/с на бота и ~20/мин в группу
+OUTBOX_GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))
+OUTBOX_GROUP_PER_MIN = float(os.getenv("OUTBOX_GROUP_PER_MIN", "20"))
+OUTBOX_PRIVATE_RATE = float(os.getenv("OUTBOX_PRIVATE_RATE", "1"))
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", "8"))
+
+# апдейты разных пользователей обрабатываются параллельно, одного — строго по очереди
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "64"))
+UPDATE_QUEUE_PER_USER = int(os.getenv("UPDATE_QUEUE_PER_USER", "20"))
+
+# сколько результатов /find на одной странице
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "8"))
+# сколько дней хранить сообщения для /find и сколько строк максимум (0 — без лимита);
+# без sqlite индекс живёт в памяти, поэтому там лимит по умолчанию есть
+SEARCH_RETENTION_DAYS = int(os.getenv("SEARCH_RETENTION_DAYS", "365"))
+SEARCH_MAX_ROWS = int(os.getenv("SEARCH_MAX_ROWS", "0" if STORAGE_BACKEND.lower() == "sqlite" else "20000"))
+
+# части альбома приходят отдельными апдейтами; ждём, пока перестанут приходить
+ALBUM_WINDOW_SEC = float(os.getenv("ALBUM_WINDOW_SEC", "1.0"))
+
+# входящий флуд от кандидата: FLOOD_BURST сообщений подряд, дальше FLOOD_REFILL_PER_MIN в минуту;
+# лишнее уходит в группу одной сводкой, а после FLOOD_MUTE_AFTER лишних — мьют на FLOOD_MUTE_MIN минут
+FLOOD_BURST = int(os.getenv("FLOOD_BURST", "8"))
+FLOOD_REFILL_PER_MIN = float(os.getenv("FLOOD_REFILL_PER_MIN", "12"))
+FLOOD_DIGEST_SEC = float(os.getenv("FLOOD_DIGEST_SEC", "10"))
+FLOOD_MUTE_AFTER = int(os.getenv("FLOOD_MUTE_AFTER", "40"))
+FLOOD_MUTE_MIN = float(os.getenv("FLOOD_MUTE_MIN", "30"))
+# анкету часто пишут несколькими короткими сообщениями: тексты, пришедшие
+# с паузами меньше TEXT_BATCH_SEC, уходят кураторам одним постом
+TEXT_BATCH_SEC = float(os.getenv("TEXT_BATCH_SEC", "3"))
+
 # ============ BOT STATE / ACCESS CONTROL ============
 
-# STATE[user_id] = { flow, role, deadline, msg_id, chat_id, active }
-STATE: dict[int, dict] = {}
-USER_LAST_ROLE: dict[int, str] = {}
+storage = Storage(make_backend(STORAGE_BACKEND, STORAGE_PATH))
+# индекс для /find лежит в том же файле; без sqlite живёт до перезапуска
+message_index = MessageIndex(
+    STORAGE_PATH if STORAGE_BACKEND.lower() == "sqlite" else ":memory:",
+    retention_days=SEARCH_RETENTION_DAYS,
+    max_rows=SEARCH_MAX_ROWS,
+)
+analytics = EventLog(ANALYTICS_PATH, retention_days=ANALYTICS_RETENTION_DAYS)
+
+# STATE[user_id] -> UserSession; доступ через user_session()
+STATE: PersistentMap = PersistentMap(storage, "state", value_codec=SESSION_VALUE, mutable=True)
+USER_LAST_ROLE: PersistentMap = PersistentMap(storage, "last_role", value_codec=STR_VALUE)
+
+
+def track(event: Event, user_id: int, role_key: str | None) -> None:
+    """Событие воронки для /stats; без роли — код 0."""
+    role = Role.from_key(role_key)
+    analytics.record(event, user_id, int(role) if role else 0)
+
+
+def user_session(user_id: int) -> UserSession:
+    """Состояние пользователя; при первом обращении создаётся пустое."""
+    st = STATE.get(user_id)
+    if st is None:
+        st = STATE[user_id] = UserSession()
+    return st
+
 
 # Бан-лист: можно инициировать через BANNED_IDS="1,2,3"
-BANNED_IDS = {int(x) for x in os.getenv("BANNED_IDS", "").split(",") if x.strip().isdigit()}
+BANNED_IDS = PersistentSet(
+    storage, "banned",
+    initial=(int(x) for x in os.getenv("BANNED_IDS", "").split(",") if x.strip().isdigit()),
+)
 
-_LAST_START_AT: dict[int, float] = {}
-_LAST_CB_KEY_AT: dict[tuple[int, str], float] = {}
+# Debounce и блокировки: живут минуты, дальше просто выкидываем
+_LAST_START_AT = BoundedCache("last_start", CACHE_MAX_ENTRIES, ttl=60)
+# временный мьют за флуд: как бан, но сам снимается через FLOOD_MUTE_MIN
+flood = FloodGuard(
+    burst=FLOOD_BURST,
+    refill=FLOOD_REFILL_PER_MIN / 60,
+    mute_after=FLOOD_MUTE_AFTER,
+    mute_sec=FLOOD_MUTE_MIN * 60,
+    maxsize=CACHE_MAX_ENTRIES,
+)
+_LAST_CB_KEY_AT = BoundedCache("last_cb_key", CACHE_MAX_ENTRIES, ttl=60)
 _CB_DEBOUNCE_SEC = 2.5
-_USER_LOCKS: dict[int, asyncio.Lock] = {}
+# замок экрана живёт, пока его держат или ждут (ссылки из render_screen), и исчезает сам:
+# вытеснение из кэша могло бы выкинуть занятый замок и пустить два рендера одного пользователя
+_USER_LOCKS: "weakref.WeakValueDictionary[int, asyncio.Lock]" = weakref.WeakValueDictionary()
+# запросы /find для кнопок листания: в callback_data целиком не влезают
+_FIND_QUERIES = BoundedCache("find_queries", 1000, ttl=3600)
+# рассылки, ждущие подтверждения кнопкой
+_PENDING_BROADCASTS = BoundedCache("pending_broadcasts", 100, ttl=600)
+
+
+class ReplyTarget:
+    """Сообщение в группе -> кандидат, которому уйдёт «свайп-ответ»."""
+    __slots__ = ("user_id", "created_at")
+
+    def __init__(self, user_id: int, created_at: float):
+        self.user_id = user_id
+        self.created_at = created_at
 
-# Сообщение в группе -> целевой user_id для «свайп-ответа»
-REPLY_MAP: dict[tuple[int, int], int] = {}
 
-# Сообщение куратора в группе -> (user_id, [message_id в ЛС кандидата])
-ADMIN_SENT_MAP: dict[tuple[int, int], tuple[int, list[int]]] = {}
+class SentRecord:
+    """Сообщение куратора в группе -> что бот отправил в ЛС кандидату."""
+    __slots__ = ("user_id", "message_ids", "created_at")
+
+    def __init__(self, user_id: int, message_ids: list[int], created_at: float):
+        self.user_id = user_id
+        self.message_ids = message_ids
+        self.created_at = created_at
+
+
+class BroadcastRecord:
+    """Команда /broadcast в группе -> что бот разослал (для /undo)."""
+    __slots__ = ("sent", "created_at", "keys")
+
+    def __init__(self, sent: dict[int, list[int]], created_at: float, keys: list[tuple[int, int]]):
+        self.sent = sent
+        self.created_at = created_at
+        # все сообщения в группе, под которыми лежит эта запись
+        self.keys = keys
+
+
+def _now_ts() -> float:
+    return datetime.now(timezone.utc).timestamp()
+
+
+def _load_reply_target(raw) -> ReplyTarget:
+    v = JSON_VALUE.load(raw)
+    if isinstance(v, int):  # старый формат: просто user_id
+        return ReplyTarget(v, _now_ts())
+    return ReplyTarget(*v)
+
+
+def _load_sent_record(raw) -> SentRecord:
+    v = JSON_VALUE.load(raw)
+    if len(v) == 2:  # старый формат: (user_id, [message_id])
+        return SentRecord(v[0], v[1], _now_ts())
+    return SentRecord(*v)
+
+
+def _load_broadcast_record(raw) -> BroadcastRecord:
+    created_at, sent, keys = JSON_VALUE.load(raw)
+    return BroadcastRecord({uid: ids for uid, ids in sent}, created_at, [tuple(k) for k in keys])
+
+
+REPLY_MAP: PersistentMap = PersistentMap(
+    storage, "reply", key_codec=PAIR_KEY,
+    value_codec=Codec(lambda r: JSON_VALUE.dump([r.user_id, r.created_at]), _load_reply_target),
+    cache=BoundedCache("reply_map", CACHE_MAX_ENTRIES, ttl=3600),
+    expires_at=lambda r: r.created_at + REPLY_TTL_DAYS * 86400,
+)
+
+ADMIN_SENT_MAP: PersistentMap = PersistentMap(
+    storage, "admin_sent", key_codec=PAIR_KEY,
+    value_codec=Codec(lambda r: JSON_VALUE.dump([r.user_id, r.message_ids, r.created_at]), _load_sent_record),
+    cache=BoundedCache("admin_sent_map", CACHE_MAX_ENTRIES, ttl=3600),
+    expires_at=lambda r: r.created_at + UNDO_TTL_HOURS * 3600,
+)
+
+BROADCAST_MAP: PersistentMap = PersistentMap(
+    storage, "broadcast", key_codec=PAIR_KEY,
+    value_codec=Codec(
+        lambda r: JSON_VALUE.dump([r.created_at, [[uid, ids] for uid, ids in r.sent.items()], r.keys]),
+        _load_broadcast_record,
+    ),
+    cache=BoundedCache("broadcast_map", 1000, ttl=3600),
+    expires_at=lambda r: r.created_at + UNDO_TTL_HOURS * 3600,
+)
+
+
+REPLY_TOO_OLD_TEXT = (
+    f"⌛ Это сообщение кандидата старше {REPLY_TTL_DAYS} дн., ответ на него отключён. "
+    "Напишите через /pm ID [текст]."
+)
+
+
+# «/pm», «/pm@bot», «/pm 123456789» в начале текста или подписи
+_PM_COMMAND = re.compile(r"(?i)^/pm(?:@\w+)?(?:\s+\d+)?\s*")
+
+
+def strip_pm_command(text: str) -> str:
+    return _PM_COMMAND.sub("", text, count=1).strip()
+
+
+def is_too_old(created_at: float, ttl_sec: float) -> bool:
+    return _now_ts() - created_at > ttl_sec
 
 
 def is_admin(user_id: int) -> bool:
@@ -166,21 +415,56 @@ if DefaultBotProperties:
 else:
     bot = Bot(BOT_TOKEN, parse_mode=ParseMode.HTML)
 
+# все отправки идут через одну очередь с лимитами и приоритетами
+outbox = Outbox(
+    global_rate=OUTBOX_GLOBAL_RATE,
+    group_per_min=OUTBOX_GROUP_PER_MIN,
+    private_rate=OUTBOX_PRIVATE_RATE,
+    concurrency=OUTBOX_CONCURRENCY,
+)
+bot.session.middleware(outbox)
+# после outbox: меряем сам запрос, без ожидания в очереди
+bot.session.middleware(ApiTimingMiddleware())
+
 dp = Dispatcher()
+# считает апдейты в обработке, чтобы при остановке дождаться их; до хендлера ничего не ждёт
+lifecycle = Lifecycle(drain_timeout=DRAIN_TIMEOUT_SEC)
+dp.update.outer_middleware(lifecycle)
+# порядок в очереди пользователя = порядок поступления
+updates = UpdateScheduler(concurrency=UPDATE_CONCURRENCY, max_queue=UPDATE_QUEUE_PER_USER)
+dp.update.outer_middleware(updates)
+dp.message.middleware(HandlerTimingMiddleware())
+dp.callback_query.middleware(HandlerTimingMiddleware())
+dp.message.middleware(HandlerContextMiddleware())
+dp.callback_query.middleware(HandlerContextMiddleware())
+
+# user_id / role / update_id в каждой записи лога
+dp.update.outer_middleware(UpdateContextMiddleware(role_of=lambda uid: USER_LAST_ROLE.get(uid)))
+
+# ник и имя каждого, кто пишет боту, — без лишних getChat
+profiles = ProfileCache(bot.get_chat, maxsize=CACHE_MAX_ENTRIES, ttl=PROFILE_TTL_HOURS * 3600)
+dp.update.outer_middleware(ProfileMiddleware(profiles))
 
 # ============ SMALL UTILITIES ============
 
-async def send_plain(chat_id: int, text: str):
-    await bot.send_message(chat_id, text, parse_mode=None, disable_web_page_preview=True)
+async def send_plain(chat_id: int, text: str, *, priority: Priority = Priority.NORMAL):
+    with prioritized(priority):
+        await bot.send_message(chat_id, text, parse_mode=None, disable_web_page_preview=True)
 
 
 def remember_reply_target(msg: Message | None, user_id: int):
     if not msg:
         return
-    try:
-        REPLY_MAP[(msg.chat.id, msg.message_id)] = user_id
-    except Exception:
-        pass
+    remember_reply_ids(msg.chat.id, [msg.message_id], user_id)
+
+
+def remember_reply_ids(chat_id: int, message_ids: list[int], user_id: int):
+    now = _now_ts()
+    for mid in message_ids:
+        try:
+            REPLY_MAP[(chat_id, mid)] = ReplyTarget(user_id, now)
+        except Exception:
+            pass
 
 
 def role_title(key: str) -> str:
@@ -206,23 +490,48 @@ def apply_info_block(key: str) -> str:
     )
 
 
+def user_header(user, role_title_text: str) -> str:
+    username = f"@{user.username}" if user.username else "—"
+    hashtag = f"\n#{user.username}" if user.username else ""
+    return f"📥 Сообщение от {username} (id {user.id}) | Роль: {role_title_text}{hashtag}"
+
+
 async def send_combined_user_message_to_group(
     m: Message,
     role_title_text: str,
     thread_id: int | None,
-) -> bool:
+) -> list[int]:
     """
     Делает ОДНО сообщение в группе:
     шапка + текст/подпись + вложение (если есть).
     На него потом можно ответить и через /pm, и через свайп.
+    Возвращает id сообщений в группе ([] — не доставлено).
     """
     if not GROUP_ID:
-        return False
+        return []
+
+    header = user_header(m.from_user, role_title_text)
+    try:
+        ids = await copy_with_header(
+            bot, m, GROUP_ID, header,
+            m.text or m.caption or "",
+            m.entities or m.caption_entities,
+            thread_id=thread_id,
+        )
+    except TelegramBadRequest as e:
+        # не всё можно скопировать (например, викторину без ответа) — собираем вручную
+        log.info("copyMessage failed, rebuilding message: %s", e, extra={"content_type": m.content_type})
+        return await _rebuild_user_message_in_group(m, header, thread_id)
+    except Exception as e:
+        log.warning("send_combined_user_message_to_group error: %s", e, extra={"error": type(e).__name__})
+        return []
+
+    remember_reply_ids(GROUP_ID, ids, m.from_user.id)
+    return ids
 
-    username = f"@{m.from_user.username}" if m.from_user.username else "—"
-    hashtag = f"\n#{m.from_user.username}" if m.from_user.username else ""
-    header = f"📥 Сообщение от {username} (id {m.from_user.id}) | Роль: {role_title_text}{hashtag}"
 
+async def _rebuild_user_message_in_group(m: Message, header: str, thread_id: int | None) -> list[int]:
+    """Запасной путь: пересобираем сообщение по типу вложения."""
     body_text = m.text or m.caption or ""
     caption = f"{header}\n\n{body_text}" if body_text else header
 
@@ -288,7 +597,7 @@ async def send_combined_user_message_to_group(
             )
             remember_reply_target(info_msg, m.from_user.id)
             remember_reply_target(sticker_msg, m.from_user.id)
-            return True
+            return [info_msg.message_id, sticker_msg.message_id]
         else:
             sent_msg = await bot.send_message(
                 GROUP_ID,
@@ -296,13 +605,138 @@ async def send_combined_user_message_to_group(
                 **send_kwargs,
             )
     except Exception as e:
-        print("send_combined_user_message_to_group error:", e)
-        return False
+        log.warning("_rebuild_user_message_in_group error: %s", e, extra={"error": type(e).__name__})
+        return []
 
     if sent_msg:
         remember_reply_target(sent_msg, m.from_user.id)
-        return True
-    return False
+        return [sent_msg.message_id]
+    return []
+
+
+def _album_item(m: Message, caption: str | None, entities: list[MessageEntity] | None):
+    # подпись кандидата — обычный текст с entities, а не HTML: иначе «<» или «&» ломают отправку
+    kwargs = dict(caption=caption, caption_entities=entities, parse_mode=None)
+    if m.photo:
+        return InputMediaPhoto(media=m.photo[-1].file_id, **kwargs)
+    if m.video:
+        return InputMediaVideo(media=m.video.file_id, **kwargs)
+    if m.document:
+        return InputMediaDocument(media=m.document.file_id, **kwargs)
+    if m.audio:
+        return InputMediaAudio(media=m.audio.file_id, **kwargs)
+    return None
+
+
+async def send_album_to_group(
+    parts: list[Message],
+    role_title_text: str,
+    thread_id: int | None,
+) -> list[int]:
+    """
+    Альбом кандидата — одним sendMediaGroup: шапка в подписи первого
+    элемента, подписи остальных как есть. Каждое сообщение альбома
+    запоминаем в REPLY_MAP, чтобы свайп работал на любой картинке.
+    """
+    if not GROUP_ID:
+        return []
+
+    user = parts[0].from_user
+    header = user_header(user, role_title_text)
+
+    media = []
+    for i, part in enumerate(parts):
+        if i == 0:
+            caption, entities = compose(header, part.caption or "", part.caption_entities)
+        else:
+            caption, entities = part.caption or None, part.caption_entities
+        item = _album_item(part, caption, entities)
+        if item is None:
+            return []
+        media.append(item)
+
+    send_kwargs: dict = {}
+    if thread_id:
+        send_kwargs["message_thread_id"] = thread_id
+
+    try:
+        sent = await bot.send_media_group(GROUP_ID, media, **send_kwargs)
+    except Exception as e:
+        log.warning("send_album_to_group error: %s", e, extra={"error": type(e).__name__, "parts": len(parts)})
+        return []
+
+    ids = [msg.message_id for msg in sent]
+    remember_reply_ids(GROUP_ID, ids, user.id)
+    return ids
+
+
+async def copy_album_to_group(
+    parts: list[Message],
+    role_title_text: str,
+    thread_id: int | None,
+) -> tuple[list[int], int]:
+    """
+    Запасной путь для альбома: шапка + copyMessages, по одному — только если
+    и это не прошло. Возвращает id в группе и сколько частей не ушло: часть
+    альбома может дойти, и тогда кандидату надо сказать, что повторять всё не нужно.
+    """
+    user = parts[0].from_user
+    try:
+        ids = await copy_many_with_header(
+            bot, parts, GROUP_ID, user_header(user, role_title_text), thread_id=thread_id,
+        )
+    except Exception as e:
+        log.info("copyMessages failed, sending album parts one by one: %s", e)
+        ids, failed = [], 0
+        for p in parts:
+            try:
+                part_ids = await send_combined_user_message_to_group(p, role_title_text, thread_id)
+            except Exception as e:
+                log.warning("Album part forward failed: %s", e, extra={"error": type(e).__name__})
+                part_ids = []
+            ids += part_ids
+            failed += not part_ids
+        return ids, failed
+
+    remember_reply_ids(GROUP_ID, ids, user.id)
+    return ids, 0
+
+
+async def send_digest_to_group(parts: list[Message], header: str, thread_id: int | None) -> list[int]:
+    """
+    Пачка сообщений одного пользователя как одна сводка: шапка и все тексты —
+    в одно сообщение (или несколько, если не влезают в лимит), вложения —
+    следом одним copyMessages. Возвращает [], если ушло не всё.
+    """
+    if not GROUP_ID:
+        return []
+
+    kwargs: dict = {}
+    if thread_id:
+        kwargs["message_thread_id"] = thread_id
+
+    texts = [(p.text, p.entities) for p in parts if p.text]
+    media = [p.message_id for p in parts if not p.text]
+    ids: list[int] = []
+    try:
+        for chunk, entities in pack_messages(header, texts):
+            sent = await bot.send_message(
+                GROUP_ID, chunk, entities=entities, parse_mode=None, disable_web_page_preview=True, **kwargs,
+            )
+            ids.append(sent.message_id)
+        if media:
+            copied = await bot.copy_messages(GROUP_ID, parts[0].chat.id, media, **kwargs)
+            ids += [c.message_id for c in copied]
+    except Exception as e:
+        log.warning("send_digest_to_group error: %s", e, extra={"error": type(e).__name__, "parts": len(parts)})
+        remember_reply_ids(GROUP_ID, ids, parts[0].from_user.id)
+        return []
+
+    remember_reply_ids(GROUP_ID, ids, parts[0].from_user.id)
+    return ids
+
+
+ADMIN_HEADER = "Сообщение от куратора:"
 
 
 async def send_admin_message_to_user(
@@ -312,20 +746,39 @@ async def send_admin_message_to_user(
 ) -> None:
     """
     Отправляет пользователю ОДНО логическое сообщение:
-    либо текст, либо один файл + подпись 'Сообщение от куратора' + текст.
-    Может быть несколько технических сообщений (например стикер + текст),
+    либо текст, либо копию вложения с подписью 'Сообщение от куратора' + текст.
+    Может быть несколько технических сообщений (например текст + стикер),
     но все они будут связаны с исходным src и могут быть удалены через /undo.
     """
+    base_text = admin_text(src, tail_text)
+
+    # ответ куратора обгоняет в очереди подтверждения и прочую мелочь
+    with prioritized(Priority.HIGH):
+        message_ids = await deliver_admin_message(user_id, src, base_text)
+
+    if message_ids:
+        try:
+            ADMIN_SENT_MAP[(src.chat.id, src.message_id)] = SentRecord(
+                user_id,
+                message_ids,
+                _now_ts(),
+            )
+        except Exception:
+            pass
+
+
+def admin_text(src: Message, tail_text: str | None = None) -> str:
+    """Текст для кандидата: приписка из команды, потом подпись или текст src без /pm."""
     tail_text = (tail_text or "").strip()
 
     # подпись у исходного сообщения (если есть)
     raw_caption = src.caption or ""
-    clean_caption = re.sub(r"(?i)^/pm(\s+\d+)?\s*", "", raw_caption).strip()
+    clean_caption = strip_pm_command(raw_caption)
 
     # обычный текст сообщения (для ответов через свайп)
     body_text = (src.text or "").strip()
     if body_text:
-        body_text = re.sub(r"(?i)^/pm(\s+\d+)?\s*", "", body_text).strip()
+        body_text = strip_pm_command(body_text)
 
     # собираем итоговый текст: приоритет tail_text, потом caption, потом text
     base_text = ""
@@ -337,11 +790,23 @@ async def send_admin_message_to_user(
             base_text += "\n\n" + body_text
     else:
         base_text = clean_caption or body_text
+    return base_text
+
+
+async def deliver_admin_message(user_id: int, src: Message, base_text: str) -> list[int]:
+    """Копия src с шапкой куратора и текстом base_text; id сообщений у кандидата."""
+    try:
+        return await copy_with_header(bot, src, user_id, ADMIN_HEADER, base_text)
+    except TelegramBadRequest as e:
+        if not is_copy_error(e):
+            raise
+        log.info("copyMessage failed, rebuilding message: %s", e, extra={"content_type": src.content_type})
+        caption = f"{ADMIN_HEADER}\n\n{base_text}" if base_text else ADMIN_HEADER
+        return [msg.message_id for msg in await _rebuild_admin_message(user_id, src, caption)]
 
-    caption = "Сообщение от куратора:"
-    if base_text:
-        caption += "\n\n" + base_text
 
+async def _rebuild_admin_message(user_id: int, src: Message, caption: str) -> list[Message]:
+    """Запасной путь: пересобираем сообщение куратора по типу вложения."""
     has_media = any([
         src.photo,
         src.document,
@@ -371,24 +836,17 @@ async def send_admin_message_to_user(
             msg = await bot.send_audio(user_id, src.audio.file_id, caption=caption, parse_mode=None)
             sent_messages.append(msg)
         elif src.voice:
-            msg = await bot.send_voice(user_id, src.voice.file_id, caption=caption)
+            msg = await bot.send_voice(user_id, src.voice.file_id, caption=caption, parse_mode=None)
             sent_messages.append(msg)
         elif src.sticker:
             st_msg = await bot.send_sticker(user_id, src.sticker.file_id)
-            txt_msg = await bot.send_message(user_id, caption)
+            txt_msg = await bot.send_message(user_id, caption, parse_mode=None)
             sent_messages.extend([st_msg, txt_msg])
     else:
-        msg = await bot.send_message(user_id, caption)
+        msg = await bot.send_message(user_id, caption, parse_mode=None)
         sent_messages.append(msg)
 
-    if sent_messages:
-        try:
-            ADMIN_SENT_MAP[(src.chat.id, src.message_id)] = (
-                user_id,
-                [m.message_id for m in sent_messages],
-            )
-        except Exception:
-            pass
+    return sent_messages
 
 
 def _cb_too_fast_for_key(user_id: int, data: str) -> bool:
@@ -400,156 +858,272 @@ def _cb_too_fast_for_key(user_id: int, data: str) -> bool:
     _LAST_CB_KEY_AT[(user_id, key)] = now
     return False
 
-# ============ KEYBOARDS ============
+# ============ SCREENS ============
 
-def main_menu():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="જ⁀➴ О команде", callback_data="about")],
-        [InlineKeyboardButton(text="Подать заявку <┈╯", callback_data="apply")]
-    ])
+WELCOME_TEXT = """ㅤㅤㅤ🐾『𝐓𝐚𝐥𝐞𝐬 𝐨𝐟 𝐊𝐢𝐭𝐬𝐮𝐧𝐞』 🐾
+        ㅤУзнай легенды логова иㅤ
+        правила его обитателей, аㅤ
+        затем оставь свою заявку,ㅤ
+        если готов присоединить-
+        ㅤся к стае.༄˖°.🍂.ೃ࿔*:･ㅤ"""
 
+APPLY_ROLES_TEXT = """        ㅤ        Выбери направление,ㅤ
+        ㅤв котором раскроетсяㅤ
+        ㅤтвой талант под пред-ㅤ
+        ㅤводительством кицунэ.ㅤ"""
+
+ABOUT_TEXT = (
+    "<b>Tales of Kitsune</b> — команда, которая переводит манхвы с любовью к оригиналу и уважением к читателю.\n\n"
+    "<b>Работаем за спасибо.</b>\n"
+    "Наш проект некоммерческий: здесь нет зарплат, премий и прочих земных наград.\n"
+    "Мы трудимся ради удовольствия творить и ради тех, кто хочет читать эти истории свободно — так, как их задумали авторы.\n\n"
+    "<b>Берём кандидатов без опыта.</b>\n"
+    "Не умеешь чистить, вставлять текст или спорить со шрифтами — научим.\n"
+    "Умеешь — тем лучше, сбережём немного нервов и времени для сна.\n"
+    "Главное — желание делать хорошо. Остальное приходит с практикой, терпением и парой ночей в компании таинственного файла «финал_3_точно_последний.psd».\n\n"
+    "<b>Требования:</b>\n"
+    "• Пара свободных часов в неделю\n"
+    "• Ответственность и уважение к срокам\n"
+    "• Возраст от 16 лет\n"
+    "• Прохождение тестового задания"
+)
 
-def vacancies_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="Переводчик", callback_data="v:translator"),
-            InlineKeyboardButton(text="Редактор", callback_data="v:editor"),
-        ],
-        [
-            InlineKeyboardButton(text="Клинер", callback_data="v:cleaner"),
-            InlineKeyboardButton(text="Тайпер", callback_data="v:typesetter"),
-        ],
-        [
-            InlineKeyboardButton(text="Склейщик", callback_data="v:gluer"),
-            InlineKeyboardButton(text="Куратор", callback_data="v:curator"),
-        ],
-        [
-            InlineKeyboardButton(text="Бета-ридер", callback_data="v:beta"),
-            InlineKeyboardButton(text="Тайп-чекер", callback_data="v:typecheck"),
-        ],
-        [InlineKeyboardButton(text="« Назад", callback_data="back:menu"),
-         InlineKeyboardButton(text="Подать заявку", callback_data="apply")]
-    ])
+# короткие подписи кнопок; порядок — как в клавиатурах
+ROLE_BUTTONS = {
+    "translator": "Переводчик",
+    "editor": "Редактор",
+    "cleaner": "Клинер",
+    "typesetter": "Тайпер",
+    "gluer": "Склейщик",
+    "curator": "Куратор",
+    "beta": "Бета-ридер",
+    "typecheck": "Тайп-чекер",
+}
 
 
-def back_and_apply_small():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="« Назад", callback_data="back:vacancies"),
-            InlineKeyboardButton(text="Подать заявку", callback_data="apply")
-        ]
-    ])
+def _role_rows(prefix: str) -> list[list[tuple[str, str]]]:
+    buttons = [(label, f"{prefix}:{key}") for key, label in ROLE_BUTTONS.items()]
+    return [buttons[i:i + 2] for i in range(0, len(buttons), 2)]
 
 
-def apply_roles_keyboard():
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="Переводчик", callback_data="a:translator"),
-            InlineKeyboardButton(text="Редактор", callback_data="a:editor"),
-        ],
-        [
-            InlineKeyboardButton(text="Клинер", callback_data="a:cleaner"),
-            InlineKeyboardButton(text="Тайпер", callback_data="a:typesetter"),
-        ],
-        [
-            InlineKeyboardButton(text="Склейщик", callback_data="a:gluer"),
-            InlineKeyboardButton(text="Куратор", callback_data="a:curator"),
-        ],
-        [
-            InlineKeyboardButton(text="Бета-ридер", callback_data="a:beta"),
-            InlineKeyboardButton(text="Тайп-чекер", callback_data="a:typecheck"),
-        ],
-        [InlineKeyboardButton(text="« Назад", callback_data="back:menu")]
-    ])
+def _test_text(key: str) -> str:
+    info = ROLE_INFO.get(key, {})
+    folder = info.get("test_folder", "")
+    guide = info.get("guide", "")
+    title = role_title(key)
 
+    lines = [
+        f"<b>{title}</b>",
+        "Заполните анкету по форме ниже и прикрепите к ней тестовый файл "
+        "(тестовое задание для кураторов отсутствует):",
+        "1. Имя (при желании указать).",
+        "2. Ник (как к вам обращаться).",
+        "3. Наличие/отсутствие опыта (при желании указать). При подаче заявки на куратора указывать обязательно.",
+        "4. Количество свободного времени в неделю.",
+        "5. Дополнительные полезные навыки/знания (работа в приложениях, с нейросетями, знание EXCEL/Google docs и прочее).",
+        "6*. Укажите язык, с которого был выполнен перевод (пункт для переводчиков).",
+        "",
+    ]
 
-def start_test_keyboard(role_key: str):
-    return InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Пройти тестовое задание", callback_data=f"starttest:{role_key}")],
-        [InlineKeyboardButton(text="« Назад", callback_data="back:applyroles")]
-    ])
+    if folder:
+        lines.append(f"<b>Папка с тестовым заданием:</b> {folder}")
+    else:
+        lines.append("<b>Папка с тестовым заданием:</b> отсутствует для этой роли.")
+
+    if guide:
+        lines.append(f"<b>Правила выполнения задания:</b> {guide}")
+
+    lines.append(f"<b>Методичка:</b> {EXTRA_GUIDE_URL}")
+    lines.append(f"<b>Дедлайн:</b> {TEST_DEADLINE_DAYS} дня.")
+
+    return "\n".join(lines)
+
+
+def build_screens() -> ScreenRegistry:
+    """Все экраны меню: собираются один раз при старте."""
+    reg = ScreenRegistry()
+    reg.add("menu", WELCOME_TEXT, keyboard(
+        [("જ⁀➴ О команде", "about")],
+        [("Подать заявку <┈╯", "apply")],
+    ))
+    reg.add("about", ABOUT_TEXT, keyboard(
+        [("« Назад", "back:menu"), ("Подать заявку", "apply")],
+    ))
+    reg.add("vacancies", "Выбери специальность:", keyboard(
+        *_role_rows("v"),
+        [("« Назад", "back:menu"), ("Подать заявку", "apply")],
+    ))
+    reg.add("apply", APPLY_ROLES_TEXT, keyboard(
+        *_role_rows("a"),
+        [("« Назад", "back:menu")],
+    ))
+
+    vacancy_kb = keyboard([("« Назад", "back:vacancies"), ("Подать заявку", "apply")])
+    test_kb = keyboard([("« Назад", "back:applyroles")])
+    for key in ROLE_INFO:
+        reg.add(f"vacancy:{key}", role_desc_block(key), vacancy_kb)
+        reg.add(f"apply:{key}", apply_info_block(key), keyboard(
+            [("Пройти тестовое задание", f"starttest:{key}")],
+            [("« Назад", "back:applyroles")],
+        ))
+        reg.add(f"test:{key}", _test_text(key), test_kb)
+    return reg
+
+
+SCREENS = build_screens()
 
 # ============ DEADLINE NOTIFY ============
 
-async def schedule_deadline_notify(user_id: int, role_key: str, started_at: datetime):
-    deadline = started_at + timedelta(days=TEST_DEADLINE_DAYS)
-    thread_id = ROLE_TOPICS.get(role_key) or None
-    title = role_title(role_key)
+def _digest_line(user_id: int, when: float, suffix: str = "") -> str:
+    # ник только из кэша: getChat не идёт через outbox, и после рестарта сводка
+    # дала бы пачку запросов без темпа; недостающие ники подтянет profiles.run
+    profile = profiles.peek(user_id)
+    profiles.want(user_id)
+    nick = f" (@{html.escape(profile.username)})" if profile and profile.username else ""
+    return f"• id {user_id}{nick} — {datetime.fromtimestamp(when, timezone.utc):%d.%m %H:%M}{suffix}"
+
+
+def _digest_section(title: str, lines: list[str]) -> list[str]:
+    if not lines:
+        return []
+    out = [f"\n{title} ({len(lines)}):"] + lines[:DIGEST_SECTION_LINES]
+    if len(lines) > DIGEST_SECTION_LINES:
+        out.append(f"… и ещё {len(lines) - DIGEST_SECTION_LINES}")
+    return out
+
+
+def render_deadline_digest(role_key: str, post: DigestPost) -> str | None:
+    pending = deadlines.items(role_key)
+    if not pending and not post.expired and not post.assigned and post.message_id is None:
+        return None
+
+    now = _now_ts()
+    fresh = set(post.assigned)
+    soon, working = [], []
+    for uid, due in pending:
+        line = _digest_line(uid, due, " 🆕" if uid in fresh else "")
+        (soon if due - now <= DIGEST_DUE_SOON_HOURS * 3600 else working).append(line)
+    overdue = [_digest_line(uid, due) for uid, due in post.expired]
+
+    day = datetime.fromtimestamp(post.day * DAY, timezone.utc)
+    lines = [
+        f"📋 <b>Тестовые — {role_title(role_key)}</b> · {day:%d.%m.%Y}",
+        f"Выдано сегодня: {len(post.assigned)}, в работе: {len(pending)}, просрочено сегодня: {len(overdue)}",
+    ]
+    lines += _digest_section(f"🔥 <b>Дедлайн в ближайшие {DIGEST_DUE_SOON_HOURS} ч</b>", soon)
+    lines += _digest_section("⏳ <b>В работе</b>", working)
+    lines += _digest_section("⌛ <b>Просрочили сегодня</b>", overdue)
+    lines.append("\nВремя — UTC. Написать кандидату: /pm ID")
+    return "\n".join(lines)
+
 
-    username = ""
+async def post_deadline_digest(role_key: str, text: str) -> int | None:
+    if not GROUP_ID:
+        return None
+    sent = await bot.send_message(GROUP_ID, text, message_thread_id=ROLE_TOPICS.get(role_key) or None)
+    return sent.message_id
+
+
+async def edit_deadline_digest(role_key: str, message_id: int, text: str) -> bool:
     try:
-        user = await bot.get_chat(user_id)
-        username = f" (@{user.username})" if user.username else ""
-    except Exception:
-        user = None
+        await bot.edit_message_text(text, chat_id=GROUP_ID, message_id=message_id)
+    except TelegramBadRequest as e:
+        err = str(e).lower()
+        if "message is not modified" in err:
+            return True
+        if any(x in err for x in _SCREEN_GONE_ERRORS):
+            return False
+        raise
+    return True
+
 
+async def notify_deadline_expired(user_id: int, role_key: str, due_at: float):
+    deadline_digest.expired(role_key, user_id, due_at)
     try:
-        hashtag = f"\n#{user.username}" if user and user.username else ""
-        text = (
-            "⏳ <b>Выдано тестовое задание</b>\n"
-            f"Роль: <b>{title}</b>\n"
-            f"Пользователь: id {user_id}{username}{hashtag}\n"
-            f"Дедлайн: {deadline.strftime('%Y-%m-%d %H:%M %Z') or deadline.isoformat()}"
+        await bot.send_message(
+            user_id,
+            f"Напоминание: срок сдачи теста по роли «{role_title(role_key)}» истёк. Если нужно продление, ответьте на это сообщение."
         )
-        if GROUP_ID:
-            if thread_id:
-                await bot.send_message(GROUP_ID, text, message_thread_id=thread_id)
-            else:
-                await bot.send_message(GROUP_ID, text)
     except Exception as e:
-        print("Error posting assignment:", e)
-
-    now = datetime.now(timezone.utc)
-    delta = (deadline.replace(tzinfo=timezone.utc) - now).total_seconds()
-    if delta > 0:
-        await asyncio.sleep(delta)
-        try:
-            await bot.send_message(
-                user_id,
-                f"Напоминание: срок сдачи теста по роли «{title}» истёк. Если нужно продление, ответьте на это сообщение."
-            )
-        except Exception as e:
-            print("Notify user failed:", e)
+        log.warning("Notify user failed: %s", e, extra={"error": type(e).__name__})
+
+
+# одна задача на все дедлайны; переживает перезапуск через storage
+deadlines = DeadlineScheduler(storage, notify_deadline_expired)
+# выдачи и просрочки — одной сводкой в день на тему роли, правится на месте
+deadline_digest = DeadlineDigest(
+    storage, ROLE_INFO,
+    render=render_deadline_digest,
+    post=post_deadline_digest,
+    edit=edit_deadline_digest,
+    interval=DIGEST_REFRESH_SEC,
+)
 
 # --- один «экран» на пользователя ---
+
+SCREEN_EDITS = Counter("screen_renders", "Screen renders by outcome", ("result",))
+
+# ошибки редактирования, после которых экран надо прислать заново
+_SCREEN_GONE_ERRORS = ("message to edit not found", "message can't be edited", "message_id_invalid")
+
+
 async def render_screen(
     user_id: int,
     chat_id: int,
     text: str,
     *,
     reply_markup=None,
-    parse_mode: str | None = ParseMode.HTML
+    parse_mode: str | None = ParseMode.HTML,
+    fingerprint: bytes | None = None,
+    source_msg_id: int | None = None,
 ):
+    """
+    Показывает пользователю экран, редактируя его текущее сообщение.
+
+    source_msg_id — сообщение, на кнопку которого нажали: раз нажатие
+    пришло, оно точно на месте, и если на нём уже тот же экран
+    (совпал отпечаток текста и кнопок), запрос в API не нужен вовсе.
+    """
+    if fingerprint is None:
+        fingerprint = screen_fingerprint(text, reply_markup)
+
     lock = _USER_LOCKS.setdefault(user_id, asyncio.Lock())
     async with lock:
-        st = STATE.setdefault(user_id, {"flow": None, "role": None, "deadline": None,
-                                        "msg_id": None, "chat_id": None, "active": False})
+        st = user_session(user_id)
 
-        old_chat_id = st.get("chat_id")
-        old_msg_id = st.get("msg_id")
-        if old_msg_id and old_chat_id and old_chat_id != chat_id:
-            try:
-                await bot.delete_message(old_chat_id, old_msg_id)
-            except Exception:
-                pass
-            st["msg_id"] = None
+        if st.msg_id and st.chat_id and st.chat_id != chat_id:
+            await delete_messages(bot, st.chat_id, [st.msg_id])
+            st.forget_screen()
+
+        msg_id = st.msg_id
+        if msg_id and msg_id == source_msg_id and st.screen_fp == fingerprint:
+            SCREEN_EDITS.inc(result="skipped")
+            return
 
-        msg_id = st.get("msg_id")
         if msg_id:
             try:
-                edited = await bot.edit_message_text(
+                await bot.edit_message_text(
                     text=text,
                     chat_id=chat_id,
                     message_id=msg_id,
                     reply_markup=reply_markup,
                     parse_mode=parse_mode
                 )
-                st["chat_id"] = chat_id
-                if edited:
+                st.chat_id = chat_id
+                st.screen_fp = fingerprint
+                SCREEN_EDITS.inc(result="edited")
+                return
+            except TelegramBadRequest as e:
+                error = str(e).lower()
+                if "message is not modified" in error:
+                    # на экране уже ровно это — считаем, что показали
+                    st.screen_fp = fingerprint
+                    SCREEN_EDITS.inc(result="not_modified")
                     return
-            except Exception as e:
-                print("Edit failed, fallback to send:", e)
-                st["msg_id"] = None
+                if not any(gone in error for gone in _SCREEN_GONE_ERRORS):
+                    raise
+                log.info("Screen message is gone, sending a new one: %s", e)
+                st.forget_screen()
 
         sent = await bot.send_message(
             chat_id,
@@ -557,8 +1131,19 @@ async def render_screen(
             reply_markup=reply_markup,
             parse_mode=parse_mode
         )
-        st["msg_id"] = sent.message_id
-        st["chat_id"] = chat_id
+        st.msg_id = sent.message_id
+        st.chat_id = chat_id
+        st.screen_fp = fingerprint
+        SCREEN_EDITS.inc(result="sent")
+
+
+async def show_screen(user_id: int, chat_id: int, screen: Screen, *, source_msg_id: int | None = None):
+    await render_screen(
+        user_id, chat_id, screen.text,
+        reply_markup=screen.markup,
+        fingerprint=screen.fingerprint,
+        source_msg_id=source_msg_id,
+    )
 
 # ============ HANDLERS ============
 
@@ -570,36 +1155,23 @@ async def cmd_start(m: Message):
         return
     _LAST_START_AT[m.from_user.id] = now
 
-    st = STATE.setdefault(m.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
-    st.update({"flow": None, "role": None, "active": True})
-    await render_screen(
-        m.from_user.id, m.chat.id,
-        """ㅤㅤㅤ🐾『𝐓𝐚𝐥𝐞𝐬 𝐨𝐟 𝐊𝐢𝐭𝐬𝐮𝐧𝐞』 🐾
-        ㅤУзнай легенды логова иㅤ
-        правила его обитателей, аㅤ
-        затем оставь свою заявку,ㅤ
-        если готов присоединить-
-        ㅤся к стае.༄˖°.🍂.ೃ࿔*:･ㅤ""",
-        reply_markup=main_menu()
-    )
+    st = user_session(m.from_user.id)
+    st.flow, st.role, st.active = Flow.NONE, None, True
+    await show_screen(m.from_user.id, m.chat.id, SCREENS["menu"])
 
 
 @dp.message(Command("cancel"))
 async def cancel(m: Message):
-    st = STATE.setdefault(m.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
+    st = user_session(m.from_user.id)
 
     # удаляем текущий экран с кнопками, если есть
-    old_chat = st.get("chat_id")
-    old_msg = st.get("msg_id")
-    if old_chat and old_msg:
-        try:
-            await bot.delete_message(old_chat, old_msg)
-        except Exception:
-            pass
+    if st.chat_id and st.msg_id:
+        await delete_messages(bot, st.chat_id, [st.msg_id])
 
-    st.update({"flow": None, "role": None, "active": False, "msg_id": None, "chat_id": None})
+    st.flow, st.role, st.active = Flow.NONE, None, False
+    st.forget_screen()
+    if deadlines.cancel(m.from_user.id):
+        deadline_digest.changed()
     await send_plain(
         m.chat.id,
         "Ты больше не желаешь быть частью стаи? Окей, мы закрыли твою заявку и кураторы больше не увидят твои сообщения. "
@@ -634,20 +1206,16 @@ async def admin_ban(m: Message, command: CommandObject):
         return
 
     BANNED_IDS.add(user_id)
-    st = STATE.setdefault(user_id, {"flow": None, "role": None, "deadline": None,
-                                     "msg_id": None, "chat_id": None, "active": False})
+    st = user_session(user_id)
 
     # удаляем его экран с кнопками, если был
-    old_chat = st.get("chat_id")
-    old_msg = st.get("msg_id")
-    if old_chat and old_msg:
-        try:
-            await bot.delete_message(old_chat, old_msg)
-        except Exception:
-            pass
+    if st.chat_id and st.msg_id:
+        await delete_messages(bot, st.chat_id, [st.msg_id])
 
-    st.update({"flow": None, "role": None, "deadline": None,
-               "msg_id": None, "chat_id": None, "active": False})
+    st.flow, st.role, st.deadline, st.active = Flow.NONE, None, None, False
+    st.forget_screen()
+    if deadlines.cancel(user_id):
+        deadline_digest.changed()
 
     try:
         await send_plain(
@@ -678,6 +1246,7 @@ async def admin_unban(m: Message, command: CommandObject):
 
     if user_id in BANNED_IDS:
         BANNED_IDS.discard(user_id)
+        flood.unmute(user_id)
         try:
             await send_plain(
                 user_id,
@@ -686,6 +1255,8 @@ async def admin_unban(m: Message, command: CommandObject):
         except Exception:
             pass
         await send_plain(m.chat.id, f"✅ Разбанен id {user_id}. Может снова общаться после /start.")
+    elif flood.unmute(user_id):
+        await send_plain(m.chat.id, f"✅ Снят мьют за флуд с id {user_id}.")
     else:
         await send_plain(m.chat.id, "Этого лиса и так никто не держал в клетке. Он не в бане.")
 
@@ -712,6 +1283,15 @@ async def admin_undo(m: Message):
     key = (m.chat.id, m.reply_to_message.message_id)
     info = ADMIN_SENT_MAP.get(key)
 
+    if not info and key in _RUNNING_BROADCASTS:
+        # прогресс рассылки сохранил бы запись обратно, а новые сообщения ушли бы уже после удаления
+        await send_plain(m.chat.id, "⏳ Рассылка ещё идёт — /undo сработает, когда она закончится.")
+        return
+
+    if not info and key in BROADCAST_MAP:
+        await undo_broadcast(m.chat.id, key)
+        return
+
     if not info:
         await send_plain(
             m.chat.id,
@@ -720,22 +1300,390 @@ async def admin_undo(m: Message):
         )
         return
 
-    user_id, msg_ids = info
-    failed = False
-    for mid in msg_ids:
-        try:
-            await bot.delete_message(user_id, mid)
-        except Exception as e:
-            print("Undo delete failed:", e)
-            failed = True
+    if is_too_old(info.created_at, UNDO_TTL_HOURS * 3600):
+        ADMIN_SENT_MAP.pop(key, None)
+        await send_plain(
+            m.chat.id,
+            f"⌛ Это сообщение слишком старое: Telegram позволяет удалять сообщения бота "
+            f"только в течение {UNDO_TTL_HOURS} ч."
+        )
+        return
+
+    # сообщений тут единицы — удаляем по одному, чтобы точно назвать неудавшиеся
+    result = await delete_messages(bot, info.user_id, info.message_ids, exact=True)
 
     ADMIN_SENT_MAP.pop(key, None)
 
-    if failed:
-        await send_plain(m.chat.id, "⚠️ Что-то не получилось удалить, возможно сообщение уже слишком старое.")
+    if not result.ok:
+        failed = ", ".join(str(mid) for mid in result.failed_ids())
+        await send_plain(
+            m.chat.id,
+            f"⚠️ Удалено {result.deleted} из {len(info.message_ids)}. Не получилось удалить сообщения: {failed} "
+            "(уже удалены кандидатом или слишком старые)."
+        )
     else:
         await send_plain(m.chat.id, "✅ Сообщение в ЛС кандидата удалено.")
 
+# ---- /broadcast: рассылка кандидатам ----
+
+_ID_LIST = re.compile(r"\d+(?:,\d+)*")
+
+_BROADCAST_REASONS = {
+    "blocked": "заблокировали бота",
+    "deactivated": "аккаунт удалён",
+    "not_found": "чат не найден",
+    "error": "другая ошибка",
+}
+
+
+class PendingBroadcast:
+    __slots__ = ("src", "text", "user_ids", "label", "keys", "started_at")
+
+    def __init__(self, src: Message, text: str, user_ids: list[int], label: str, keys: list[tuple[int, int]]):
+        self.src = src
+        self.text = text
+        self.user_ids = user_ids
+        self.label = label
+        # сообщения в группе, ответом на которые /undo отменит рассылку
+        self.keys = keys
+        # когда ушло первое сообщение: от него считается срок /undo
+        self.started_at: float | None = None
+
+
+async def broadcast_targets(spec: str) -> tuple[str, list[int]] | None:
+    """(описание, получатели) для цели /broadcast; None — цель не распознана."""
+    low = spec.lower()
+    if low in ("active", "all", "все"):
+        # активных ищем по всему хранилищу, а не только по тем, кто сейчас в памяти
+        await storage.flush()
+        user_ids = [int(k) for k, raw in storage.load_all(STATE.ns) if SESSION_VALUE.load(raw).active]
+        label = "все кандидаты в диалоге с кураторами"
+    elif _ID_LIST.fullmatch(spec):
+        user_ids = sorted({int(x) for x in spec.split(",")})
+        label = "по списку id"
+    else:
+        low = low.removeprefix("role:")
+        by_title = {v["title"].lower(): k for k, v in ROLE_INFO.items()}
+        role = low if low in ROLE_INFO else by_title.get(low)
+        if not role:
+            return None
+        user_ids = deadlines.users(role)
+        label = f"тест «{role_title(role)}» ещё не сдан по сроку"
+    return label, [uid for uid in user_ids if uid not in BANNED_IDS]
+
+
+@dp.message(Command("broadcast"))
+async def admin_broadcast(m: Message, command: CommandObject):
+    if m.chat.type not in ("supergroup", "group"):
+        return
+    if not is_admin(m.from_user.id):
+        return
+
+    args = (command.args or "").split(maxsplit=1)
+    tail = args[1] if len(args) > 1 else ""
+    src = m.reply_to_message or m
+    text = admin_text(src, tail) if m.reply_to_message else tail.strip()
+    if not args or (src is m and not text and not m.caption):
+        await send_plain(
+            m.chat.id,
+            "Использование: /broadcast ЦЕЛЬ текст — или ответом на сообщение, которое нужно разослать.\n"
+            "ЦЕЛЬ: active — все, кто в диалоге; роль (editor, Редактор) — кому выдан тест и срок ещё не вышел; "
+            "123,456 — список id."
+        )
+        return
+
+    target = await broadcast_targets(args[0])
+    if target is None:
+        await send_plain(m.chat.id, f"Не понял цель «{args[0]}». Варианты: active, роль или список id через запятую.")
+        return
+    label, user_ids = target
+    if not user_ids:
+        await send_plain(m.chat.id, f"Получателей нет ({label}).")
+        return
+
+    token = secrets.token_hex(4)
+    confirm = await bot.send_message(
+        m.chat.id,
+        f"📣 Рассылка: {label} — {len(user_ids)} получ. Отправить?",
+        reply_markup=keyboard([("Отправить", f"bc:{token}:go"), ("Отмена", f"bc:{token}:no")]),
+        message_thread_id=m.message_thread_id if m.is_topic_message else None,
+        parse_mode=None,
+    )
+    _PENDING_BROADCASTS[token] = PendingBroadcast(
+        src, text, user_ids, label, [(m.chat.id, m.message_id), (m.chat.id, confirm.message_id)],
+    )
+
+
+@dp.callback_query(F.data.startswith("bc:"))
+async def admin_broadcast_confirm(c: CallbackQuery):
+    if not is_admin(c.from_user.id):
+        await c.answer()
+        return
+    try:
+        _, token, action = c.data.split(":")
+    except ValueError:
+        await c.answer()
+        return
+
+    job = _PENDING_BROADCASTS.pop(token, None)
+    if job is None:
+        await c.answer("Рассылка уже запущена или устарела.", show_alert=True)
+        return
+    if action != "go":
+        await c.message.edit_text("Рассылка отменена.", parse_mode=None)
+        await c.answer()
+        return
+
+    await c.answer("Рассылка запущена")
+    # может идти минуты: не держим очередь апдейтов куратора
+    task = asyncio.create_task(run_broadcast(job, c.message))
+    _BROADCAST_TASKS.add(task)
+    task.add_done_callback(_BROADCAST_TASKS.discard)
+
+
+_BROADCAST_TASKS: set[asyncio.Task] = set()
+# сообщение в группе -> рассылка, которая ещё идёт
+_RUNNING_BROADCASTS: dict[tuple[int, int], PendingBroadcast] = {}
+
+
+def _save_broadcast(job: PendingBroadcast, result: BroadcastResult) -> None:
+    record = BroadcastRecord(dict(result.sent), job.started_at, job.keys)
+    for key in job.keys:
+        BROADCAST_MAP[key] = record
+
+
+def _broadcast_report(job: PendingBroadcast, result: BroadcastResult, *, finished: bool) -> str:
+    head = "📣 Рассылка завершена" if finished else "📣 Рассылка идёт"
+    lines = [f"{head}: {job.label}", f"Доставлено {len(result.sent)} из {result.total}, ошибок {len(result.failed)}."]
+    if finished and result.failed:
+        by_reason: dict[str, list[int]] = {}
+        for uid, reason in result.failed.items():
+            by_reason.setdefault(reason, []).append(uid)
+        for reason, uids in by_reason.items():
+            shown = ", ".join(str(uid) for uid in uids[:20])
+            more = f" и ещё {len(uids) - 20}" if len(uids) > 20 else ""
+            lines.append(f"• {_BROADCAST_REASONS[reason]}: {shown}{more}")
+    if finished and result.sent:
+        lines.append("Отменить: /undo ответом на команду или на это сообщение.")
+    return "\n".join(lines)
+
+
+async def run_broadcast(job: PendingBroadcast, status: Message):
+    job.started_at = _now_ts()
+
+    async def send_one(user_id: int) -> list[int]:
+        # рассылка не должна тормозить ответы кандидатам
+        with prioritized(Priority.LOW):
+            return await deliver_admin_message(user_id, job.src, job.text)
+
+    async def progress(result: BroadcastResult) -> None:
+        _save_broadcast(job, result)
+        await status.edit_text(_broadcast_report(job, result, finished=False), parse_mode=None)
+
+    for key in job.keys:
+        _RUNNING_BROADCASTS[key] = job
+    try:
+        result = await fan_out(
+            job.user_ids, send_one,
+            concurrency=BROADCAST_CONCURRENCY,
+            on_progress=progress,
+            progress_every=BROADCAST_PROGRESS_SEC,
+        )
+        _save_broadcast(job, result)
+    finally:
+        for key in job.keys:
+            _RUNNING_BROADCASTS.pop(key, None)
+    log.info("Broadcast finished", extra={"sent": len(result.sent), "failed": len(result.failed)})
+    try:
+        await status.edit_text(_broadcast_report(job, result, finished=True), parse_mode=None)
+    except Exception as e:
+        log.warning("Broadcast report failed: %s", e)
+
+
+async def undo_broadcast(chat_id: int, key: tuple[int, int]):
+    record = BROADCAST_MAP.get(key)
+    if is_too_old(record.created_at, UNDO_TTL_HOURS * 3600):
+        await send_plain(chat_id, f"⌛ Рассылка слишком старая: удалить сообщения бота можно только {UNDO_TTL_HOURS} ч.")
+        return
+
+    batch = DeletionBatch(bot)
+    for user_id, message_ids in record.sent.items():
+        batch.extend(user_id, message_ids)
+    total = len(batch)
+    result = await batch.execute()
+
+    # запись лежит под командой и под сообщением с отчётом
+    for k in record.keys:
+        BROADCAST_MAP.pop(k, None)
+    # deleteMessages не говорит, каких id уже не было, — они тоже в result.deleted
+    if result.ok:
+        await send_plain(
+            chat_id,
+            f"✅ Рассылка отменена: удалено (или уже удалено самими) {result.deleted} сообщ. у {len(record.sent)} получ."
+        )
+    else:
+        await send_plain(
+            chat_id,
+            f"⚠️ Удалено (или уже удалено самими) {result.deleted} из {total}. "
+            f"У {len(result.failed)} получ. удалить не вышло (уже удалили сами или слишком старые)."
+        )
+
+# ---- /find: поиск по пересланным сообщениям ----
+
+def group_message_link(chat_id: int, message_id: int, thread_id: int | None = None) -> str | None:
+    """Ссылка t.me/c/... — работает только для супергрупп (id вида -100...)."""
+    s = str(chat_id)
+    if not s.startswith("-100"):
+        return None
+    if thread_id:
+        return f"https://t.me/c/{s[4:]}/{thread_id}/{message_id}"
+    return f"https://t.me/c/{s[4:]}/{message_id}"
+
+
+def _find_hit_line(n: int, hit) -> str:
+    when = datetime.fromtimestamp(hit.ts, timezone.utc).strftime("%d.%m.%Y %H:%M")
+    link = group_message_link(hit.chat_id, hit.message_id, hit.thread_id)
+    head = f'<a href="{link}">{when}</a>' if link else when
+    who = f"@{html.escape(hit.username)} " if hit.username else ""
+    snippet = " ".join(hit.text.split())
+    if len(snippet) > 120:
+        snippet = snippet[:120] + "…"
+    line = f"{n}. {head} · {role_title(hit.role) if hit.role else '—'} · {who}(id {hit.user_id})"
+    return f"{line}\n<i>{html.escape(snippet)}</i>" if snippet else line
+
+
+async def _find_page(qid: str, page: int):
+    query = _FIND_QUERIES.get(qid)
+    if query is None:
+        return None, None
+    hits = await message_index.search(query, limit=SEARCH_PAGE_SIZE + 1, offset=page * SEARCH_PAGE_SIZE)
+    has_next = len(hits) > SEARCH_PAGE_SIZE
+    hits = hits[:SEARCH_PAGE_SIZE]
+    if not hits:
+        return ("Ничего не нашлось." if page == 0 else "Больше результатов нет."), None
+
+    first = page * SEARCH_PAGE_SIZE + 1
+    lines = [f"🔎 Результаты {first}–{first + len(hits) - 1}:"]
+    lines += [_find_hit_line(first + i, hit) for i, hit in enumerate(hits)]
+
+    nav = []
+    if page > 0:
+        nav.append(("« Назад", f"find:{qid}:{page - 1}"))
+    if has_next:
+        nav.append(("Дальше »", f"find:{qid}:{page + 1}"))
+    return "\n\n".join(lines), (keyboard(nav) if nav else None)
+
+
+@dp.message(Command("find"))
+async def admin_find(m: Message, command: CommandObject):
+    if m.chat.type not in ("supergroup", "group"):
+        return
+    if not is_admin(m.from_user.id):
+        return
+
+    query = parse_query(command.args or "", {k: v["title"] for k, v in ROLE_INFO.items()})
+    if not query:
+        await send_plain(
+            m.chat.id,
+            "Использование: /find запрос\n"
+            "Например: /find 123456789, /find @nick, /find редактор тест, /find перевод*"
+        )
+        return
+
+    qid = secrets.token_hex(4)
+    _FIND_QUERIES[qid] = query
+    text, markup = await _find_page(qid, 0)
+    await bot.send_message(
+        m.chat.id, text,
+        reply_markup=markup,
+        message_thread_id=m.message_thread_id if m.is_topic_message else None,
+        disable_web_page_preview=True,
+    )
+
+
+@dp.callback_query(F.data.startswith("find:"))
+async def admin_find_page(c: CallbackQuery):
+    if not is_admin(c.from_user.id):
+        await c.answer()
+        return
+    try:
+        _, qid, page = c.data.split(":")
+        page = max(0, int(page))
+    except ValueError:
+        await c.answer()
+        return
+
+    text, markup = await _find_page(qid, page)
+    if text is None:
+        await c.answer("Поиск устарел — повторите /find.", show_alert=True)
+        return
+    try:
+        await c.message.edit_text(text, reply_markup=markup, disable_web_page_preview=True)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e).lower():
+            raise
+    await c.answer()
+
+# ---- /stats: воронка набора ----
+
+_FUNNEL_STEPS = (
+    (Event.VACANCY, "вакансия"),
+    (Event.APPLY, "анкета"),
+    (Event.TEST, "тест"),
+    (Event.MESSAGE, "написали"),
+    (Event.FILE, "файл"),
+)
+
+
+def _funnel_line(title: str, entered: int, counts: dict[Event, int]) -> str:
+    # доля — от пришедших в когорту: шаги можно пропускать (анкета без описания вакансии)
+    steps = [f"{label} {counts[event]} ({counts[event] * 100 // entered}%)" for event, label in _FUNNEL_STEPS]
+    return f"<b>{html.escape(title)}</b>: пришли {entered} → " + " → ".join(steps)
+
+
+@dp.message(Command("stats"))
+async def admin_stats(m: Message, command: CommandObject):
+    if m.chat.type not in ("supergroup", "group"):
+        return
+    if not is_admin(m.from_user.id):
+        return
+
+    arg = (command.args or "7").strip().lower()
+    if arg == "all":
+        since, period = 0, f"за всё время (до {ANALYTICS_RETENTION_DAYS} дн.)"
+    elif arg.isdigit() and int(arg) > 0:
+        days = int(arg)
+        # сегодняшний день считается целиком, поэтому «1» — это только сегодня (UTC)
+        since, period = _now_ts() - (days - 1) * DAY, f"за {days} дн."
+    else:
+        await send_plain(m.chat.id, "Использование: /stats [дни|all], по умолчанию 7 дней")
+        return
+
+    funnel = analytics.funnel(since)
+    lines = [
+        f"📊 Воронка {period}: кто впервые пришёл к роли в этот период (UTC) "
+        "и до каких шагов дошёл к сегодняшнему дню"
+    ]
+    total_entered, total = 0, dict.fromkeys(Event, 0)
+    for code in sorted(funnel):
+        entered, counts = funnel[code]
+        if not entered:
+            continue
+        title = role_title(Role(code).key) if code else "без роли"
+        lines.append(_funnel_line(title, entered, counts))
+        total_entered += entered
+        for event, n in counts.items():
+            total[event] += n
+    if not total_entered:
+        lines.append("Событий пока нет.")
+    else:
+        lines.append(_funnel_line("Всего по ролям", total_entered, total))
+
+    await bot.send_message(
+        m.chat.id, "\n".join(lines),
+        message_thread_id=m.message_thread_id if m.is_topic_message else None,
+    )
+
 # ---- Кнопки и экраны ----
 
 @dp.callback_query(F.data == "about")
@@ -744,31 +1692,7 @@ async def on_about(c: CallbackQuery):
         await c.answer("Притормози, лисёнок...")
         return
 
-    about_html = (
-        "<b>Tales of Kitsune</b> — команда, которая переводит манхвы с любовью к оригиналу и уважением к читателю.\n\n"
-        "<b>Работаем за спасибо.</b>\n"
-        "Наш проект некоммерческий: здесь нет зарплат, премий и прочих земных наград.\n"
-        "Мы трудимся ради удовольствия творить и ради тех, кто хочет читать эти истории свободно — так, как их задумали авторы.\n\n"
-        "<b>Берём кандидатов без опыта.</b>\n"
-        "Не умеешь чистить, вставлять текст или спорить со шрифтами — научим.\n"
-        "Умеешь — тем лучше, сбережём немного нервов и времени для сна.\n"
-        "Главное — желание делать хорошо. Остальное приходит с практикой, терпением и парой ночей в компании таинственного файла «финал_3_точно_последний.psd».\n\n"
-        "<b>Требования:</b>\n"
-        "• Пара свободных часов в неделю\n"
-        "• Ответственность и уважение к срокам\n"
-        "• Возраст от 16 лет\n"
-        "• Прохождение тестового задания"
-    )
-
-    await render_screen(
-        c.from_user.id,
-        c.message.chat.id,
-        about_html,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="« Назад", callback_data="back:menu"),
-             InlineKeyboardButton(text="Подать заявку", callback_data="apply")]
-        ])
-    )
+    await show_screen(c.from_user.id, c.message.chat.id, SCREENS["about"], source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -778,29 +1702,17 @@ async def on_apply(c: CallbackQuery):
         await c.answer("Притормози, лисёнок...")
         return
 
-    st = STATE.setdefault(
-        c.from_user.id,
-        {"flow": None, "role": None, "deadline": None,
-         "msg_id": None, "chat_id": None, "active": False},
-    )
+    st = user_session(c.from_user.id)
 
-    if not st.get("active", False):
+    if not st.active:
         await c.answer(
             "Подача заявок для тебя сейчас закрыта.\nНабери /start, чтобы открыть её снова.",
             show_alert=True,
         )
         return
 
-    st.update({"flow": "apply", "role": None})
-    await render_screen(
-        c.from_user.id,
-        c.message.chat.id,
-        """        ㅤ        Выбери направление,ㅤ
-        ㅤв котором раскроетсяㅤ
-        ㅤтвой талант под пред-ㅤ
-        ㅤводительством кицунэ.ㅤ""",
-        reply_markup=apply_roles_keyboard()
-    )
+    st.flow, st.role = Flow.APPLY, None
+    await show_screen(c.from_user.id, c.message.chat.id, SCREENS["apply"], source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -809,10 +1721,9 @@ async def on_vacancies(c: CallbackQuery):
     if _cb_too_fast_for_key(c.from_user.id, c.data):
         await c.answer("Притормози, лисёнок...")
         return
-    st = STATE.setdefault(c.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
-    st.update({"flow": "vacancies", "role": None})
-    await render_screen(c.from_user.id, c.message.chat.id, "Выбери специальность:", reply_markup=vacancies_keyboard())
+    st = user_session(c.from_user.id)
+    st.flow, st.role = Flow.VACANCIES, None
+    await show_screen(c.from_user.id, c.message.chat.id, SCREENS["vacancies"], source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -821,19 +1732,9 @@ async def on_back_menu(c: CallbackQuery):
     if _cb_too_fast_for_key(c.from_user.id, c.data):
         await c.answer("Притормози, лисёнок...")
         return
-    st = STATE.setdefault(c.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
-    st.update({"flow": None, "role": None})
-    await render_screen(
-        c.from_user.id, c.message.chat.id,
-        """ㅤㅤㅤ🐾『𝐓𝐚𝐥𝐞𝐬 𝐨𝐟 𝐊𝐢𝐭𝐬𝐮𝐧𝐞』 🐾
-        ㅤУзнай легенды логова иㅤ
-        правила его обитателей, аㅤ
-        затем оставь свою заявку,ㅤ
-        если готов присоединить-
-        ㅤся к стае.༄˖°.🍂.ೃ࿔*:･ㅤ""",
-        reply_markup=main_menu()
-    )
+    st = user_session(c.from_user.id)
+    st.flow, st.role = Flow.NONE, None
+    await show_screen(c.from_user.id, c.message.chat.id, SCREENS["menu"], source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -842,18 +1743,9 @@ async def on_back_applyroles(c: CallbackQuery):
     if _cb_too_fast_for_key(c.from_user.id, c.data):
         await c.answer("Притормози, лисёнок...")
         return
-    st = STATE.setdefault(c.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
-    st.update({"flow": "apply", "role": None})
-    await render_screen(
-        c.from_user.id,
-        c.message.chat.id,
-        """        ㅤ        Выбери направление,ㅤ
-        ㅤв котором раскроетсяㅤ
-        ㅤтвой талант под пред-ㅤ
-        ㅤводительством кицунэ.ㅤ""",
-        reply_markup=apply_roles_keyboard()
-    )
+    st = user_session(c.from_user.id)
+    st.flow, st.role = Flow.APPLY, None
+    await show_screen(c.from_user.id, c.message.chat.id, SCREENS["apply"], source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -863,16 +1755,16 @@ async def vacancy_show(c: CallbackQuery):
         await c.answer("Притормози, лисёнок...")
         return
     key = c.data.split(":", 1)[1]
-    st = STATE.setdefault(c.from_user.id, {"flow": None, "role": None, "deadline": None,
-                                            "msg_id": None, "chat_id": None, "active": False})
-    st["role"] = key
+    screen = SCREENS.get(f"vacancy:{key}")
+    if not screen:
+        await c.answer()
+        return
+    st = user_session(c.from_user.id)
+    st.role = Role.from_key(key)
     USER_LAST_ROLE[c.from_user.id] = key
+    track(Event.VACANCY, c.from_user.id, key)
 
-    await render_screen(
-        c.from_user.id, c.message.chat.id,
-        role_desc_block(key),
-        reply_markup=back_and_apply_small()
-    )
+    await show_screen(c.from_user.id, c.message.chat.id, screen, source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -883,27 +1775,24 @@ async def apply_role_intro(c: CallbackQuery):
         return
 
     key = c.data.split(":", 1)[1]
-    st = STATE.setdefault(
-        c.from_user.id,
-        {"flow": None, "role": None, "deadline": None,
-         "msg_id": None, "chat_id": None, "active": False},
-    )
+    screen = SCREENS.get(f"apply:{key}")
+    if not screen:
+        await c.answer()
+        return
+    st = user_session(c.from_user.id)
 
-    if not st.get("active", False):
+    if not st.active:
         await c.answer(
             "Подача заявок для тебя сейчас закрыта.\nНабери /start, чтобы открыть её снова.",
             show_alert=True,
         )
         return
 
-    st["role"] = key
+    st.role = Role.from_key(key)
     USER_LAST_ROLE[c.from_user.id] = key
+    track(Event.APPLY, c.from_user.id, key)
 
-    await render_screen(
-        c.from_user.id, c.message.chat.id,
-        apply_info_block(key),
-        reply_markup=start_test_keyboard(key)
-    )
+    await show_screen(c.from_user.id, c.message.chat.id, screen, source_msg_id=c.message.message_id)
     await c.answer()
 
 
@@ -914,64 +1803,34 @@ async def start_test(c: CallbackQuery):
         return
 
     key = c.data.split(":", 1)[1]
-    info = ROLE_INFO.get(key, {})
-    folder = info.get("test_folder", "")
-    guide = info.get("guide", "")
+    screen = SCREENS.get(f"test:{key}")
+    if not screen:
+        await c.answer()
+        return
 
-    st = STATE.setdefault(
-        c.from_user.id,
-        {"flow": None, "role": None, "deadline": None,
-         "msg_id": None, "chat_id": None, "active": False},
-    )
+    st = user_session(c.from_user.id)
 
-    if not st.get("active", False):
+    if not st.active:
         await c.answer(
             "Подача заявок для тебя сейчас закрыта.\nНабери /start, чтобы открыть её снова.",
             show_alert=True,
         )
         return
 
-    st["deadline"] = datetime.now(timezone.utc)
-    st["role"] = key
+    started_at = datetime.now(timezone.utc)
+    deadline = started_at + timedelta(days=TEST_DEADLINE_DAYS)
+    # повторное нажатие не переносит дедлайн и не дублирует напоминание
+    is_new = deadlines.schedule(c.from_user.id, key, deadline.timestamp())
+    if is_new:
+        st.deadline = started_at.timestamp()
+        track(Event.TEST, c.from_user.id, key)
+    st.role = Role.from_key(key)
     USER_LAST_ROLE[c.from_user.id] = key
 
-    title = role_title(key)
-
-    lines = [
-        f"<b>{title}</b>",
-        "Заполните анкету по форме ниже и прикрепите к ней тестовый файл "
-        "(тестовое задание для кураторов отсутствует):",
-        "1. Имя (при желании указать).",
-        "2. Ник (как к вам обращаться).",
-        "3. Наличие/отсутствие опыта (при желании указать). При подаче заявки на куратора указывать обязательно.",
-        "4. Количество свободного времени в неделю.",
-        "5. Дополнительные полезные навыки/знания (работа в приложениях, с нейросетями, знание EXCEL/Google docs и прочее).",
-        "6*. Укажите язык, с которого был выполнен перевод (пункт для переводчиков).",
-        "",
-    ]
-
-    if folder:
-        lines.append(f"<b>Папка с тестовым заданием:</b> {folder}")
-    else:
-        lines.append("<b>Папка с тестовым заданием:</b> отсутствует для этой роли.")
-
-    if guide:
-        lines.append(f"<b>Правила выполнения задания:</b> {guide}")
+    await show_screen(c.from_user.id, c.message.chat.id, screen, source_msg_id=c.message.message_id)
 
-    lines.append(f"<b>Методичка:</b> {EXTRA_GUIDE_URL}")
-    lines.append(f"<b>Дедлайн:</b> {TEST_DEADLINE_DAYS} дня.")
-
-    text = "\n".join(lines)
-
-    await render_screen(
-        c.from_user.id, c.message.chat.id,
-        text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="« Назад", callback_data="back:applyroles")]
-        ])
-    )
-
-    asyncio.create_task(schedule_deadline_notify(c.from_user.id, key, st["deadline"]))
+    if is_new:
+        deadline_digest.assigned(key, c.from_user.id)
     await c.answer("Тест выдан")
 
 # ---- /pm для админов ----
@@ -990,8 +1849,13 @@ async def admin_pm(m: Message, command: CommandObject):
         return
 
     replied_user_id = None
+    reply_too_old = False
     if m.reply_to_message:
-        replied_user_id = REPLY_MAP.get((m.chat.id, m.reply_to_message.message_id))
+        target = REPLY_MAP.get((m.chat.id, m.reply_to_message.message_id))
+        if target:
+            reply_too_old = is_too_old(target.created_at, REPLY_TTL_DAYS * 86400)
+            if not reply_too_old:
+                replied_user_id = target.user_id
 
     user_id = None
     tail_text = ""
@@ -1001,13 +1865,16 @@ async def admin_pm(m: Message, command: CommandObject):
     elif replied_user_id:
         user_id = replied_user_id
         tail_text = (args[0].strip() if args else "")
+    elif reply_too_old:
+        await send_plain(m.chat.id, REPLY_TOO_OLD_TEXT)
+        return
     else:
         await send_plain(m.chat.id, "Айди должен быть числом. Пример: /pm 123456789 Привет\nИли просто ответьте на сообщение кандидата.")
         return
 
     try:
         await send_admin_message_to_user(user_id, m, tail_text)
-        await send_plain(m.chat.id, "✅ Сообщение отправлено пользователю.")
+        await send_plain(m.chat.id, "✅ Сообщение отправлено пользователю.", priority=Priority.LOW)
     except Exception as e:
         await send_plain(m.chat.id, f"⚠️ Не удалось отправить: {e}")
 
@@ -1019,21 +1886,15 @@ async def admin_reply_by_swipe(m: Message):
         return
 
     # если это /pm, то обработку делает admin_pm, а здесь не трогаем
-    txt_self = (m.text or m.caption or "").strip()
-    if txt_self.startswith("/pm"):
+    if _PM_COMMAND.match(m.text or m.caption or ""):
         return
 
     key = (m.chat.id, m.reply_to_message.message_id)
-    user_id = REPLY_MAP.get(key)
-
-    if not user_id:
-        try:
-            txt = m.reply_to_message.text or m.reply_to_message.caption or ""
-            mobj = re.search(r"id\s+(\d{6,})", txt)
-            if mobj:
-                user_id = int(mobj.group(1))
-        except Exception:
-            pass
+    target = REPLY_MAP.get(key)
+    if target and is_too_old(target.created_at, REPLY_TTL_DAYS * 86400):
+        await send_plain(m.chat.id, REPLY_TOO_OLD_TEXT)
+        return
+    user_id = target.user_id if target else None
 
     if not user_id:
         await send_plain(m.chat.id, "Использование: ответьте на сообщение кандидата в этой теме, тогда я пойму, кому отправить.")
@@ -1041,12 +1902,141 @@ async def admin_reply_by_swipe(m: Message):
 
     try:
         await send_admin_message_to_user(user_id, m)
-        await send_plain(m.chat.id, "✅ Сообщение отправлено пользователю.")
+        await send_plain(m.chat.id, "✅ Сообщение отправлено пользователю.", priority=Priority.LOW)
     except Exception as e:
         await send_plain(m.chat.id, f"⚠️ Не удалось отправить: {e}")
 
 # ---- ЛС от юзеров: сбор и пересылка ----
 
+def _forward_role(user_id: int) -> str | None:
+    st = STATE.get(user_id)
+    return (st and st.role_key) or USER_LAST_ROLE.get(user_id)
+
+
+def _forward_target(user_id: int, role_key: str | None = None) -> tuple[str | None, str, int | None]:
+    role_key = role_key or _forward_role(user_id)
+    role_title_text = role_title(role_key) if role_key else "—"
+    thread_id = ROLE_TOPICS.get(role_key) if role_key else None
+    return role_key, role_title_text, thread_id
+
+
+def record_forwarded(role_key: str | None, thread_id: int | None, group_ids: list[int], parts: list[Message]):
+    """
+    Доставленное кураторам: запись для /find (ссылка ведёт на первое
+    сообщение пересылки в группе) и события воронки для /stats.
+    """
+    user = parts[0].from_user
+    text = "\n\n".join(p.text or p.caption for p in parts if p.text or p.caption)
+    track(Event.MESSAGE, user.id, role_key)
+    if any(p.content_type in CAPTIONED for p in parts):
+        track(Event.FILE, user.id, role_key)
+    try:
+        message_index.add(
+            chat_id=GROUP_ID,
+            message_id=group_ids[0],
+            thread_id=thread_id,
+            user_id=user.id,
+            username=user.username,
+            role=role_key,
+            ts=_now_ts(),
+            text=text,
+        )
+    except Exception as e:
+        log.warning("Index add failed: %s", e)
+
+
+async def _confirm_delivery(chat_id: int, delivered: bool, *, missing: int = 0, total: int = 0):
+    """missing из total — часть альбома дошла, часть нет."""
+    try:
+        if delivered and missing:
+            await send_plain(
+                chat_id,
+                f"Кураторам дошла только часть альбома: {total - missing} из {total}. "
+                "Пришлите ещё раз только недостающие файлы, весь альбом повторять не нужно."
+            )
+        elif delivered:
+            await send_plain(chat_id, "Сообщение доставлено кураторам.", priority=Priority.LOW)
+        else:
+            await send_plain(chat_id, "Не получилось доставить сообщение кураторам. Попробуйте ещё раз позже.")
+    except Exception:
+        pass
+
+
+async def forward_album(key, parts: list[Message]):
+    """Все части одного альбома: один пост в группе и одно подтверждение."""
+    parts.sort(key=lambda p: p.message_id)
+    chat_id = parts[0].chat.id
+    role_key, role_title_text, thread_id = _forward_target(parts[0].from_user.id)
+
+    ids: list[int] = []
+    missing = 0
+    try:
+        if GROUP_ID:
+            ids = await send_album_to_group(parts, role_title_text, thread_id)
+            if not ids:
+                # например, смешанный альбом, который Telegram не принял целиком
+                ids, missing = await copy_album_to_group(parts, role_title_text, thread_id)
+    except Exception as e:
+        log.exception("Album forward error: %s", e)
+
+    if ids:
+        record_forwarded(role_key, thread_id, ids, parts)
+    await _confirm_delivery(chat_id, bool(ids), missing=missing, total=len(parts))
+
+
+# в альбоме не больше 10 элементов — полный альбом отправляем сразу, без ожидания
+albums = IdleBatcher(forward_album, idle=ALBUM_WINDOW_SEC, max_items=10)
+
+
+async def forward_digest(user_id: int, parts: list[Message]):
+    """Сообщения сверх лимита: одна сводка в группе и одно подтверждение."""
+    parts.sort(key=lambda p: p.message_id)
+    user = parts[0].from_user
+    role_key, role_title_text, thread_id = _forward_target(user_id)
+
+    header = f"{user_header(user, role_title_text)}\n⚠️ Много сообщений подряд ({len(parts)}) — собраны в одно"
+    if flood.is_muted(user_id):
+        header += f"\n🔇 Следующие {FLOOD_MUTE_MIN:g} мин. сообщения не пересылаются (/unban {user_id} — снять)"
+
+    ids: list[int] = []
+    try:
+        ids = await send_digest_to_group(parts, header, thread_id)
+    except Exception as e:
+        log.exception("Digest forward error: %s", e)
+
+    if ids:
+        record_forwarded(role_key, thread_id, ids, parts)
+    await _confirm_delivery(parts[0].chat.id, bool(ids))
+
+
+# 100 — предел copyMessages за один вызов
+digests = IdleBatcher(forward_digest, idle=FLOOD_DIGEST_SEC, max_items=100)
+
+
+async def forward_texts(key, parts: list[Message]):
+    """Тексты одного кандидата по одной роли, пришедшие подряд: один пост и одно подтверждение."""
+    parts.sort(key=lambda p: p.message_id)
+    user = parts[0].from_user
+    # роль — та, что была, когда пришли сообщения
+    role_key, role_title_text, thread_id = _forward_target(*key)
+
+    ids: list[int] = []
+    try:
+        if len(parts) == 1:
+            ids = await send_combined_user_message_to_group(parts[0], role_title_text, thread_id)
+        else:
+            ids = await send_digest_to_group(parts, user_header(user, role_title_text), thread_id)
+    except Exception as e:
+        log.exception("Forward error: %s", e)
+
+    if ids:
+        record_forwarded(role_key, thread_id, ids, parts)
+    await _confirm_delivery(parts[0].chat.id, bool(ids))
+
+
+texts = IdleBatcher(forward_texts, idle=TEXT_BATCH_SEC, max_items=50)
+
+
 @dp.message()
 async def collect_and_forward(m: Message):
     if m.chat.type != "private":
@@ -1056,32 +2046,69 @@ async def collect_and_forward(m: Message):
     if m.from_user.id in BANNED_IDS:
         return
 
-    st = STATE.get(m.from_user.id) or {}
-    if not st.get("active", False):
+    st = STATE.get(m.from_user.id)
+    if not st or not st.active:
         return
 
-    role_key = st.get("role") or USER_LAST_ROLE.get(m.from_user.id)
-    role_title_text = role_title(role_key) if role_key else "—"
-    thread_id = ROLE_TOPICS.get(role_key) if role_key else None
+    # остальные части уже начатого альбома — туда же, лимит альбом расходует один раз
+    album_key = (m.chat.id, m.media_group_id) if m.media_group_id else None
+    if album_key in albums:
+        albums.add(album_key, m)
+        return
+
+    text_key = (m.from_user.id, _forward_role(m.from_user.id))
+    verdict = flood.check(m.from_user.id)
+    if verdict is Verdict.MUTED:
+        return
+    # текст, дописанный к ещё не отправленному посту, и так уйдёт одним сообщением —
+    # в сводку его не уводим, но токен он тратит: иначе пачками можно флудить без мьюта
+    if m.text and text_key in texts and verdict is not Verdict.MUTE:
+        texts.add(text_key, m)
+        return
+    if verdict is not Verdict.PASS:
+        if verdict is Verdict.MUTE:
+            # собранное до мьюта уходит раньше сводки
+            pending = texts.flush(text_key)
+            if pending:
+                await pending
+        digests.add(m.from_user.id, m)
+        if verdict is Verdict.MUTE:
+            digests.flush(m.from_user.id)
+            await send_plain(
+                m.chat.id,
+                "Слишком много сообщений подряд. Всё, что уже пришло, передано кураторам одной сводкой, "
+                f"а следующие {FLOOD_MUTE_MIN:g} мин. бот пересылать сообщения не будет."
+            )
+        return
+
+    if m.text:
+        texts.add(text_key, m)
+        return
+    # вложение после текстов: сначала отправляем тексты, чтобы не нарушить порядок
+    pending = texts.flush(text_key)
+    if pending:
+        await pending
+
+    if album_key:
+        albums.add(album_key, m)
+        return
 
-    delivered = False
+    role_key, role_title_text, thread_id = _forward_target(m.from_user.id)
+
+    ids: list[int] = []
     try:
         if GROUP_ID:
-            delivered = await send_combined_user_message_to_group(
+            ids = await send_combined_user_message_to_group(
                 m,
                 role_title_text,
                 thread_id,
             )
     except Exception as e:
-        print("Forward error:", e)
+        log.exception("Forward error: %s", e)
 
-    try:
-        if delivered:
-            await send_plain(m.chat.id, "Сообщение доставлено кураторам.")
-        else:
-            await send_plain(m.chat.id, "Не получилось доставить сообщение кураторам. Попробуйте ещё раз позже.")
-    except Exception:
-        pass
+    if ids:
+        record_forwarded(role_key, thread_id, ids, [m])
+    await _confirm_delivery(m.chat.id, bool(ids))
 
 # ============ COMMAND SUGGESTIONS (slash menu) ============
 
@@ -1100,6 +2127,9 @@ async def setup_commands():
         BotCommand(command="unban", description="Разбанить пользователя: /unban ID"),
         BotCommand(command="topicid", description="Показать ID текущей темы"),
         BotCommand(command="undo", description="Удалить сообщение бота у кандидата"),
+        BotCommand(command="find", description="Поиск сообщений кандидатов: /find запрос"),
+        BotCommand(command="broadcast", description="Рассылка кандидатам: /broadcast цель текст"),
+        BotCommand(command="stats", description="Воронка набора: /stats [дни|all]"),
     ]
     await bot.set_my_commands(admin_cmds, scope=BotCommandScopeAllChatAdministrators())
 
@@ -1113,9 +2143,14 @@ async def help_cmd(m: Message):
             "— ответьте на сообщение кандидата в этой теме, чтобы написать ему в ЛС\n"
             "/pm ID [текст] – отправить ЛС пользователю по ID\n"
             "/ban ID – запретить писать боту и отключить пересылку\n"
-            "/unban ID – снять запрет\n"
+            "/unban ID – снять запрет или мьют за флуд\n"
             "/topicid – показать ID темы для привязки вакансий\n"
             "/undo – удалить сообщение бота в ЛС кандидата (ответом на исходное сообщение)\n"
+            "/find запрос – найти сообщения кандидатов: id, @ник, роль, слова (слово* — по началу)\n"
+            "/broadcast цель текст – рассылка: active, роль (у кого идёт тест) или id через запятую; "
+            "/undo ответом на команду отменяет\n"
+            "/stats [дни|all] – воронка по ролям для пришедших за период: вакансия → анкета → тест → написали → файл "
+            "(по умолчанию 7 дней)\n"
             "\nПодсказка: упоминания @username в группах — это просто тег. Для ЛС используйте ответ или ID."
         )
         await send_plain(m.chat.id, text)
@@ -1128,57 +2163,165 @@ async def help_cmd(m: Message):
         )
         await send_plain(m.chat.id, text)
 
-# ============ FAKE HTTP FOR RENDER ============
+# ============ HEALTH / METRICS ============
 
-class _Handler(BaseHTTPRequestHandler):
-    def _ok(self):
-        body = b"OK"
-        self.send_response(200)
-        self.send_header("Content-Type", "text/plain")
-        self.send_header("Content-Length", str(len(body)))
-        self.end_headers()
-        return body
+health = Health(mode=MODE)
+bot.session.middleware(HeartbeatMiddleware(health))
 
-    def do_GET(self):
-        if self.path in ("/", "/healthz"):
-            self.wfile.write(self._ok())
-        else:
-            self.send_response(404); self.end_headers()
+CallbackMetric("outbox_queue_depth", "Outgoing requests waiting in the outbox", outbox.depth)
+CallbackMetric(
+    "outbox_requests", "Outbox requests by outcome",
+    lambda: [((k,), outbox.stats()[k]) for k in ("sent", "failed", "retried")],
+    labels=("outcome",), kind="counter",
+)
+CallbackMetric(
+    "outbox_latency_seconds", "Outbox enqueue-to-done latency over recent requests",
+    lambda: [((q,), outbox.stats()[f"latency_p{int(float(q) * 100)}"]) for q in ("0.5", "0.99")],
+    labels=("quantile",),
+)
+CallbackMetric(
+    "cache_entries", "Entries held by bounded caches",
+    lambda: [((name,), st["size"]) for name, st in cache_stats().items()],
+    labels=("cache",),
+)
+CallbackMetric(
+    "cache_evictions", "Entries dropped by bounded caches",
+    lambda: [((name, why), st[why]) for name, st in cache_stats().items() for why in ("evictions", "expirations")],
+    labels=("cache", "reason"), kind="counter",
+)
+CallbackMetric("updates_queued", "Updates waiting for or running in their user/thread lane", updates.queued)
+CallbackMetric("update_lanes", "Users and group threads with updates in progress", updates.lanes)
+CallbackMetric("updates_parked", "Handlers waiting on the outbox without a global slot", lambda: updates.parked)
+CallbackMetric("inbound_muted_users", "Candidates temporarily muted for flooding", flood.muted)
+CallbackMetric("deadlines_pending", "Test deadlines waiting to fire", lambda: len(deadlines))
+CallbackMetric("event_loop_lag_seconds", "Event loop scheduling lag", lambda: health.loop_lag)
+
+async def run_polling():
+    try:
+        # накопившееся за время деплоя не выбрасываем
+        await bot.delete_webhook(drop_pending_updates=False)
+    except Exception:
+        pass
 
-    def do_HEAD(self):
-        if self.path in ("/", "/healthz"):
-            self._ok()
+    runner = await serve(build_app(health), PORT)
+    log.info("Bot polling…")
+    # сигналы и закрытие сессии — на lifecycle и main(), иначе сессия закроется до дренажа
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, close_bot_session=False))
+    stop = asyncio.create_task(lifecycle.stopping.wait())
+    try:
+        done, _ = await asyncio.wait({polling, stop}, return_when=asyncio.FIRST_COMPLETED)
+        if polling in done:
+            polling.result()
         else:
-            self.send_response(404); self.end_headers()
+            await dp.stop_polling()
+            await polling
+    finally:
+        stop.cancel()
+        await runner.cleanup()
+
 
-    def log_message(self, fmt, *args):
+async def confirm_processed_updates():
+    """
+    Последнюю пачку апдейтов Telegram считает подтверждённой только при
+    следующем getUpdates. Подтверждаем сами, чтобы после рестарта не
+    обработать их второй раз.
+    """
+    if lifecycle.last_update_id is None:
         return
+    try:
+        await bot.get_updates(offset=lifecycle.last_update_id + 1, limit=1, timeout=0)
+    except Exception as e:
+        log.warning("Failed to confirm processed updates: %s", e)
 
-def start_http():
-    srv = HTTPServer(("0.0.0.0", PORT), _Handler)
-    print(f"HTTP server on {PORT}")
-    srv.serve_forever()
 
-async def main():
+async def run_webhook():
+    app = build_app(health)
+    webhook = add_webhook(
+        app, dp, bot,
+        path=WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        max_backlog=WEBHOOK_MAX_BACKLOG,
+    )
+    runner = await serve(app, PORT)
+
     try:
-        await bot.delete_webhook(drop_pending_updates=True)
-    except Exception:
-        pass
+        await bot.set_webhook(
+            WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=min(WEBHOOK_MAX_CONCURRENCY, 100),
+            allowed_updates=dp.resolve_used_update_types(),
+            drop_pending_updates=False,
+        )
+        health.touch()
+        log.info("Bot webhook: %s%s", WEBHOOK_BASE_URL.rstrip("/"), WEBHOOK_PATH)
+        await lifecycle.stopping.wait()
+    finally:
+        # новые апдейты больше не принимаем: Telegram повторит их следующему экземпляру
+        await runner.cleanup()
+        # а принятые уже подтверждены — их надо обработать здесь
+        await lifecycle.wait_idle("webhook backlog", webhook.backlog)
 
+
+async def main():
+    lifecycle.install_signals()
     try:
         me = await bot.get_me()
-        print(f"Running bot: @{me.username} (id {me.id})")
+        log.info("Running bot: @%s (id %s)", me.username, me.id)
     except Exception:
         pass
 
     try:
         await setup_commands()
     except Exception as e:
-        print("setup_commands failed:", e)
+        log.warning("setup_commands failed: %s", e)
+
+    flusher = asyncio.create_task(storage.run(STORAGE_FLUSH_SEC))
+    index_task = asyncio.create_task(message_index.run(STORAGE_FLUSH_SEC))
+    analytics_task = asyncio.create_task(analytics.run(STORAGE_FLUSH_SEC))
+    # просроченные за время простоя напоминания уйдут сразу
+    deadline_task = asyncio.create_task(deadlines.run())
+    digest_task = asyncio.create_task(deadline_digest.run())
+    # подтянутый ник попадёт в сводку при следующей перерисовке
+    profile_task = asyncio.create_task(profiles.run(PROFILE_REFRESH_SEC, on_fetched=deadline_digest.changed))
+    lag_task = asyncio.create_task(health.watch_loop())
+    summary_task = asyncio.create_task(log_summary(METRICS_LOG_INTERVAL)) if METRICS_LOG_INTERVAL > 0 else None
+    try:
+        if MODE == "webhook":
+            await run_webhook()
+        else:
+            await run_polling()
+    finally:
+        lifecycle.request_stop()
+        drained = await lifecycle.wait_idle("handlers", lambda: lifecycle.active)
+        drained = await lifecycle.wait_idle("broadcasts", lambda: len(_BROADCAST_TASKS)) and drained
+        # недособранные альбомы и сводки не теряем
+        await texts.flush_all()
+        await albums.flush_all()
+        await digests.flush_all()
+        digest_task.cancel()
+        profile_task.cancel()
+        await deadline_digest.flush()
+        drained = await lifecycle.wait_idle("outbox", outbox.pending) and drained
+        if MODE == "polling" and drained:
+            await confirm_processed_updates()
+        log.info(
+            "Drained in %.2fs", lifecycle.elapsed(),
+            extra={"complete": drained, "updates_left": lifecycle.active, "outbox_left": outbox.pending()},
+        )
 
-    Thread(target=start_http, daemon=True).start()
-    print("Bot polling…")
-    await dp.start_polling(bot)
+        index_task.cancel()
+        message_index.close()
+        analytics_task.cancel()
+        analytics.close()
+        if summary_task:
+            summary_task.cancel()
+        lag_task.cancel()
+        deadline_task.cancel()
+        flusher.cancel()
+        # состояние, баны, карты ответов — на диск
+        storage.close()
+        await bot.session.close()
+        shutdown_logging()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,87 @@
+"""
+Рассылка одного сообщения многим пользователям.
+
+fan_out отправляет через send_one каждому получателю: concurrency
+воркеров по очереди разбирают общий список, так что число задач
+не зависит от размера аудитории. Темп и лимиты Telegram (в том числе
+RetryAfter) соблюдает outbox — сюда он доходит уже как очередь запросов,
+поэтому рассылку стоит запускать с низким приоритетом. Ошибки по
+получателю не прерывают рассылку: собираются в result.failed с причиной.
+"""
+import asyncio
+from time import monotonic
+from typing import Awaitable, Callable
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+from logs import get_logger
+from metrics import Counter
+
+log = get_logger("broadcast")
+
+BROADCAST_MESSAGES = Counter("broadcast_messages", "Broadcast deliveries by outcome", ("result",))
+
+
+def failure_reason(exc: Exception) -> str:
+    """Короткий код причины: blocked, deactivated, not_found или error."""
+    text = str(exc).lower()
+    if isinstance(exc, TelegramForbiddenError):
+        if "deactivated" in text:
+            return "deactivated"
+        return "blocked"
+    if isinstance(exc, TelegramBadRequest) and "chat not found" in text:
+        return "not_found"
+    return "error"
+
+
+class BroadcastResult:
+    __slots__ = ("total", "sent", "failed")
+
+    def __init__(self, total: int):
+        self.total = total
+        # user_id -> id отправленных ему сообщений (для отмены)
+        self.sent: dict[int, list[int]] = {}
+        # user_id -> код причины (failure_reason)
+        self.failed: dict[int, str] = {}
+
+    @property
+    def done(self) -> int:
+        return len(self.sent) + len(self.failed)
+
+
+async def fan_out(
+    user_ids: list[int],
+    send_one: Callable[[int], Awaitable[list[int]]],
+    *,
+    concurrency: int,
+    on_progress: Callable[[BroadcastResult], Awaitable[None]] | None = None,
+    progress_every: float = 10.0,
+) -> BroadcastResult:
+    result = BroadcastResult(len(user_ids))
+    # общий итератор — очередь получателей: воркеров всегда concurrency,
+    # сколько бы ни было получателей
+    queue = iter(user_ids)
+    last_report = monotonic()
+
+    async def worker() -> None:
+        nonlocal last_report
+        for user_id in queue:
+            try:
+                result.sent[user_id] = await send_one(user_id)
+                BROADCAST_MESSAGES.inc(result="sent")
+            except Exception as e:
+                reason = failure_reason(e)
+                result.failed[user_id] = reason
+                BROADCAST_MESSAGES.inc(result=reason)
+                if reason == "error":
+                    log.warning("Broadcast send failed: %s", e, extra={"user_id": user_id, "error": type(e).__name__})
+
+            if on_progress and monotonic() - last_report >= progress_every and result.done < result.total:
+                last_report = monotonic()
+                try:
+                    await on_progress(result)
+                except Exception as e:
+                    log.info("Progress report failed: %s", e)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(user_ids)))))
+    return result
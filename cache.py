@@ -0,0 +1,119 @@
+"""
+Ограниченные кэши для долгоживущего процесса.
+
+BoundedCache — dict с лимитом по числу записей (LRU) и по времени простоя
+(TTL с момента последнего обращения). Записи упорядочены по последнему
+обращению, поэтому «протухшие» всегда лежат в начале и чистятся за O(1)
+на каждую вставку — без отдельного таймера.
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from time import monotonic
+from typing import Any, Callable, Iterator
+
+# сколько протухших записей выкидывать из головы очереди за одну вставку
+_PRUNE_PER_SET = 2
+
+# все созданные кэши — для метрик
+CACHES: list["BoundedCache"] = []
+
+
+class CacheEntry:
+    __slots__ = ("value", "touched_at")
+
+    def __init__(self, value: Any, touched_at: float):
+        self.value = value
+        self.touched_at = touched_at
+
+
+class BoundedCache(MutableMapping):
+    def __init__(
+        self,
+        name: str,
+        maxsize: int,
+        ttl: float | None = None,
+        *,
+        on_evict: Callable[[Any, Any], None] | None = None,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self.clock = clock
+        self.evictions = 0   # вытеснено по размеру
+        self.expirations = 0  # выкинуто по TTL
+        self._data: OrderedDict[Any, CacheEntry] = OrderedDict()
+        CACHES.append(self)
+
+    def _is_stale(self, entry: CacheEntry, now: float) -> bool:
+        return self.ttl is not None and now - entry.touched_at > self.ttl
+
+    def _drop(self, key, *, expired: bool) -> None:
+        entry = self._data.pop(key)
+        if expired:
+            self.expirations += 1
+        else:
+            self.evictions += 1
+        if self.on_evict:
+            self.on_evict(key, entry.value)
+
+    def __getitem__(self, key):
+        entry = self._data[key]
+        now = self.clock()
+        if self._is_stale(entry, now):
+            self._drop(key, expired=True)
+            raise KeyError(key)
+        entry.touched_at = now
+        self._data.move_to_end(key)
+        return entry.value
+
+    def __setitem__(self, key, value) -> None:
+        now = self.clock()
+        entry = self._data.get(key)
+        if entry is None:
+            self._data[key] = CacheEntry(value, now)
+        else:
+            entry.value = value
+            entry.touched_at = now
+            self._data.move_to_end(key)
+        self.prune(now, limit=_PRUNE_PER_SET)
+        while len(self._data) > self.maxsize:
+            self._drop(next(iter(self._data)), expired=False)
+
+    def __delitem__(self, key) -> None:
+        del self._data[key]
+
+    def __contains__(self, key) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self) -> Iterator:
+        return iter(list(self._data))
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def prune(self, now: float | None = None, *, limit: int | None = None) -> int:
+        """Выкидывает протухшие записи из головы очереди."""
+        if self.ttl is None:
+            return 0
+        now = self.clock() if now is None else now
+        dropped = 0
+        while self._data and (limit is None or dropped < limit):
+            key, entry = next(iter(self._data.items()))
+            if not self._is_stale(entry, now):
+                break
+            self._drop(key, expired=True)
+            dropped += 1
+        return dropped
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "evictions": self.evictions, "expirations": self.expirations}
+
+
+def cache_stats() -> dict[str, dict]:
+    return {c.name: c.stats() for c in CACHES}
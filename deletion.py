@@ -0,0 +1,89 @@
+"""
+Пакетное удаление сообщений бота.
+
+Собираем id по чатам и удаляем через deleteMessages пачками до 100 штук.
+Если пачка целиком не прошла, перебираем её по одному deleteMessage.
+
+deleteMessages отвечает True, даже если часть id уже была удалена
+(кандидатом или самим Telegram), поэтому при пачках DeletionResult.deleted —
+это id, которые удалены или которых уже не было, а failed — только то,
+что не прошло и по одному. Когда нужен точный список неудавшихся id,
+создавайте DeletionBatch(bot, exact=True): тогда каждое id удаляется
+отдельным deleteMessage.
+"""
+from aiogram import Bot
+
+from logs import get_logger
+
+log = get_logger("deletion")
+
+# лимит Bot API на один вызов deleteMessages
+MAX_IDS_PER_CALL = 100
+
+
+class DeletionResult:
+    __slots__ = ("deleted", "failed")
+
+    def __init__(self):
+        # удалены (при пачках — или их уже не было)
+        self.deleted = 0
+        # chat_id -> id сообщений, которые удалить не получилось
+        self.failed: dict[int, list[int]] = {}
+
+    @property
+    def ok(self) -> bool:
+        return not self.failed
+
+    def failed_ids(self) -> list[int]:
+        return [mid for ids in self.failed.values() for mid in ids]
+
+
+class DeletionBatch:
+    def __init__(self, bot: Bot, *, exact: bool = False):
+        self.bot = bot
+        self.exact = exact
+        self._by_chat: dict[int, list[int]] = {}
+
+    def add(self, chat_id: int | None, message_id: int | None) -> None:
+        if chat_id and message_id:
+            self._by_chat.setdefault(chat_id, []).append(message_id)
+
+    def extend(self, chat_id: int, message_ids) -> None:
+        for mid in message_ids:
+            self.add(chat_id, mid)
+
+    def __len__(self) -> int:
+        return sum(len(ids) for ids in self._by_chat.values())
+
+    async def execute(self) -> DeletionResult:
+        result = DeletionResult()
+        by_chat, self._by_chat = self._by_chat, {}
+        for chat_id, ids in by_chat.items():
+            ids = sorted(set(ids))
+            for i in range(0, len(ids), MAX_IDS_PER_CALL):
+                await self._delete_chunk(chat_id, ids[i:i + MAX_IDS_PER_CALL], result)
+        if result.failed:
+            log.warning("Delete failed for some messages", extra={"failed": result.failed})
+        return result
+
+    async def _delete_chunk(self, chat_id: int, chunk: list[int], result: DeletionResult) -> None:
+        if len(chunk) > 1 and not self.exact:
+            try:
+                await self.bot.delete_messages(chat_id, chunk)
+                result.deleted += len(chunk)
+                return
+            except Exception as e:
+                log.info("deleteMessages failed, retrying one by one: %s", e, extra={"chat_id": chat_id})
+
+        for mid in chunk:
+            try:
+                await self.bot.delete_message(chat_id, mid)
+                result.deleted += 1
+            except Exception:
+                result.failed.setdefault(chat_id, []).append(mid)
+
+
+async def delete_messages(bot: Bot, chat_id: int, message_ids, *, exact: bool = False) -> DeletionResult:
+    batch = DeletionBatch(bot, exact=exact)
+    batch.extend(chat_id, message_ids)
+    return await batch.execute()
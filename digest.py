@@ -0,0 +1,170 @@
+"""
+Сводка по тестовым заданиям: одно сообщение в теме роли на день.
+
+Вместо поста на каждую выдачу теста и на каждую просрочку в тему роли
+раз в сутки (по UTC) уходит один пост, который дальше редактируется
+на месте: кто сейчас делает тест, у кого дедлайн скоро, кто сегодня
+просрочил. События только помечают роль «грязной», а перерисовывает
+её фоновый цикл не чаще раза в interval секунд — так десяток выдач
+подряд превращается в одну правку.
+
+Текст собирает render из bot.py (ему нужны ники и дедлайны), отправку
+и правку делают post / edit — здесь только учёт постов по дням.
+"""
+import asyncio
+import time
+from typing import Awaitable, Callable, Iterable
+
+from logs import get_logger
+from metrics import Counter
+from storage import JSON_VALUE, STR_VALUE, Codec, PersistentMap, Storage
+
+log = get_logger("digest")
+
+DIGEST_UPDATES = Counter("deadline_digest_updates", "Deadline digest renders by outcome", ("result",))
+
+DAY = 86400
+
+# раз в столько перерисовываем все роли: «дедлайн скоро» зависит от времени, а не только от событий
+_FULL_REFRESH_SEC = 3600.0
+
+
+class DigestPost:
+    """Пост сводки по роли за один день."""
+    __slots__ = ("day", "message_id", "assigned", "expired")
+
+    def __init__(
+        self,
+        day: int,
+        message_id: int | None = None,
+        assigned: list[int] | None = None,
+        expired: list[tuple[int, float]] | None = None,
+    ):
+        # номер дня UTC (unix-время // DAY)
+        self.day = day
+        self.message_id = message_id
+        # кому тест выдан сегодня
+        self.assigned = assigned if assigned is not None else []
+        # (user_id, дедлайн) — просрочили сегодня
+        self.expired = expired if expired is not None else []
+
+
+def _dump_post(p: DigestPost) -> str:
+    return JSON_VALUE.dump([p.day, p.message_id, p.assigned, p.expired])
+
+
+def _load_post(raw) -> DigestPost:
+    day, message_id, assigned, expired = JSON_VALUE.load(raw)
+    return DigestPost(day, message_id, assigned, [tuple(e) for e in expired])
+
+
+class DeadlineDigest:
+    def __init__(
+        self,
+        storage: Storage,
+        roles: Iterable[str],
+        *,
+        render: Callable[[str, DigestPost], str | None],
+        post: Callable[[str, str], Awaitable[int | None]],
+        edit: Callable[[str, int, str], Awaitable[bool]],
+        interval: float,
+        ns: str = "deadline_digest",
+        clock: Callable[[], float] = time.time,
+    ):
+        """
+        render(role, post) -> текст или None, если показывать нечего;
+        post(role, text) -> message_id нового сообщения;
+        edit(role, message_id, text) -> False, если сообщения больше нет.
+        """
+        self.roles = tuple(roles)
+        self.render = render
+        self.post = post
+        self.edit = edit
+        self.interval = interval
+        self.clock = clock
+        self._posts = PersistentMap(storage, ns, key_codec=STR_VALUE, value_codec=Codec(_dump_post, _load_post))
+        self._posts.preload()
+        # последний отправленный текст: одинаковое не редактируем
+        self._last: dict[str, str] = {}
+        # после старта перерисовываем всё: за время простоя могли пройти дедлайны
+        self._dirty: set[str] = set(self.roles)
+        self._lock = asyncio.Lock()
+
+    def _current(self, role: str) -> DigestPost:
+        """Пост роли за сегодня; вчерашний остаётся в теме как есть."""
+        day = int(self.clock()) // DAY
+        post = self._posts.get(role)
+        if post is None or post.day != day:
+            post = DigestPost(day)
+        return post
+
+    # ---- события ----
+
+    def assigned(self, role: str, user_id: int) -> None:
+        post = self._current(role)
+        if user_id not in post.assigned:
+            post.assigned.append(user_id)
+        self._posts[role] = post
+        self._dirty.add(role)
+
+    def expired(self, role: str, user_id: int, due_at: float) -> None:
+        post = self._current(role)
+        post.expired.append((user_id, due_at))
+        self._posts[role] = post
+        self._dirty.add(role)
+
+    def changed(self, role: str | None = None) -> None:
+        """Список «в работе» поменялся без выдачи/просрочки (отмена, бан)."""
+        self._dirty.update([role] if role else self.roles)
+
+    # ---- перерисовка ----
+
+    async def _refresh(self, role: str) -> None:
+        post = self._current(role)
+        text = self.render(role, post)
+        if text is None:
+            DIGEST_UPDATES.inc(result="empty")
+            return
+
+        if post.message_id is not None:
+            if self._last.get(role) == text:
+                DIGEST_UPDATES.inc(result="unchanged")
+                return
+            if await self.edit(role, post.message_id, text):
+                self._last[role] = text
+                DIGEST_UPDATES.inc(result="edited")
+                return
+            # сообщение удалили руками — пришлём заново
+
+        message_id = await self.post(role, text)
+        if message_id is None:
+            return
+        post.message_id = message_id
+        self._posts[role] = post
+        self._last[role] = text
+        DIGEST_UPDATES.inc(result="posted")
+
+    async def flush(self) -> None:
+        """Перерисовывает всё, что поменялось."""
+        async with self._lock:
+            for role in sorted(self._dirty):
+                self._dirty.discard(role)
+                try:
+                    await self._refresh(role)
+                except asyncio.CancelledError:
+                    self._dirty.add(role)
+                    raise
+                except Exception as e:
+                    self._dirty.add(role)
+                    log.warning("Digest refresh failed: %s", e, extra={"role": role, "error": type(e).__name__})
+
+    async def run(self) -> None:
+        last_full = self.clock()
+        while True:
+            await self.flush()
+            await asyncio.sleep(self.interval)
+            now = self.clock()
+            # новый день или просто пора обновить «дедлайн скоро»
+            if now - last_full >= _FULL_REFRESH_SEC or int(now) // DAY != int(last_full) // DAY:
+                last_full = now
+                self._dirty.update(self.roles)
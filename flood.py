@@ -0,0 +1,109 @@
+"""
+Ограничение входящего потока сообщений от кандидатов.
+
+У каждого пользователя свой TokenBucket: burst сообщений подряд проходят
+как обычно, дальше — refill сообщений в секунду. Лишние сообщения не
+пересылаются по одному, а собираются в сводку, которая уходит в группу
+одним постом (этим занимается bot.py). Если за одну «волну» лишних
+набралось mute_after, пользователь на mute_sec секунд замолкает: его
+сообщения отбрасываются так же, как от забаненных. Волна заканчивается,
+когда ведро снова наполнилось целиком.
+"""
+from enum import Enum
+from time import monotonic
+from typing import Callable
+
+from cache import BoundedCache
+from logs import get_logger
+from metrics import Counter
+from outbox import TokenBucket
+
+log = get_logger("flood")
+
+INBOUND_SUPPRESSED = Counter(
+    "inbound_suppressed", "Candidate messages not forwarded one by one", ("reason",),
+)
+INBOUND_MUTES = Counter("inbound_mutes", "Temporary mutes for flooding")
+
+
+class Verdict(Enum):
+    PASS = "pass"      # пересылаем как обычно
+    DIGEST = "digest"  # в сводку
+    MUTE = "mute"      # в сводку, и с этого сообщения пользователь замолкает
+    MUTED = "muted"    # отбрасываем
+
+
+class _UserFlood:
+    __slots__ = ("bucket", "excess")
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self.excess = 0
+
+
+class FloodGuard:
+    def __init__(
+        self,
+        *,
+        burst: int,
+        refill: float,
+        mute_after: int,
+        mute_sec: float,
+        maxsize: int,
+        clock: Callable[[], float] = monotonic,
+    ):
+        self.burst = burst
+        self.refill = refill
+        self.mute_after = mute_after
+        self.mute_sec = mute_sec
+        self.clock = clock
+        # простаивающее ведро всё равно полное — его можно забыть
+        self._users = BoundedCache("flood", maxsize, ttl=burst / refill + 60)
+        # user_id -> до какого момента (clock) молчит
+        self._muted: dict[int, float] = {}
+
+    def _get(self, user_id: int) -> _UserFlood:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserFlood(TokenBucket(self.refill, self.burst))
+        return state
+
+    def check(self, user_id: int) -> Verdict:
+        now = self.clock()
+        if self.is_muted(user_id):
+            INBOUND_SUPPRESSED.inc(reason="muted")
+            return Verdict.MUTED
+
+        state = self._get(user_id)
+        if state.bucket.take(now):
+            if state.bucket.tokens >= self.burst - 1:
+                state.excess = 0
+            return Verdict.PASS
+
+        state.excess += 1
+        INBOUND_SUPPRESSED.inc(reason="digest")
+        if state.excess >= self.mute_after:
+            self._muted[user_id] = now + self.mute_sec
+            state.excess = 0
+            INBOUND_MUTES.inc()
+            log.info("User muted for flooding", extra={"user_id": user_id, "seconds": self.mute_sec})
+            return Verdict.MUTE
+        return Verdict.DIGEST
+
+    def is_muted(self, user_id: int) -> bool:
+        until = self._muted.get(user_id)
+        if until is None:
+            return False
+        if until > self.clock():
+            return True
+        del self._muted[user_id]
+        return False
+
+    def unmute(self, user_id: int) -> bool:
+        return self._muted.pop(user_id, 0.0) > self.clock()
+
+    def muted(self) -> int:
+        now = self.clock()
+        for uid in [uid for uid, until in self._muted.items() if until <= now]:
+            del self._muted[uid]
+        return len(self._muted)
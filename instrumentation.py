@@ -0,0 +1,91 @@
+"""
+Замеры времени для хендлеров и запросов к Bot API.
+
+HandlerTimingMiddleware — middleware диспетчера: время работы каждого
+хендлера, число ошибок по типу исключения, сколько хендлеров выполняется
+прямо сейчас. ApiTimingMiddleware — то же для каждого метода Bot API
+(middleware сессии бота; подключать после Outbox, чтобы считать чистое
+время запроса без ожидания в очереди).
+
+Всё пишется в metrics.REGISTRY и видно на /metrics; log_summary()
+дополнительно раз в N секунд пишет в лог короткую сводку.
+"""
+import asyncio
+from time import monotonic
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+from logs import get_logger
+from metrics import Counter, Gauge, Histogram
+
+log = get_logger("metrics")
+
+HANDLER_LATENCY = Histogram("handler_duration_seconds", "Handler execution time", ("handler",))
+HANDLER_ERRORS = Counter("handler_errors", "Handler exceptions by type", ("handler", "error"))
+HANDLER_IN_FLIGHT = Gauge("handlers_in_flight", "Handlers running right now", ("handler",))
+
+API_LATENCY = Histogram(
+    "api_request_duration_seconds", "Bot API request time", ("method",),
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+API_ERRORS = Counter("api_errors", "Bot API errors by type", ("method", "error"))
+API_IN_FLIGHT = Gauge("api_requests_in_flight", "Bot API requests waiting for a response", ("method",))
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """Вешается как inner-middleware (dp.message.middleware(...)): там уже известен хендлер."""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        name = getattr(getattr(handler_obj, "callback", None), "__name__", "unknown")
+        HANDLER_IN_FLIGHT.inc(handler=name)
+        start = monotonic()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            HANDLER_ERRORS.inc(handler=name, error=type(e).__name__)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(monotonic() - start, handler=name)
+            HANDLER_IN_FLIGHT.dec(handler=name)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        API_IN_FLIGHT.inc(method=name)
+        start = monotonic()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            API_ERRORS.inc(method=name, error=type(e).__name__)
+            raise
+        finally:
+            API_LATENCY.observe(monotonic() - start, method=name)
+            API_IN_FLIGHT.dec(method=name)
+
+
+def _format(hist: Histogram, errors: Counter, prev: dict) -> str:
+    parts = []
+    errs: dict[str, float] = {}
+    for (label, _err), n in errors.snapshot().items():
+        errs[label] = errs.get(label, 0) + n
+    for (label,), (count, total) in sorted(hist.totals().items()):
+        p_count, p_total = prev.get(label, (0, 0.0))
+        prev[label] = (count, total)
+        if count == p_count:
+            continue
+        avg_ms = (total - p_total) / (count - p_count) * 1000
+        parts.append(f"{label}={int(count - p_count)}x{avg_ms:.0f}ms/err{int(errs.get(label, 0))}")
+    return " ".join(parts) or "-"
+
+
+async def log_summary(interval: float) -> None:
+    """Раз в interval секунд: сколько вызовов и среднее время с прошлой сводки."""
+    prev_handlers: dict = {}
+    prev_api: dict = {}
+    while True:
+        await asyncio.sleep(interval)
+        log.info("Handlers: %s", _format(HANDLER_LATENCY, HANDLER_ERRORS, prev_handlers))
+        log.info("Bot API: %s", _format(API_LATENCY, API_ERRORS, prev_api))
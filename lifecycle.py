@@ -0,0 +1,86 @@
+"""
+Корректная остановка бота при деплое.
+
+По SIGTERM/SIGINT:
+  1. перестаём принимать апдейты (polling останавливается, webhook-сервер
+     закрывается — Telegram доставит новые следующему экземпляру);
+  2. ждём, пока доработают уже начатые хендлеры и опустеет очередь
+     исходящих, но не дольше drain_timeout;
+  3. сохраняем состояние и закрываем сессию — это делает main().
+
+Lifecycle — ещё и outer-middleware на dp.update: считает апдейты
+в обработке и помнит последний обработанный update_id, чтобы в polling
+подтвердить его Telegram и не получить эти апдейты повторно после рестарта.
+"""
+import asyncio
+import signal
+from time import monotonic
+from typing import Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from logs import get_logger
+
+log = get_logger("lifecycle")
+
+# как часто проверять, опустели ли очереди
+_POLL_SEC = 0.05
+
+
+class Lifecycle(BaseMiddleware):
+    def __init__(self, *, drain_timeout: float):
+        self.drain_timeout = drain_timeout
+        self.stopping = asyncio.Event()
+        self.active = 0
+        self.last_update_id: int | None = None
+        self._stop_started: float | None = None
+
+    # ---- сигналы ----
+
+    def install_signals(self) -> None:
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.request_stop, sig)
+            except NotImplementedError:  # Windows
+                pass
+
+    def request_stop(self, sig: signal.Signals | None = None) -> None:
+        if self.stopping.is_set():
+            return
+        log.info("Shutdown requested", extra={"signal": sig.name if sig else None})
+        self._stop_started = monotonic()
+        self.stopping.set()
+
+    # ---- учёт апдейтов ----
+
+    async def __call__(self, handler, event: Update, data: dict):
+        self.active += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.active -= 1
+            if self.last_update_id is None or event.update_id > self.last_update_id:
+                self.last_update_id = event.update_id
+
+    # ---- дренаж ----
+
+    def remaining(self) -> float:
+        """Сколько ещё можно ждать в рамках drain_timeout."""
+        if self._stop_started is None:
+            self._stop_started = monotonic()
+        return max(0.0, self.drain_timeout - (monotonic() - self._stop_started))
+
+    def elapsed(self) -> float:
+        return monotonic() - self._stop_started if self._stop_started is not None else 0.0
+
+    async def wait_idle(self, name: str, busy: Callable[[], int]) -> bool:
+        """Ждёт, пока busy() не станет 0; False — не успели до дедлайна."""
+        deadline = monotonic() + self.remaining()
+        while busy():
+            if monotonic() >= deadline:
+                log.warning("Drain deadline reached", extra={"stage": name, "left": busy()})
+                return False
+            await asyncio.sleep(_POLL_SEC)
+        return True
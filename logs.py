@@ -0,0 +1,213 @@
+"""
+Структурированные JSON-логи вместо print().
+
+Запись в stdout делает фоновый поток (QueueListener); в коде бота
+log.warning(...) только кладёт запись в ограниченную очередь и сразу
+возвращается. В каждую запись автоматически попадают user_id, role,
+handler и update_id текущего апдейта (contextvars, заполняются
+middleware диспетчера).
+
+Частые одинаковые записи (например, «Edit failed…») сэмплируются: за окно
+window секунд пропускаются первые burst штук с одним и тем же шаблоном,
+остальные только считаются, а счётчик приезжает полем "suppressed"
+в первой записи следующего окна.
+
+Уровни — общий LOG_LEVEL и точечно по компонентам:
+LOG_LEVELS="outbox=DEBUG,storage=WARNING,aiogram.event=INFO".
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from time import monotonic
+from typing import Callable
+
+from aiogram import BaseMiddleware
+
+ROOT_LOGGER = "kitsune"
+CONTEXT_FIELDS = ("user_id", "role", "handler", "update_id")
+
+_CONTEXT: dict[str, ContextVar] = {name: ContextVar(f"log_{name}", default=None) for name in CONTEXT_FIELDS}
+
+# атрибуты, которые есть у любой LogRecord; всё остальное — наши extra-поля
+_STD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def get_logger(component: str) -> logging.Logger:
+    return logging.getLogger(f"{ROOT_LOGGER}.{component}")
+
+
+def bind(**fields) -> list:
+    """Добавляет поля в контекст логов текущей задачи; вернуть токены в unbind()."""
+    return [(_CONTEXT[k], _CONTEXT[k].set(v)) for k, v in fields.items() if k in _CONTEXT]
+
+
+def unbind(tokens: list) -> None:
+    for var, token in reversed(tokens):
+        var.reset(token)
+
+# ============ FILTERS / FORMAT ============
+
+
+class _ContextFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        for name, var in _CONTEXT.items():
+            if not hasattr(record, name):
+                setattr(record, name, var.get())
+        return True
+
+
+class _SamplingFilter(logging.Filter):
+    def __init__(self, burst: int, window: float):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        # (logger, шаблон) -> [начало окна, пропущено, подавлено]
+        self._seen: dict[tuple[str, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0 or record.levelno >= logging.CRITICAL:
+            return True
+        key = (record.name, str(record.msg))
+        now = monotonic()
+        slot = self._seen.get(key)
+        if slot is None or now - slot[0] > self.window:
+            suppressed = slot[2] if slot else 0
+            if len(self._seen) > 10_000:
+                self._seen.clear()
+            self._seen[key] = [now, 1, 0]
+            if suppressed:
+                record.suppressed = suppressed
+            return True
+        if slot[1] < self.burst:
+            slot[1] += 1
+            return True
+        slot[2] += 1
+        return False
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        out = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _STD_ATTRS and value is not None:
+                out[key] = value
+        if record.exc_text:
+            out["exc"] = record.exc_text
+        return json.dumps(out, ensure_ascii=False, default=str)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Не блокируется на полной очереди: лишнее выкидываем и считаем."""
+
+    dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # форматируем только сообщение и трейсбек; JSON соберёт фоновый поток
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            type(self).dropped += 1
+
+# ============ SETUP ============
+
+
+def _logger_name(component: str) -> str:
+    if component.split(".", 1)[0] in ("aiogram", "aiohttp", "asyncio"):
+        return component
+    return f"{ROOT_LOGGER}.{component}"
+
+
+def setup_logging(
+    level: str = "INFO",
+    component_levels: str = "",
+    *,
+    sample_burst: int = 5,
+    sample_window: float = 60.0,
+    queue_size: int = 10_000,
+) -> None:
+    global _listener
+    if _listener is not None:
+        return
+
+    q: queue.Queue = queue.Queue(maxsize=queue_size)
+    handler = _DroppingQueueHandler(q)
+    handler.addFilter(_ContextFilter())
+    handler.addFilter(_SamplingFilter(sample_burst, sample_window))
+
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level.upper())
+    # aiogram пишет INFO на каждый апдейт — по умолчанию это лишнее
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+
+    for item in component_levels.split(","):
+        name, _, lvl = item.strip().partition("=")
+        if name and lvl:
+            logging.getLogger(_logger_name(name)).setLevel(lvl.strip().upper())
+
+    writer = logging.StreamHandler(sys.stdout)
+    writer.setFormatter(JsonFormatter())
+    _listener = logging.handlers.QueueListener(q, writer, respect_handler_level=False)
+    _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Дописывает очередь и останавливает фоновый поток."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+# ============ DISPATCHER MIDDLEWARE ============
+
+
+class UpdateContextMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: update_id, user_id и роль пользователя."""
+
+    def __init__(self, role_of: Callable[[int], str | None] | None = None):
+        self.role_of = role_of
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        role = None
+        if user and self.role_of:
+            try:
+                role = self.role_of(user.id)
+            except Exception:
+                pass
+        tokens = bind(update_id=event.update_id, user_id=user.id if user else None, role=role)
+        try:
+            return await handler(event, data)
+        finally:
+            unbind(tokens)
+
+
+class HandlerContextMiddleware(BaseMiddleware):
+    """Inner-middleware (dp.message / dp.callback_query): имя хендлера."""
+
+    async def __call__(self, handler, event, data):
+        handler_obj = data.get("handler")
+        tokens = bind(handler=getattr(getattr(handler_obj, "callback", None), "__name__", None))
+        try:
+            return await handler(event, data)
+        finally:
+            unbind(tokens)
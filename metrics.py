@@ -0,0 +1,212 @@
+"""
+Метрики в текстовом формате Prometheus и состояние «живости» бота.
+
+Без внешних зависимостей: Counter / Gauge / Histogram с метками,
+CallbackMetric — значение считается в момент запроса /metrics
+(размеры очередей, кэшей и т.п.), и Health — для /readyz.
+"""
+import asyncio
+from contextlib import contextmanager
+from time import monotonic
+from typing import Callable, Iterable
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+
+PREFIX = "kitsune_"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list = []
+
+    def register(self, metric) -> None:
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = (), *, registry: Registry = REGISTRY):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labels)
+        registry.register(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labelnames)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+    def snapshot(self) -> dict[tuple, float]:
+        return dict(self._values)
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in self._values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple = DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        # ключ меток -> [счётчики по бакетам..., sum, count]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        row = self._values.get(key)
+        if row is None:
+            row = self._values[key] = [0.0] * (len(self.buckets) + 2)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                row[i] += 1
+                break
+        row[-2] += value
+        row[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic() - start, **labels)
+
+    def totals(self) -> dict[tuple, tuple[float, float]]:
+        """Метки -> (count, sum)."""
+        return {k: (row[-1], row[-2]) for k, row in self._values.items()}
+
+    def samples(self) -> list[str]:
+        out = []
+        for key, row in self._values.items():
+            acc = 0.0
+            for bound, n in zip(self.buckets, row):
+                acc += n
+                le = _fmt_labels(self.labelnames, key, 'le="%s"' % bound)
+                out.append(f"{self.name}_bucket{le} {acc}")
+            le = _fmt_labels(self.labelnames, key, 'le="+Inf"')
+            out.append(f"{self.name}_bucket{le} {row[-1]}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {row[-2]}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {row[-1]}")
+        return out
+
+
+class CallbackMetric(_Metric):
+    """
+    Значение считается при каждом запросе /metrics.
+    fn возвращает число (без меток) или пары (значения меток, число).
+    """
+
+    def __init__(self, name: str, help: str, fn: Callable, labels: Iterable[str] = (), *, kind: str = "gauge", **kwargs):
+        super().__init__(name, help, labels, **kwargs)
+        self.kind = kind
+        self.fn = fn
+
+    def samples(self) -> list[str]:
+        try:
+            value = self.fn()
+        except Exception:
+            return []
+        if not self.labelnames:
+            return [f"{self.name} {value}"]
+        return [f"{self.name}{_fmt_labels(self.labelnames, k)} {v}" for k, v in value]
+
+# ============ HEALTH ============
+
+
+class Health:
+    """
+    Готовность бота для /readyz: когда последний раз был контакт
+    с Telegram (успешный getUpdates или запрос на вебхук) и насколько
+    отстаёт event loop.
+    """
+
+    def __init__(self, *, mode: str, max_silence: float = 90.0, max_lag: float = 1.0):
+        self.mode = mode
+        self.max_silence = max_silence
+        self.max_lag = max_lag
+        self.started_at = monotonic()
+        self.last_contact: float | None = None
+        self.loop_lag = 0.0
+
+    def touch(self) -> None:
+        self.last_contact = monotonic()
+
+    async def watch_loop(self, interval: float = 0.5) -> None:
+        while True:
+            start = monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag = max(0.0, monotonic() - start - interval)
+
+    def readiness(self) -> tuple[bool, dict]:
+        now = monotonic()
+        silence = None if self.last_contact is None else now - self.last_contact
+        # вебхук молчит, пока кандидаты молчат, — это нормально
+        contact_ok = silence is not None and (self.mode == "webhook" or silence < self.max_silence)
+        ready = contact_ok and self.loop_lag < self.max_lag
+        return ready, {
+            "ready": ready,
+            "mode": self.mode,
+            "uptime_sec": round(now - self.started_at, 1),
+            "last_contact_sec_ago": None if silence is None else round(silence, 1),
+            "loop_lag_sec": round(self.loop_lag, 4),
+        }
+
+
+class HeartbeatMiddleware(BaseRequestMiddleware):
+    """Отмечает в Health каждый успешный getUpdates."""
+
+    def __init__(self, health: Health):
+        self.health = health
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        if isinstance(method, GetUpdates):
+            self.health.touch()
+        return result
@@ -0,0 +1,163 @@
+"""
+Параллельная обработка апдейтов с сохранением порядка внутри «полосы».
+
+Полоса — один пользователь в личке и кнопках или одна тема группы
+(ответы кураторов). Апдейты разных полос идут параллельно, но не больше
+concurrency одновременно; внутри полосы — строго по одному и в порядке
+поступления, так что сообщение кандидата и его нажатие кнопки больше
+не правят STATE наперегонки.
+
+Очередь пользователя ограничена max_queue: что сверх неё — отбрасываем
+и считаем, чтобы один флудящий пользователь не занял весь бот. Темы
+группы не ограничиваем: там пишут кураторы, и терять их ответы нельзя.
+
+Пока хендлер ждёт своей очереди в outbox (в группу уходит ~20 сообщений
+в минуту), глобальный слот ему не нужен: outbox оборачивает ожидание в
+parked(), слот на это время отпускается и достаётся апдейтам других полос.
+Полоса при этом остаётся занятой — порядок внутри неё не меняется.
+
+Подключается одним из первых outer-middleware на dp.update: в тех, что стоят
+до него, не должно быть await до вызова handler, иначе апдейты одной полосы
+могут встать в очередь не в том порядке, в каком пришли.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from time import monotonic
+from typing import Callable, Hashable
+
+from aiogram import BaseMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.types import Update
+
+from logs import get_logger
+from metrics import Counter, Histogram
+
+log = get_logger("ordering")
+
+UPDATES_DROPPED = Counter("updates_dropped", "Updates dropped because the lane queue was full", ("lane",))
+# start — апдейт ждёт первого слота, resume — хендлер вернулся из outbox и ждёт слот обратно
+UPDATE_SLOT_WAIT = Histogram(
+    "update_slot_wait_seconds", "Time an update waited for a global handler slot", ("stage",),
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0),
+)
+
+
+class _Slot:
+    """Глобальный слот, выданный хендлеру; task — задача, в которой он работает."""
+    __slots__ = ("owner", "task", "held")
+
+    def __init__(self, owner: "UpdateScheduler"):
+        self.owner = owner
+        self.task = asyncio.current_task()
+        self.held = True
+
+
+_SLOT: ContextVar[_Slot | None] = ContextVar("update_slot", default=None)
+
+
+@asynccontextmanager
+async def parked():
+    """
+    Отпускает глобальный слот апдейта на время ожидания. Действует только
+    в задаче самого хендлера: задачи, которые он породил, слота не держат.
+    """
+    slot = _SLOT.get()
+    if slot is None or not slot.held or slot.task is not asyncio.current_task():
+        yield
+        return
+    owner = slot.owner
+    slot.held = False
+    owner.parked += 1
+    owner._slots.release()
+    try:
+        yield
+    finally:
+        owner.parked -= 1
+        started = monotonic()
+        await owner._slots.acquire()
+        slot.held = True
+        UPDATE_SLOT_WAIT.observe(monotonic() - started, stage="resume")
+
+
+def update_lane(event: Update, data: dict) -> Hashable | None:
+    """Пользователь — для лички и кнопок, (чат, тема) — для групп."""
+    msg = event.message or event.edited_message
+    if msg and msg.chat.type in ("group", "supergroup"):
+        return ("chat", msg.chat.id, msg.message_thread_id or 0)
+    user = data.get("event_from_user")
+    if user:
+        return ("user", user.id)
+    return None
+
+
+class _Lane:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class UpdateScheduler(BaseMiddleware):
+    def __init__(
+        self,
+        *,
+        concurrency: int,
+        max_queue: int,
+        lane_of: Callable[[Update, dict], Hashable | None] = update_lane,
+    ):
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.lane_of = lane_of
+        self._slots = asyncio.Semaphore(concurrency)
+        self._lanes: dict[Hashable, _Lane] = {}
+        self.dropped = 0
+        # хендлеры, отпустившие слот на время ожидания в outbox
+        self.parked = 0
+
+    def queued(self) -> int:
+        """Апдейты, которые ждут своей очереди или выполняются."""
+        return sum(lane.depth for lane in self._lanes.values())
+
+    def lanes(self) -> int:
+        return len(self._lanes)
+
+    async def _run(self, handler, event: Update, data: dict):
+        started = monotonic()
+        await self._slots.acquire()
+        UPDATE_SLOT_WAIT.observe(monotonic() - started, stage="start")
+        slot = _Slot(self)
+        token = _SLOT.set(slot)
+        try:
+            return await handler(event, data)
+        finally:
+            _SLOT.reset(token)
+            # отмена посреди parked() оставляет слот не занятым — тогда и отдавать нечего
+            if slot.held:
+                slot.held = False
+                self._slots.release()
+
+    async def __call__(self, handler, event: Update, data: dict):
+        key = self.lane_of(event, data)
+        if key is None:
+            return await self._run(handler, event, data)
+
+        lane = self._lanes.get(key)
+        if lane is None:
+            lane = self._lanes[key] = _Lane()
+        if key[0] == "user" and lane.depth >= self.max_queue:
+            self.dropped += 1
+            UPDATES_DROPPED.inc(lane=key[0])
+            log.warning("Lane queue is full, update dropped", extra={"lane": str(key), "update_id": event.update_id})
+            return UNHANDLED
+
+        lane.depth += 1
+        try:
+            async with lane.lock:
+                # глобальный слот берём только когда подошла очередь полосы
+                return await self._run(handler, event, data)
+        finally:
+            lane.depth -= 1
+            if not lane.depth:
+                self._lanes.pop(key, None)
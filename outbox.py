@@ -0,0 +1,265 @@
+"""
+Единая очередь исходящих сообщений с учётом лимитов Telegram.
+
+Outbox подключается как middleware сессии бота (bot.session.middleware),
+поэтому через него проходят все отправки — send_*, copy_*, forward_*,
+edit_* — без правок в местах вызова. Остальные методы (getUpdates,
+deleteMessage, answerCallbackQuery, ...) идут напрямую.
+
+Лимиты — token bucket'ы: общий (≈30 сообщений/с на бота) и по чату
+(≈20/мин в группу, ≈1/с в личку). Бакет не «ждёт», а резервирует слот:
+задача откладывается до своего времени, и очередь тем временем
+обслуживает другие чаты. На TelegramRetryAfter чат ставится на паузу
+на указанное время, а запрос повторяется. Хендлер, ждущий своей отправки,
+на это время отпускает глобальный слот апдейтов (ordering.parked).
+
+Приоритет задаётся контекстом вызывающего кода:
+
+    with prioritized(Priority.HIGH):
+        await bot.send_message(...)
+"""
+import asyncio
+import heapq
+import itertools
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from time import monotonic
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from cache import BoundedCache
+from ordering import parked
+
+
+class Priority(IntEnum):
+    HIGH = 0    # ответы кураторов кандидатам
+    NORMAL = 1
+    LOW = 2     # подтверждения «доставлено» / «отправлено»
+
+
+_PRIORITY: ContextVar[Priority] = ContextVar("outbox_priority", default=Priority.NORMAL)
+
+_PACED_PREFIXES = ("Send", "Copy", "Forward", "Edit")
+
+# сколько последних задержек держать для p50/p99
+_LATENCY_WINDOW = 1024
+
+
+@contextmanager
+def prioritized(priority: Priority):
+    token = _PRIORITY.set(priority)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Забирает токен (возможно, «в долг») и возвращает, сколько ждать до него."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, now: float) -> bool:
+        """Забирает токен, только если он есть; в долг не уходит."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def pause(self, now: float, seconds: float) -> None:
+        """RetryAfter: ни одного токена ближайшие `seconds` секунд."""
+        self.tokens = min(self.tokens, 0.0) - seconds * self.rate
+        self.updated = now
+
+
+class _Job:
+    __slots__ = (
+        "priority", "seq", "chat_id", "make_request", "bot", "method",
+        "future", "enqueued_at", "reserved", "attempts",
+    )
+
+    def __init__(self, priority, seq, chat_id, make_request, bot, method, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.make_request = make_request
+        self.bot = bot
+        self.method = method
+        self.future = future
+        self.enqueued_at = monotonic()
+        self.reserved = False
+        self.attempts = 0
+
+    def __lt__(self, other: "_Job") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class Outbox(BaseRequestMiddleware):
+    def __init__(
+        self,
+        *,
+        global_rate: float = 30.0,
+        group_per_min: float = 20.0,
+        private_rate: float = 1.0,
+        concurrency: int = 8,
+        max_retries: int = 3,
+    ):
+        self.group_rate = group_per_min / 60.0
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = BoundedCache("outbox_chats", 50_000, ttl=600)
+        self._ready: list[_Job] = []
+        self._timed: list[tuple[float, _Job]] = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._slots = asyncio.Semaphore(concurrency)
+        self._runner: asyncio.Task | None = None
+        self._in_flight = 0
+        self._latencies: deque[float] = deque(maxlen=_LATENCY_WINDOW)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    # ---- middleware ----
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None or not type(method).__name__.startswith(_PACED_PREFIXES):
+            return await make_request(bot, method)
+
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.create_task(self.run())
+
+        future = asyncio.get_running_loop().create_future()
+        job = _Job(_PRIORITY.get(), next(self._seq), chat_id, make_request, bot, method, future)
+        self._push(job)
+        # в очереди к группе можно простоять минуты — слот апдейта пусть пока поработает на других
+        async with parked():
+            return await future
+
+    # ---- очередь ----
+
+    def _push(self, job: _Job) -> None:
+        heapq.heappush(self._ready, job)
+        self._wake.set()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # у групп/каналов id отрицательный, у личек — положительный
+            if isinstance(chat_id, str) or chat_id < 0:
+                bucket = TokenBucket(self.group_rate, 5)
+            else:
+                bucket = TokenBucket(self.private_rate, 3)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    async def _wait_for_work(self) -> None:
+        self._wake.clear()
+        timeout = self._timed[0][0] - monotonic() if self._timed else None
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self) -> None:
+        while True:
+            now = monotonic()
+            while self._timed and self._timed[0][0] <= now:
+                heapq.heappush(self._ready, heapq.heappop(self._timed)[1])
+
+            if not self._ready:
+                await self._wait_for_work()
+                continue
+
+            job = heapq.heappop(self._ready)
+            if job.future.done():  # вызывающий уже не ждёт (отмена)
+                continue
+            if not job.reserved:
+                job.reserved = True
+                delay = self._chat_bucket(job.chat_id).reserve(now)
+                if delay > 0:
+                    heapq.heappush(self._timed, (now + delay, job))
+                    continue
+
+            delay = self._global.reserve(now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._slots.acquire()
+            asyncio.create_task(self._execute(job))
+
+    async def _execute(self, job: _Job) -> None:
+        self._in_flight += 1
+        try:
+            result = await job.make_request(job.bot, job.method)
+        except TelegramRetryAfter as e:
+            if job.attempts < self.max_retries and not job.future.done():
+                job.attempts += 1
+                job.reserved = False
+                self.retried += 1
+                self._chat_bucket(job.chat_id).pause(monotonic(), e.retry_after)
+                self._push(job)
+            else:
+                self._finish(job, exc=e)
+        except Exception as e:
+            self._finish(job, exc=e)
+        else:
+            self._finish(job, result=result)
+        finally:
+            self._in_flight -= 1
+            self._slots.release()
+
+    def _finish(self, job: _Job, *, result=None, exc: Exception | None = None) -> None:
+        self._latencies.append(monotonic() - job.enqueued_at)
+        if exc is None:
+            self.sent += 1
+        else:
+            self.failed += 1
+        if job.future.done():
+            return
+        if exc is None:
+            job.future.set_result(result)
+        else:
+            job.future.set_exception(exc)
+
+    # ---- статистика ----
+
+    def depth(self) -> int:
+        return len(self._ready) + len(self._timed)
+
+    def pending(self) -> int:
+        """Запросы в очереди и в полёте — для ожидания при остановке."""
+        return self.depth() + self._in_flight
+
+    def stats(self) -> dict:
+        lat = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return lat[min(len(lat) - 1, int(p * len(lat)))] if lat else 0.0
+
+        return {
+            "queued": self.depth(),
+            "in_flight": self._in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "latency_p50": pct(0.50),
+            "latency_p99": pct(0.99),
+        }
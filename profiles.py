@@ -0,0 +1,143 @@
+"""
+Кэш профилей пользователей: id -> ник, имя, когда последний раз видели.
+
+Заполняется сам из каждого входящего апдейта (ProfileMiddleware), поэтому
+для тех, кто только что писал боту или нажал кнопку, ник известен без
+запроса getChat. Если профиль старше ttl или его нет вовсе, get() один раз
+спрашивает Telegram; одновременные запросы про один id ждут один и тот же
+вызов (singleflight). При ошибке отдаём то, что есть, пусть и устаревшее.
+
+Тем, кому ник нужен без ожидания (сводка дедлайнов), хватает peek() и
+want(): запрошенные id фоновый run() обновляет по одному за интервал,
+так что после рестарта getChat не уходит пачкой.
+"""
+import asyncio
+from time import time
+from typing import Awaitable, Callable
+
+from aiogram import BaseMiddleware
+from aiogram.types import Chat, User
+
+from cache import BoundedCache
+from logs import get_logger
+from metrics import Counter
+
+log = get_logger("profiles")
+
+PROFILE_LOOKUPS = Counter("profile_lookups", "Profile lookups by outcome", ("result",))
+
+# сколько id ждут фонового обновления; остальных попросят при следующей перерисовке
+_WANTED_MAX = 1000
+
+
+class Profile:
+    __slots__ = ("user_id", "username", "first_name", "seen_at")
+
+    def __init__(self, user_id: int, username: str | None, first_name: str | None, seen_at: float):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        # unix ts последнего апдейта от пользователя или запроса getChat
+        self.seen_at = seen_at
+
+    def __repr__(self) -> str:
+        return f"Profile({self.user_id}, username={self.username!r})"
+
+
+class ProfileCache:
+    def __init__(
+        self,
+        fetch: Callable[[int], Awaitable[Chat | User]],
+        *,
+        maxsize: int,
+        ttl: float,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._profiles = BoundedCache("profiles", maxsize)
+        self._inflight: dict[int, asyncio.Future] = {}
+        # очередь want() -> run(), по порядку запросов
+        self._wanted: dict[int, None] = {}
+        # getChat не удался (бот заблокирован, чат удалён): не спрашиваем снова до ttl
+        self._failed = BoundedCache("profile_failures", maxsize, ttl=ttl)
+
+    def observe(self, user: User | Chat) -> Profile:
+        """Запоминает пользователя из апдейта или ответа API."""
+        profile = self._profiles.get(user.id)
+        if profile is None:
+            profile = self._profiles[user.id] = Profile(user.id, user.username, user.first_name, time())
+        else:
+            profile.username = user.username
+            profile.first_name = user.first_name
+            profile.seen_at = time()
+        return profile
+
+    def peek(self, user_id: int) -> Profile | None:
+        """Только из кэша, без запросов — даже устаревший."""
+        return self._profiles.get(user_id)
+
+    def _fresh(self, profile: Profile | None) -> bool:
+        return profile is not None and time() - profile.seen_at <= self.ttl
+
+    def want(self, user_id: int) -> None:
+        """Просит обновить профиль в фоне, если его нет или он устарел."""
+        if self._fresh(self._profiles.get(user_id)) or user_id in self._wanted or user_id in self._failed:
+            return
+        if len(self._wanted) < _WANTED_MAX:
+            self._wanted[user_id] = None
+
+    async def run(self, interval: float, on_fetched: Callable[[], None]) -> None:
+        """Обновляет профили из want() по одному раз в interval секунд."""
+        while True:
+            await asyncio.sleep(interval)
+            if not self._wanted:
+                continue
+            user_id = next(iter(self._wanted))
+            del self._wanted[user_id]
+            profile = await self.get(user_id)
+            if self._fresh(profile):
+                on_fetched()
+            else:
+                self._failed[user_id] = True
+
+    async def get(self, user_id: int) -> Profile | None:
+        profile = self._profiles.get(user_id)
+        if self._fresh(profile):
+            PROFILE_LOOKUPS.inc(result="hit")
+            return profile
+
+        pending = self._inflight.get(user_id)
+        if pending is not None:
+            PROFILE_LOOKUPS.inc(result="joined")
+            return await asyncio.shield(pending)
+
+        PROFILE_LOOKUPS.inc(result="fetch")
+        pending = self._inflight[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            fresh = self.observe(await self.fetch(user_id))
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            log.info("Profile fetch failed: %s", e, extra={"user_id": user_id, "error": type(e).__name__})
+            fresh = profile
+        finally:
+            del self._inflight[user_id]
+        pending.set_result(fresh)
+        return fresh
+
+    def __len__(self) -> int:
+        return len(self._profiles)
+
+
+class ProfileMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: каждый апдейт обновляет профиль отправителя."""
+
+    def __init__(self, profiles: ProfileCache):
+        self.profiles = profiles
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None and not user.is_bot:
+            self.profiles.observe(user)
+        return await handler(event, data)
@@ -0,0 +1,172 @@
+"""
+Пересылка сообщений кандидат → группа и куратор → кандидат через copyMessage.
+
+Вместо пересборки каждого типа (send_photo / send_document / ...) копируем
+исходное сообщение и подменяем подпись: шапка + текст. Так одним вызовом
+уходит любой тип с подписью, а кружки, опросы, геопозиции, контакты,
+стикеры копируются как есть — шапка к ним идёт отдельным сообщением
+(подписи у них в Bot API нет).
+
+Форматирование исходного текста сохраняем: entities сдвигаются на длину
+шапки, parse_mode не используется.
+"""
+from aiogram import Bot
+from aiogram.enums import ContentType
+from aiogram.exceptions import TelegramAPIError, TelegramBadRequest
+from aiogram.types import Message, MessageEntity
+
+# лимиты Bot API, в UTF-16 символах
+CAPTION_LIMIT = 1024
+TEXT_LIMIT = 4096
+
+# типы, у которых можно подменить подпись при копировании
+CAPTIONED = frozenset({
+    ContentType.PHOTO,
+    ContentType.VIDEO,
+    ContentType.DOCUMENT,
+    ContentType.ANIMATION,
+    ContentType.AUDIO,
+    ContentType.VOICE,
+})
+
+
+# copyMessage не смог именно скопировать — такое сообщение стоит пересобрать вручную;
+# остальные ошибки (чат не найден, бот заблокирован) пересборка не исправит
+_COPY_FAILED_ERRORS = ("message to copy not found", "can't be copied")
+
+
+def is_copy_error(e: TelegramBadRequest) -> bool:
+    err = str(e).lower()
+    return any(x in err for x in _COPY_FAILED_ERRORS)
+
+
+def utf16_len(text: str) -> int:
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _shift(entities: list[MessageEntity] | None, offset: int) -> list[MessageEntity] | None:
+    if not entities:
+        return None
+    return [e.model_copy(update={"offset": e.offset + offset}) for e in entities]
+
+
+def compose(header: str, body: str = "", entities: list[MessageEntity] | None = None):
+    """Шапка + пустая строка + тело; entities тела сдвинуты под итоговый текст."""
+    if not body:
+        return header, None
+    return f"{header}\n\n{body}", _shift(entities, utf16_len(header) + 2)
+
+
+def _blocks(text: str, limit: int) -> list[str]:
+    """Текст кусками не длиннее limit: по строкам, слишком длинную строку — по символам."""
+    if utf16_len(text) <= limit:
+        return [text]
+    lines: list[str] = []
+    for line in text.split("\n"):
+        while utf16_len(line) > limit:
+            # символ — не больше двух единиц UTF-16
+            lines.append(line[:limit // 2])
+            line = line[limit // 2:]
+        lines.append(line)
+    blocks = [lines[0]]
+    for line in lines[1:]:
+        if utf16_len(blocks[-1]) + 1 + utf16_len(line) <= limit:
+            blocks[-1] += "\n" + line
+        else:
+            blocks.append(line)
+    return blocks
+
+
+def pack_messages(
+    header: str,
+    items: list[tuple[str, list[MessageEntity] | None]],
+    *,
+    limit: int = TEXT_LIMIT,
+) -> list[tuple[str, list[MessageEntity] | None]]:
+    """
+    Шапка и тексты подряд через пустую строку — в как можно меньше
+    сообщений не длиннее limit. Режем по границам текстов; entities
+    сдвигаются вместе с текстом. Текст, который целиком не влезает
+    в одно сообщение, режется по строкам и идёт без форматирования.
+    """
+    chunks: list[tuple[str, list[MessageEntity]]] = [(header, [])]
+    for text, entities in items:
+        blocks = _blocks(text, limit)
+        if len(blocks) > 1:
+            entities = None
+        for block in blocks:
+            current, current_entities = chunks[-1]
+            if utf16_len(current) + 2 + utf16_len(block) <= limit:
+                chunks[-1] = (f"{current}\n\n{block}", current_entities)
+                offset = utf16_len(current) + 2
+            else:
+                chunks.append((block, []))
+                offset = 0
+            chunks[-1][1].extend(_shift(entities, offset) or ())
+    return [(text, entities or None) for text, entities in chunks]
+
+
+async def copy_with_header(
+    bot: Bot,
+    src: Message,
+    chat_id: int,
+    header: str,
+    body: str = "",
+    entities: list[MessageEntity] | None = None,
+    *,
+    thread_id: int | None = None,
+) -> list[int]:
+    """
+    Доставляет src в chat_id с шапкой. Возвращает id всех отправленных
+    сообщений (1 или 2). Ошибки Bot API не глотает — вызывающий решает,
+    нужен ли запасной путь; отдельную шапку при неудачной копии удаляет,
+    чтобы запасной путь не оставил её дублем.
+    """
+    text, text_entities = compose(header, body, entities)
+    kwargs: dict = {}
+    if thread_id:
+        kwargs["message_thread_id"] = thread_id
+
+    if src.content_type == ContentType.TEXT:
+        sent = await bot.send_message(chat_id, text, entities=text_entities, parse_mode=None, **kwargs)
+        return [sent.message_id]
+
+    if src.content_type in CAPTIONED and utf16_len(text) <= CAPTION_LIMIT:
+        copied = await bot.copy_message(
+            chat_id, src.chat.id, src.message_id,
+            caption=text, caption_entities=text_entities, parse_mode=None, **kwargs,
+        )
+        return [copied.message_id]
+
+    # подписи нет или она не влезает: шапка отдельно, содержимое — копией без подписи
+    head = await bot.send_message(chat_id, text, entities=text_entities, parse_mode=None, **kwargs)
+    if src.content_type in CAPTIONED:
+        kwargs["caption"] = ""
+    try:
+        copied = await bot.copy_message(chat_id, src.chat.id, src.message_id, **kwargs)
+    except TelegramAPIError:
+        try:
+            await bot.delete_message(chat_id, head.message_id)
+        except TelegramAPIError:
+            pass
+        raise
+    return [head.message_id, copied.message_id]
+
+
+async def copy_many_with_header(
+    bot: Bot,
+    parts: list[Message],
+    chat_id: int,
+    header: str,
+    *,
+    thread_id: int | None = None,
+) -> list[int]:
+    """Шапка + copyMessages: пачка сообщений одного чата за два вызова, альбомы сохраняются."""
+    kwargs: dict = {}
+    if thread_id:
+        kwargs["message_thread_id"] = thread_id
+    head = await bot.send_message(chat_id, header, parse_mode=None, **kwargs)
+    copied = await bot.copy_messages(
+        chat_id, parts[0].chat.id, sorted(p.message_id for p in parts), **kwargs,
+    )
+    return [head.message_id] + [c.message_id for c in copied]
@@ -0,0 +1,125 @@
+"""
+Планировщик дедлайнов тестовых заданий.
+
+Одна задача asyncio на все выданные тесты: min-heap по времени срабатывания
+плюс словарь (user_id, role) -> unix-время дедлайна. Словарь — источник
+правды в памяти, а в Storage изменения только дублируются для перезапуска.
+Повторная выдача того же теста не плодит напоминаний, отмена — O(1)
+(запись в куче просто становится «мёртвой» и пропускается),
+просроченные за время простоя напоминания срабатывают сразу после старта.
+"""
+import asyncio
+import heapq
+import time
+from typing import Awaitable, Callable
+
+from logs import get_logger
+from storage import Codec, PersistentMap, Storage
+
+log = get_logger("scheduler")
+
+DEADLINE_KEY = Codec(lambda k: f"{k[0]}:{k[1]}", lambda s: (int(s.split(":", 1)[0]), s.split(":", 1)[1]))
+
+# не спим дольше часа за раз: переживаем перевод системных часов
+_MAX_SLEEP_SEC = 3600.0
+
+
+class DeadlineScheduler:
+    def __init__(
+        self,
+        storage: Storage,
+        on_due: Callable[[int, str, float], Awaitable[None]],
+        *,
+        ns: str = "deadlines",
+    ):
+        self.on_due = on_due
+        self._saved = PersistentMap(storage, ns, key_codec=DEADLINE_KEY, value_codec=Codec(repr, float))
+        # все дедлайны держим в памяти: их не больше, чем тестов «в работе»
+        self._saved.preload()
+        self._due: dict[tuple[int, str], float] = dict(self._saved.items())
+        # user_id -> роли с дедлайном: cancel(user_id) без обхода всех дедлайнов
+        self._roles: dict[int, set[str]] = {}
+        for uid, role in self._due:
+            self._roles.setdefault(uid, set()).add(role)
+        self._heap: list[tuple[float, int, str]] = []
+        self._compact()
+        self._wake = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def pending(self, user_id: int, role: str) -> float | None:
+        return self._due.get((user_id, role))
+
+    def users(self, role: str | None = None) -> list[int]:
+        """Пользователи с ещё не наступившим напоминанием (по роли или по любой)."""
+        return sorted({uid for uid, r in self._due if role is None or r == role})
+
+    def items(self, role: str) -> list[tuple[int, float]]:
+        """(user_id, дедлайн) по роли, ближайшие первыми."""
+        return sorted(((uid, due) for (uid, r), due in self._due.items() if r == role), key=lambda x: x[1])
+
+    def schedule(self, user_id: int, role: str, due_at: float) -> bool:
+        """
+        Ставит напоминание. Если для (user_id, role) оно уже есть —
+        ничего не меняет и возвращает False.
+        """
+        key = (user_id, role)
+        if key in self._due:
+            return False
+        self._due[key] = self._saved[key] = due_at
+        self._roles.setdefault(user_id, set()).add(role)
+        heapq.heappush(self._heap, (due_at, user_id, role))
+        if self._heap[0][0] == due_at:
+            self._wake.set()
+        return True
+
+    def cancel(self, user_id: int, role: str | None = None) -> int:
+        """Снимает напоминание по роли или, если role=None, все напоминания пользователя."""
+        roles = self._roles.get(user_id, ())
+        keys = [(user_id, r) for r in roles if role is None or r == role]
+        for key in keys:
+            self._forget(key)
+        if len(self._heap) > 2 * len(self._due) + 64:
+            self._compact()
+        return len(keys)
+
+    def _forget(self, key: tuple[int, str]) -> None:
+        del self._due[key]
+        del self._saved[key]
+        uid, role = key
+        roles = self._roles[uid]
+        roles.discard(role)
+        if not roles:
+            del self._roles[uid]
+
+    def _compact(self) -> None:
+        self._heap = [(due, uid, role) for (uid, role), due in self._due.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_due(self, now: float) -> list[tuple[int, str, float]]:
+        fired = []
+        while self._heap and self._heap[0][0] <= now:
+            due, uid, role = heapq.heappop(self._heap)
+            if self._due.get((uid, role)) != due:
+                continue  # отменено или переназначено
+            self._forget((uid, role))
+            fired.append((uid, role, due))
+        return fired
+
+    async def run(self) -> None:
+        while True:
+            for uid, role, due in self._pop_due(time.time()):
+                try:
+                    await self.on_due(uid, role, due)
+                except Exception as e:
+                    log.exception("Deadline callback failed: %s", e, extra={"user_id": uid, "role": role})
+
+            self._wake.clear()
+            delay = self._heap[0][0] - time.time() if self._heap else _MAX_SLEEP_SEC
+            if delay <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=min(delay, _MAX_SLEEP_SEC))
+            except asyncio.TimeoutError:
+                pass
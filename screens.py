@@ -0,0 +1,70 @@
+"""
+Реестр статических экранов: текст + клавиатура, собранные один раз.
+
+Экраны меню не зависят от пользователя, поэтому pydantic-разметку
+и её JSON строим при старте, а хендлеры только достают готовый экран
+по ключу. fingerprint — короткий хэш текста и разметки: по нему
+render_screen понимает, что на экране у пользователя уже то же самое.
+"""
+import hashlib
+import json
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+
+def keyboard(*rows: list[tuple[str, str]]) -> InlineKeyboardMarkup:
+    """keyboard([("Текст", "callback"), ...], ...) — ряды кнопок."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=text, callback_data=data) for text, data in row]
+        for row in rows
+    ])
+
+
+def markup_json(markup: InlineKeyboardMarkup | None) -> str:
+    if markup is None:
+        return ""
+    return json.dumps(markup.model_dump(exclude_none=True), ensure_ascii=False, separators=(",", ":"))
+
+
+def fingerprint(text: str, markup: InlineKeyboardMarkup | None = None, *, payload: str | None = None) -> bytes:
+    if payload is None:
+        payload = markup_json(markup)
+    h = hashlib.blake2b(digest_size=8)
+    h.update(text.encode())
+    h.update(b"\0")
+    h.update(payload.encode())
+    return h.digest()
+
+
+class Screen:
+    __slots__ = ("key", "text", "markup", "payload", "fingerprint")
+
+    def __init__(self, key: str, text: str, markup: InlineKeyboardMarkup | None = None):
+        self.key = key
+        self.text = text
+        self.markup = markup
+        self.payload = markup_json(markup)
+        self.fingerprint = fingerprint(text, payload=self.payload)
+
+
+class ScreenRegistry:
+    def __init__(self):
+        self._screens: dict[str, Screen] = {}
+
+    def add(self, key: str, text: str, markup: InlineKeyboardMarkup | None = None) -> Screen:
+        if key in self._screens:
+            raise ValueError(f"Screen {key!r} is already registered")
+        screen = self._screens[key] = Screen(key, text, markup)
+        return screen
+
+    def get(self, key: str) -> Screen | None:
+        return self._screens.get(key)
+
+    def __getitem__(self, key: str) -> Screen:
+        return self._screens[key]
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._screens
+
+    def __len__(self) -> int:
+        return len(self._screens)
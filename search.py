@@ -0,0 +1,252 @@
+"""
+Индекс пересланных кураторам сообщений кандидатов и поиск по нему.
+
+Каждое сообщение, ушедшее в группу, записывается в SQLite: кто, с какой
+ролью, когда, куда (chat_id / message_id / тема) и текст. По тексту —
+FTS5, по id, нику и роли — обычные индексы. Результаты идут от новых
+к старым, постранично.
+
+Запись — как в storage: add() только кладёт строку в буфер, в базу
+пачкой пишет flush() из отдельного потока. Поиск сначала сбрасывает
+буфер, так что только что пересланное тоже находится; сам запрос тоже
+идёт в потоке, чтобы FTS по большой базе не останавливал event loop.
+
+Раз в час run() удаляет сообщения старше retention_days и, если задан
+max_rows, самые старые сверх лимита — для :memory: это и есть предел памяти.
+"""
+import asyncio
+import re
+import sqlite3
+import threading
+from time import time
+from typing import NamedTuple
+
+from logs import get_logger
+
+log = get_logger("search")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS messages ("
+    " id INTEGER PRIMARY KEY,"
+    " chat_id INTEGER NOT NULL, message_id INTEGER NOT NULL, thread_id INTEGER,"
+    " user_id INTEGER NOT NULL, username TEXT, role TEXT,"
+    " ts REAL NOT NULL, text TEXT NOT NULL DEFAULT '')",
+    "CREATE INDEX IF NOT EXISTS messages_user ON messages (user_id)",
+    "CREATE INDEX IF NOT EXISTS messages_username ON messages (username COLLATE NOCASE)",
+    "CREATE INDEX IF NOT EXISTS messages_role ON messages (role)",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+    " text, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages BEGIN"
+    " INSERT INTO messages_fts (rowid, text) VALUES (new.id, new.text); END",
+    "CREATE TRIGGER IF NOT EXISTS messages_ad AFTER DELETE ON messages BEGIN"
+    " INSERT INTO messages_fts (messages_fts, rowid, text) VALUES ('delete', old.id, old.text); END",
+)
+
+_COLUMNS = "m.chat_id, m.message_id, m.thread_id, m.user_id, m.username, m.role, m.ts, m.text"
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+# раз в сколько секунд удалять старые сообщения
+_PRUNE_EVERY_SEC = 3600.0
+
+
+class Hit(NamedTuple):
+    chat_id: int
+    message_id: int
+    thread_id: int | None
+    user_id: int
+    username: str | None
+    role: str | None
+    ts: float
+    text: str
+
+
+class Query(NamedTuple):
+    user_id: int | None = None
+    username: str | None = None
+    role: str | None = None
+    words: tuple[str, ...] = ()
+
+    def __bool__(self) -> bool:
+        return bool(self.user_id or self.username or self.role or self.words)
+
+
+def parse_query(raw: str, roles: dict[str, str] | None = None) -> Query:
+    """
+    «id:123», просто число от 5 цифр — id кандидата; «@ник» — ник;
+    «role:editor» или название роли — роль; остальное — слова из текста
+    (целиком; «слово*» — всё, что начинается с «слово»).
+    roles — {ключ: название} для поиска роли по названию.
+    """
+    by_title = {title.lower(): key for key, title in (roles or {}).items()}
+    user_id = username = role = None
+    words: list[str] = []
+    for token in raw.split():
+        low = token.lower()
+        if low.startswith("id:") and low[3:].isdigit():
+            user_id = int(low[3:])
+        elif token.isdigit() and len(token) >= 5:
+            user_id = int(token)
+        elif token.startswith("@") and len(token) > 1:
+            username = token[1:]
+        elif low.startswith("role:"):
+            role = by_title.get(low[5:], low[5:])
+        elif roles and (low in roles or low in by_title):
+            role = low if low in roles else by_title[low]
+        else:
+            found = _WORD.findall(token)
+            if found and token.endswith("*"):
+                found[-1] += "*"
+            words.extend(found)
+    return Query(user_id, username, role, tuple(words))
+
+
+def _match_expr(words: tuple[str, ...]) -> str:
+    # слова в кавычках, чтобы спецсимволы FTS не мешали; «слово*» — поиск по префиксу
+    return " ".join(f'"{w[:-1]}"*' if w.endswith("*") else f'"{w}"' for w in words)
+
+
+class MessageIndex:
+    def __init__(self, path: str, *, retention_days: int, max_rows: int = 0):
+        """max_rows=0 — без лимита по числу строк."""
+        self.path = path
+        self.retention_days = retention_days
+        self.max_rows = max_rows
+        self._memory = path == ":memory:"
+        self._reader = self._connect(check_same_thread=False)
+        for stmt in _SCHEMA:
+            self._reader.execute(stmt)
+        # у :memory: своя база на каждое соединение — пишем через то же
+        self._writer = self._reader if self._memory else self._connect(check_same_thread=False)
+        self._write_lock = threading.Lock()
+        # одно соединение из разных потоков — только по очереди
+        self._read_lock = self._write_lock if self._memory else threading.Lock()
+        self._pending: list[tuple] = []
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, **kwargs)
+        if not self._memory:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def add(
+        self,
+        *,
+        chat_id: int,
+        message_id: int,
+        thread_id: int | None,
+        user_id: int,
+        username: str | None,
+        role: str | None,
+        ts: float,
+        text: str,
+    ) -> None:
+        self._pending.append((chat_id, message_id, thread_id, user_id, username, role, ts, text or ""))
+
+    def _write(self, rows: list[tuple]) -> None:
+        with self._write_lock:
+            cur = self._writer.cursor()
+            cur.execute("BEGIN")
+            try:
+                cur.executemany(
+                    "INSERT INTO messages (chat_id, message_id, thread_id, user_id, username, role, ts, text)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    async def flush(self) -> None:
+        if not self._pending:
+            return
+        rows, self._pending = self._pending, []
+        try:
+            await asyncio.to_thread(self._write, rows)
+        except Exception as e:
+            log.warning("Index write failed, will retry: %s", e, extra={"rows": len(rows)})
+            self._pending[:0] = rows
+
+    def prune(self, now: float | None = None) -> int:
+        """Удаляет сообщения старше retention_days и сверх max_rows; возвращает, сколько удалено."""
+        horizon = (time() if now is None else now) - self.retention_days * 86400
+        with self._write_lock:
+            removed = self._writer.execute("DELETE FROM messages WHERE ts < ?", (horizon,)).rowcount
+            if self.max_rows:
+                # id растут с каждой вставкой: старше всех — с самыми маленькими
+                removed += self._writer.execute(
+                    "DELETE FROM messages WHERE id <= (SELECT max(id) FROM messages) - ?", (self.max_rows,),
+                ).rowcount
+        return removed
+
+    async def run(self, interval: float) -> None:
+        last_prune = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            await self.flush()
+            if time() - last_prune < _PRUNE_EVERY_SEC:
+                continue
+            last_prune = time()
+            try:
+                removed = await asyncio.to_thread(self.prune)
+            except Exception as e:
+                log.warning("Index prune failed: %s", e)
+                continue
+            if removed:
+                log.info("Pruned old messages from the index", extra={"rows": removed})
+
+    async def search(self, query: Query, *, limit: int, offset: int = 0) -> list[Hit]:
+        """До limit совпадений начиная с offset, от новых к старым."""
+        await self.flush()
+        where: list[str] = []
+        args: list = []
+        if query.user_id:
+            where.append("m.user_id = ?")
+            args.append(query.user_id)
+        if query.username:
+            where.append("m.username = ? COLLATE NOCASE")
+            args.append(query.username)
+        if query.role:
+            where.append("m.role = ?")
+            args.append(query.role)
+
+        if query.words and (query.user_id or query.username):
+            # сообщений одного кандидата немного: идём по ним и проверяем каждое в FTS
+            sql = f"SELECT {_COLUMNS} FROM messages m WHERE 1"
+            where.append("EXISTS (SELECT 1 FROM messages_fts WHERE messages_fts MATCH ? AND rowid = m.id)")
+            args.append(_match_expr(query.words))
+            order = "m.id"
+        elif query.words:
+            # FTS отдаёт rowid по убыванию и останавливается на LIMIT
+            sql = (f"SELECT {_COLUMNS} FROM messages_fts f JOIN messages m ON m.id = f.rowid"
+                   " WHERE messages_fts MATCH ?")
+            args.insert(0, _match_expr(query.words))
+            order = "f.rowid"
+        else:
+            sql = f"SELECT {_COLUMNS} FROM messages m WHERE 1"
+            order = "m.id"
+        for cond in where:
+            sql += f" AND {cond}"
+        sql += f" ORDER BY {order} DESC LIMIT ? OFFSET ?"
+        args += [limit, offset]
+        rows = await asyncio.to_thread(self._query, sql, args)
+        return [Hit(*row) for row in rows]
+
+    def _query(self, sql: str, args: list) -> list[tuple]:
+        with self._read_lock:
+            return self._reader.execute(sql, args).fetchall()
+
+    def __len__(self) -> int:
+        return self._query("SELECT count(*) FROM messages", [])[0][0] + len(self._pending)
+
+    def close(self) -> None:
+        if self._pending:
+            rows, self._pending = self._pending, []
+            self._write(rows)
+        with self._write_lock:
+            if self._writer is not self._reader:
+                self._writer.close()
+        self._reader.close()
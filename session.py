@@ -0,0 +1,144 @@
+"""
+Состояние пользователя в диалоге с ботом.
+
+UserSession — запись со __slots__ вместо словаря из шести ключей:
+на десятках тысяч бывших кандидатов это в разы меньше памяти. Роль и шаг
+сценария хранятся маленькими int (Role, Flow), в хранилище запись
+пишется через struct — 36 байт вместо JSON.
+"""
+import json
+import struct
+from datetime import datetime
+from enum import IntEnum
+
+from storage import Codec
+
+
+class Role(IntEnum):
+    """Коды ролей; имя в нижнем регистре — ключ роли в ROLE_INFO."""
+    TRANSLATOR = 1
+    EDITOR = 2
+    CLEANER = 3
+    TYPESETTER = 4
+    GLUER = 5
+    CURATOR = 6
+    BETA = 7
+    TYPECHECK = 8
+
+    @property
+    def key(self) -> str:
+        return self.name.lower()
+
+    @classmethod
+    def from_key(cls, key: str | None) -> "Role | None":
+        try:
+            return cls[key.upper()] if key else None
+        except KeyError:
+            return None
+
+
+class Flow(IntEnum):
+    NONE = 0
+    APPLY = 1
+    VACANCIES = 2
+
+
+_FLAG_ACTIVE = 1
+_FLAG_DEADLINE = 2
+_FLAG_MSG = 4
+_FLAG_CHAT = 8
+_FLAG_FP = 16
+
+# версия, флаги, flow, role, deadline (unix ts), msg_id, chat_id, отпечаток экрана
+_PACK = struct.Struct("<BBBBdqq8s")
+_VERSION = 1
+
+
+class UserSession:
+    __slots__ = ("flow", "role", "deadline", "msg_id", "chat_id", "active", "screen_fp")
+
+    def __init__(
+        self,
+        *,
+        flow: Flow = Flow.NONE,
+        role: Role | None = None,
+        deadline: float | None = None,
+        msg_id: int | None = None,
+        chat_id: int | None = None,
+        active: bool = False,
+        screen_fp: bytes | None = None,
+    ):
+        self.flow = flow
+        self.role = role
+        # время выдачи тестового (unix ts)
+        self.deadline = deadline
+        # сообщение-«экран» с кнопками
+        self.msg_id = msg_id
+        self.chat_id = chat_id
+        self.active = active
+        self.screen_fp = screen_fp
+
+    @property
+    def role_key(self) -> str | None:
+        return self.role.key if self.role else None
+
+    def forget_screen(self) -> None:
+        self.msg_id = None
+        self.chat_id = None
+        self.screen_fp = None
+
+    def __repr__(self) -> str:
+        return (f"UserSession(flow={self.flow.name}, role={self.role_key}, active={self.active}, "
+                f"msg_id={self.msg_id}, chat_id={self.chat_id})")
+
+    # ---- хранение ----
+
+    def to_bytes(self) -> bytes:
+        flags = (
+            (_FLAG_ACTIVE if self.active else 0)
+            | (_FLAG_DEADLINE if self.deadline is not None else 0)
+            | (_FLAG_MSG if self.msg_id is not None else 0)
+            | (_FLAG_CHAT if self.chat_id is not None else 0)
+            | (_FLAG_FP if self.screen_fp else 0)
+        )
+        return _PACK.pack(
+            _VERSION, flags, self.flow, self.role or 0,
+            self.deadline or 0.0, self.msg_id or 0, self.chat_id or 0, self.screen_fp or b"",
+        )
+
+    @classmethod
+    def from_bytes(cls, raw: bytes) -> "UserSession":
+        _version, flags, flow, role, deadline, msg_id, chat_id, fp = _PACK.unpack(raw)
+        return cls(
+            flow=Flow(flow),
+            role=Role(role) if role else None,
+            deadline=deadline if flags & _FLAG_DEADLINE else None,
+            msg_id=msg_id if flags & _FLAG_MSG else None,
+            chat_id=chat_id if flags & _FLAG_CHAT else None,
+            active=bool(flags & _FLAG_ACTIVE),
+            screen_fp=fp if flags & _FLAG_FP else None,
+        )
+
+    @classmethod
+    def from_dict(cls, st: dict) -> "UserSession":
+        """Старый формат: JSON-словарь { flow, role, deadline, msg_id, chat_id, active }."""
+        deadline = st.get("deadline")
+        fp = st.get("screen_fp")
+        return cls(
+            flow=Flow[st["flow"].upper()] if st.get("flow") in ("apply", "vacancies") else Flow.NONE,
+            role=Role.from_key(st.get("role")),
+            deadline=datetime.fromisoformat(deadline).timestamp() if deadline else None,
+            msg_id=st.get("msg_id"),
+            chat_id=st.get("chat_id"),
+            active=bool(st.get("active", False)),
+            screen_fp=bytes.fromhex(fp) if fp else None,
+        )
+
+
+def _load_session(raw) -> UserSession:
+    if isinstance(raw, (bytes, bytearray, memoryview)) and raw[:1] != b"{":
+        return UserSession.from_bytes(bytes(raw))
+    return UserSession.from_dict(json.loads(raw))
+
+
+SESSION_VALUE = Codec(UserSession.to_bytes, _load_session)
@@ -0,0 +1,421 @@
+"""
+Хранилище состояния бота.
+
+Бэкенды:
+  * MemoryBackend — всё в памяти процесса (как было раньше, без сохранения);
+  * SQLiteBackend — файл SQLite в режиме WAL, запись пачками «в фоне».
+
+PersistentMap / PersistentSet ведут себя как обычные dict / set,
+но подгружают записи лениво — по ключу, при первом обращении, —
+а изменения копят и сбрасывают в бэкенд одной транзакцией раз в N секунд.
+
+Запись в пачке — (ns, ключ, значение или None для удаления, срок жизни).
+Срок — unix-время, после которого запись больше не нужна (None — вечная);
+такие записи бэкенд раз в час удаляет сам, даже если их никто не трогал.
+"""
+import asyncio
+import heapq
+import json
+import sqlite3
+import threading
+import time
+from collections.abc import MutableMapping, MutableSet
+from typing import Any, Callable, Iterator, NamedTuple
+
+from cache import BoundedCache
+from logs import get_logger
+
+log = get_logger("storage")
+
+# раз в сколько секунд удалять из бэкенда записи с истёкшим сроком
+_PURGE_EVERY_SEC = 3600.0
+
+# отрицательный кэш коллекции: сколько ключей «в хранилище нет» помнить и сколько секунд
+_MISSES_MAX = 10_000
+_MISSES_TTL_SEC = 3600.0
+
+
+class Codec(NamedTuple):
+    dump: Callable[[Any], Any]
+    load: Callable[[Any], Any]
+
+
+INT_KEY = Codec(str, int)
+PAIR_KEY = Codec(lambda k: f"{k[0]}:{k[1]}", lambda s: tuple(int(x) for x in s.split(":", 1)))
+STR_VALUE = Codec(str, str)
+JSON_VALUE = Codec(lambda v: json.dumps(v, ensure_ascii=False, separators=(",", ":")), json.loads)
+
+# маркер «ключ удалён, удаление ещё не записано»
+_ABSENT = object()
+# маркер «ключа нет в памяти, надо спросить хранилище»
+_MISSING = object()
+
+# ============ BACKENDS ============
+
+
+class MemoryBackend:
+    """Ничего не сохраняет между перезапусками — поведение «как раньше»."""
+
+    def __init__(self):
+        # ns -> ключ -> (значение, срок)
+        self._data: dict[str, dict[str, tuple[Any, float | None]]] = {}
+        # (срок, ns, ключ); после перезаписи старые элементы остаются и пропускаются в purge
+        self._expiry: list[tuple[float, str, str]] = []
+
+    def load(self, ns: str, key: str):
+        row = self._data.get(ns, {}).get(key)
+        return row[0] if row else None
+
+    def load_all(self, ns: str) -> list[tuple[str, Any]]:
+        return [(k, v) for k, (v, _) in self._data.get(ns, {}).items()]
+
+    def unstamped(self, ns: str) -> list[tuple[str, Any]]:
+        # в памяти всё записано этим же процессом, значит, со сроком
+        return []
+
+    def write(self, batch: list[tuple[str, str, Any, float | None]]) -> None:
+        for ns, key, value, expires_at in batch:
+            bucket = self._data.setdefault(ns, {})
+            if value is None:
+                bucket.pop(key, None)
+                continue
+            bucket[key] = (value, expires_at)
+            if expires_at is not None:
+                heapq.heappush(self._expiry, (expires_at, ns, key))
+
+    def purge(self, now: float) -> int:
+        removed = 0
+        while self._expiry and self._expiry[0][0] < now:
+            expires_at, ns, key = heapq.heappop(self._expiry)
+            bucket = self._data.get(ns, {})
+            row = bucket.get(key)
+            if row is not None and row[1] == expires_at:
+                del bucket[key]
+                removed += 1
+        return removed
+
+    def close(self) -> None:
+        pass
+
+
+class SQLiteBackend:
+    """
+    Одна таблица kv(ns, k, v, exp). Чтение — точечное по первичному ключу
+    из потока event loop, запись — пачкой в отдельном потоке через
+    собственное соединение (WAL позволяет читать во время записи).
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS kv ("
+        " ns TEXT NOT NULL, k TEXT NOT NULL, v BLOB, exp REAL,"
+        " PRIMARY KEY (ns, k)) WITHOUT ROWID"
+    )
+    _EXP_INDEX = "CREATE INDEX IF NOT EXISTS kv_exp ON kv (exp) WHERE exp IS NOT NULL"
+
+    def __init__(self, path: str):
+        self.path = path
+        self._reader = self._connect()
+        self._reader.execute(self._SCHEMA)
+        columns = {row[1] for row in self._reader.execute("PRAGMA table_info(kv)")}
+        if "exp" not in columns:
+            # файл от версии без сроков: срок таким строкам проставит Storage.stamp
+            self._reader.execute("ALTER TABLE kv ADD COLUMN exp REAL")
+        self._reader.execute(self._EXP_INDEX)
+        self._reader.commit()
+        self._writer = self._connect(check_same_thread=False)
+        self._write_lock = threading.Lock()
+
+    def _connect(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, isolation_level=None, **kwargs)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        return conn
+
+    def load(self, ns: str, key: str):
+        row = self._reader.execute("SELECT v FROM kv WHERE ns = ? AND k = ?", (ns, key)).fetchone()
+        return row[0] if row else None
+
+    def load_all(self, ns: str) -> list[tuple[str, Any]]:
+        return self._reader.execute("SELECT k, v FROM kv WHERE ns = ?", (ns,)).fetchall()
+
+    def unstamped(self, ns: str) -> list[tuple[str, Any]]:
+        return self._reader.execute("SELECT k, v FROM kv WHERE ns = ? AND exp IS NULL", (ns,)).fetchall()
+
+    def write(self, batch: list[tuple[str, str, Any, float | None]]) -> None:
+        upserts = [(ns, k, v, exp) for ns, k, v, exp in batch if v is not None]
+        deletes = [(ns, k) for ns, k, v, _ in batch if v is None]
+        with self._write_lock:
+            cur = self._writer.cursor()
+            cur.execute("BEGIN")
+            try:
+                if upserts:
+                    cur.executemany("INSERT OR REPLACE INTO kv (ns, k, v, exp) VALUES (?, ?, ?, ?)", upserts)
+                if deletes:
+                    cur.executemany("DELETE FROM kv WHERE ns = ? AND k = ?", deletes)
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    def purge(self, now: float) -> int:
+        with self._write_lock:
+            cur = self._writer.execute("DELETE FROM kv WHERE exp IS NOT NULL AND exp < ?", (now,))
+            return cur.rowcount
+
+    def close(self) -> None:
+        with self._write_lock:
+            self._writer.close()
+        self._reader.close()
+
+
+def make_backend(kind: str, path: str):
+    kind = (kind or "memory").lower()
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind == "memory":
+        return MemoryBackend()
+    raise RuntimeError(f"Unknown STORAGE_BACKEND: {kind}")
+
+# ============ STORAGE ============
+
+
+class Storage:
+    """
+    Координатор: знает все коллекции, собирает их «грязные» записи
+    и пишет в бэкенд одной пачкой (write-behind).
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._collections: list["PersistentMap"] = []
+        # пачка, которая пишется в другом потоке или ждёт повтора
+        self._inflight: dict[tuple[str, str], Any] = {}
+        # пачка, которую не удалось записать: повторим при следующем сбросе
+        self._retry: list[tuple[str, str, Any, float | None]] = []
+        self._flush_lock = asyncio.Lock()
+
+    def register(self, collection: "PersistentMap") -> None:
+        self._collections.append(collection)
+
+    def stamp(self, ns: str, expires_at: Callable[[Any], float]) -> int:
+        """Проставляет срок записям, сохранённым без него (файл от прошлой версии)."""
+        batch = [(ns, k, v, expires_at(v)) for k, v in self.backend.unstamped(ns)]
+        if batch:
+            self.backend.write(batch)
+            log.info("Stamped expiry on stored records", extra={"ns": ns, "records": len(batch)})
+        return len(batch)
+
+    def load(self, ns: str, key: str):
+        if (ns, key) in self._inflight:
+            return self._inflight[(ns, key)]
+        return self.backend.load(ns, key)
+
+    def load_all(self, ns: str) -> list[tuple[str, Any]]:
+        return self.backend.load_all(ns)
+
+    def _collect(self) -> list[tuple[str, str, Any, float | None]]:
+        batch, self._retry = self._retry, []
+        for col in self._collections:
+            batch.extend(col.drain_dirty())
+        return batch
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            batch = self._collect()
+            if not batch:
+                return 0
+            # пока пачка не записана, читаем её значения отсюда, а не из бэкенда
+            self._inflight = {(ns, k): v for ns, k, v, _ in batch}
+            try:
+                await asyncio.to_thread(self.backend.write, batch)
+            except Exception:
+                self._retry = batch
+                raise
+            self._inflight = {}
+            return len(batch)
+
+    def flush_sync(self) -> int:
+        batch = self._collect()
+        if batch:
+            self.backend.write(batch)
+        return len(batch)
+
+    async def purge(self) -> int:
+        """Удаляет из бэкенда записи с истёкшим сроком."""
+        removed = await asyncio.to_thread(self.backend.purge, time.time())
+        if removed:
+            log.info("Purged expired records", extra={"records": removed})
+        return removed
+
+    async def run(self, interval: float) -> None:
+        last_purge = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+                if time.monotonic() - last_purge >= _PURGE_EVERY_SEC:
+                    last_purge = time.monotonic()
+                    await self.purge()
+            except Exception as e:
+                log.exception("Storage flush failed: %s", e)
+
+    def close(self) -> None:
+        self.flush_sync()
+        self.backend.close()
+
+# ============ COLLECTIONS ============
+
+
+class PersistentMap(MutableMapping):
+    """
+    dict поверх Storage. Итерация и len() — только по уже загруженным
+    в память ключам: полный обход хранилища здесь никому не нужен.
+
+    mutable=True — значения меняются «на месте» (st.update(...)),
+    поэтому любое чтение помечает запись как изменённую.
+
+    cache — ограниченный кэш (cache.BoundedCache) вместо обычного dict
+    для записей в памяти: вытесненное лениво подгрузится из хранилища снова.
+
+    expires_at(value) -> unix-время, после которого запись можно удалить
+    из бэкенда, не дожидаясь del (например, created_at + TTL).
+    """
+
+    def __init__(
+        self,
+        storage: Storage,
+        ns: str,
+        *,
+        key_codec: Codec = INT_KEY,
+        value_codec: Codec = JSON_VALUE,
+        mutable: bool = False,
+        cache: MutableMapping | None = None,
+        expires_at: Callable[[Any], float] | None = None,
+    ):
+        self.storage = storage
+        self.ns = ns
+        self.key_codec = key_codec
+        self.value_codec = value_codec
+        self.mutable = mutable
+        self.expires_at = expires_at
+        self._mem: MutableMapping = {} if cache is None else cache
+        if cache is not None:
+            cache.on_evict = self._on_evict
+        self._dirty: set = set()
+        # ключи, которых нет в хранилище: отдельно и с лимитом, чтобы промахи не копились в _mem
+        self._misses = BoundedCache(f"{ns}_misses", _MISSES_MAX, ttl=_MISSES_TTL_SEC)
+        # вытесненные из памяти, но ещё не записанные: ключ -> (сериализованное значение, срок)
+        self._evicted: dict = {}
+        storage.register(self)
+        if expires_at is not None:
+            storage.stamp(ns, lambda raw: expires_at(value_codec.load(raw)))
+
+    def _row(self, value) -> tuple[Any, float | None]:
+        if value is _ABSENT:
+            return None, None
+        return self.value_codec.dump(value), None if self.expires_at is None else self.expires_at(value)
+
+    def _on_evict(self, key, value) -> None:
+        if key in self._dirty:
+            self._dirty.discard(key)
+            self._evicted[key] = self._row(value)
+
+    def _lookup(self, key):
+        value = self._mem.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        if key in self._misses:
+            return _ABSENT
+        if key in self._evicted:
+            raw = self._evicted[key][0]
+        else:
+            raw = self.storage.load(self.ns, self.key_codec.dump(key))
+        if raw is None:
+            self._misses[key] = True
+            return _ABSENT
+        value = self._mem[key] = self.value_codec.load(raw)
+        return value
+
+    def __getitem__(self, key):
+        value = self._lookup(key)
+        if value is _ABSENT:
+            raise KeyError(key)
+        if self.mutable:
+            self._dirty.add(key)
+        return value
+
+    def __setitem__(self, key, value) -> None:
+        self._mem[key] = value
+        self._misses.pop(key, None)
+        self._evicted.pop(key, None)
+        self._dirty.add(key)
+
+    def __delitem__(self, key) -> None:
+        if self._lookup(key) is _ABSENT:
+            raise KeyError(key)
+        self._mem[key] = _ABSENT
+        self._evicted.pop(key, None)
+        self._dirty.add(key)
+
+    def __contains__(self, key) -> bool:
+        return self._lookup(key) is not _ABSENT
+
+    def _loaded(self) -> list[tuple[Any, Any]]:
+        items = ((k, self._mem.get(k, _ABSENT)) for k in list(self._mem))
+        return [(k, v) for k, v in items if v is not _ABSENT]
+
+    def __iter__(self) -> Iterator:
+        return (k for k, _ in self._loaded())
+
+    def __len__(self) -> int:
+        return len(self._loaded())
+
+    def preload(self) -> None:
+        """Загружает в память весь namespace — только для небольших таблиц."""
+        for raw_key, raw in self.storage.load_all(self.ns):
+            key = self.key_codec.load(raw_key)
+            if key not in self._dirty:
+                self._mem[key] = self.value_codec.load(raw)
+
+    def drain_dirty(self) -> list[tuple[str, str, Any, float | None]]:
+        batch = []
+        for key in list(self._dirty):
+            value = self._mem.get(key, _MISSING)
+            if value is _MISSING:
+                continue  # только что протухло в кэше и уже лежит в self._evicted
+            batch.append((self.ns, self.key_codec.dump(key), *self._row(value)))
+            if value is _ABSENT:
+                # удаление уже в пачке: дальше ключ помнит только отрицательный кэш
+                del self._mem[key]
+                self._misses[key] = True
+        self._dirty.clear()
+        batch.extend((self.ns, self.key_codec.dump(k), *row) for k, row in self._evicted.items())
+        self._evicted.clear()
+        return batch
+
+
+class PersistentSet(MutableSet):
+    """set поверх PersistentMap: хранится только факт наличия ключа."""
+
+    def __init__(self, storage: Storage, ns: str, *, key_codec: Codec = INT_KEY, initial=()):
+        self._map = PersistentMap(storage, ns, key_codec=key_codec, value_codec=STR_VALUE)
+        for item in initial:
+            self.add(item)
+
+    def __contains__(self, item) -> bool:
+        return item in self._map
+
+    def __iter__(self) -> Iterator:
+        return iter(self._map)
+
+    def __len__(self) -> int:
+        return len(self._map)
+
+    def add(self, item) -> None:
+        if item not in self._map:
+            self._map[item] = "1"
+
+    def discard(self, item) -> None:
+        if item in self._map:
+            del self._map[item]
@@ -0,0 +1,134 @@
+"""
+HTTP-часть бота на aiohttp, на event loop бота, без отдельных потоков:
+
+  /healthz — процесс жив (для Render);
+  /readyz  — есть связь с Telegram и event loop не захлёбывается;
+  /metrics — метрики в формате Prometheus;
+
+и, в режиме MODE=webhook, приём апдейтов от Telegram.
+"""
+import asyncio
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from cache import BoundedCache
+from logs import get_logger
+from metrics import REGISTRY, Counter, Health
+
+log = get_logger("http")
+
+HEALTH_KEY = web.AppKey("health", Health)
+
+WEBHOOK_UPDATES = Counter("webhook_updates", "Webhook deliveries by outcome", ("result",))
+
+
+async def _healthz(request: web.Request) -> web.Response:
+    return web.Response(text="OK")
+
+
+async def _readyz(request: web.Request) -> web.Response:
+    ready, info = request.app[HEALTH_KEY].readiness()
+    return web.json_response(info, status=200 if ready else 503)
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+def build_app(health: Health) -> web.Application:
+    app = web.Application()
+    app[HEALTH_KEY] = health
+    # add_get заодно отвечает и на HEAD
+    app.router.add_get("/", _healthz)
+    app.router.add_get("/healthz", _healthz)
+    app.router.add_get("/readyz", _readyz)
+    app.router.add_get("/metrics", _metrics)
+    return app
+
+
+class LimitedRequestHandler(SimpleRequestHandler):
+    """
+    Отвечает Telegram сразу, а апдейты обрабатывает в фоне. Сколько их
+    выполняется одновременно, решает UpdateScheduler (UPDATE_CONCURRENCY):
+    он же отпускает слот, пока хендлер ждёт очередь отправки, — второй
+    семафор здесь держал бы слот всё это время. Держать ответ до свободного
+    слота нельзя: если хендлеры медленные, ответ опоздает к таймауту
+    вебхука и Telegram пришлёт тот же апдейт ещё раз. Повторная доставка всё равно возможна
+    (сеть, рестарт), поэтому недавние update_id помним и дубли отбрасываем.
+
+    Если в очереди уже max_backlog апдейтов, отвечаем 503: Telegram
+    повторит позже, а память бота не растёт.
+    """
+
+    def __init__(
+        self,
+        dispatcher: Dispatcher,
+        bot: Bot,
+        *,
+        max_backlog: int,
+        health: Health,
+        **kwargs,
+    ):
+        super().__init__(dispatcher, bot, handle_in_background=True, **kwargs)
+        self.max_backlog = max_backlog
+        self._health = health
+        self._seen = BoundedCache("webhook_updates", 10_000, ttl=3600)
+
+    def backlog(self) -> int:
+        """Принятые апдейты, которые ещё ждут своей очереди или обрабатываются."""
+        return len(self._background_feed_update_tasks)
+
+    async def close(self) -> None:
+        # сессию бота закрывает main() после дренажа, а не остановка HTTP-сервера
+        pass
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        # сюда попадаем только после проверки секрета
+        self._health.touch()
+        update = await request.json(loads=bot.session.json_loads)
+        update_id = update.get("update_id")
+        if update_id is not None:
+            if update_id in self._seen:
+                WEBHOOK_UPDATES.inc(result="duplicate")
+                return web.json_response({}, dumps=bot.session.json_dumps)
+        if self.backlog() >= self.max_backlog:
+            WEBHOOK_UPDATES.inc(result="rejected")
+            return web.Response(status=503, text="busy")
+        if update_id is not None:
+            self._seen[update_id] = True
+
+        WEBHOOK_UPDATES.inc(result="accepted")
+        task = asyncio.create_task(self._background_feed_update(bot=bot, update=update))
+        self._background_feed_update_tasks.add(task)
+        task.add_done_callback(self._background_feed_update_tasks.discard)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+
+def add_webhook(
+    app: web.Application,
+    dp: Dispatcher,
+    bot: Bot,
+    *,
+    path: str,
+    secret_token: str,
+    max_backlog: int,
+) -> LimitedRequestHandler:
+    handler = LimitedRequestHandler(
+        dp, bot,
+        secret_token=secret_token,
+        max_backlog=max_backlog,
+        health=app[HEALTH_KEY],
+    )
+    handler.register(app, path=path)
+    setup_application(app, dp, bot=bot)
+    return handler
+
+
+async def serve(app: web.Application, port: int) -> web.AppRunner:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    log.info("HTTP server on %s", port)
+    return runner